@@ -0,0 +1,259 @@
+import argparse
+import json
+import math
+import platform
+import statistics
+import sys
+import time
+import numpy as np
+
+from Environment import RobotEnv
+from KalmanFilter import KalmanFilter
+from MapGenerator import MapGenerator
+from OccupancyGrid import OccupancyGrid
+from Planner import Planner
+from Robot import Robot
+from Sensor import WallSensor
+from Simulation import Simulation, INITIAL_COVARIANCE, PROCESS_NOISE, MEASUREMENT_NOISE
+from Sweep import motor_script
+from Telemetry import BATCH_HEADER, encode_tick, decode_batch
+
+SEED = 1234
+MAP_SIZES = [100, 1000, 10000]           #walls of the generated maps of the map size dependent benchmarks
+LANDMARK_COUNTS = [5, 50, 500]           #measurements per Kalman filter update
+SHAPELY_MAX_WALLS = 1000                 #the shapely reference paths are only timed up to this map size
+
+# Description: Times one benchmark function. After warmup calls the number of calls per repeat is doubled until a
+# repeat takes at least min_time, then repeats such repeats are timed. Returns the time per call of every repeat
+def measure(function, warmup=3, repeats=7, min_time=0.05):
+    for _ in range(warmup):
+        function()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2
+    times = [elapsed / number]
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        times.append((time.perf_counter() - start) / number)
+    return times, number
+
+def summarize(times, number):
+    quartiles = statistics.quantiles(times, n=4) if len(times) > 1 else [times[0]] * 3
+    return {
+        'median': statistics.median(times),
+        'mean': statistics.fmean(times),
+        'min': min(times),
+        'max': max(times),
+        'stdev': statistics.stdev(times) if len(times) > 1 else 0.0,
+        'iqr': quartiles[2] - quartiles[0],
+        'repeats': len(times),
+        'calls_per_repeat': number,
+    }
+
+#Generated maze of about walls walls with a robot at a seeded collision free pose, sensors up to date
+def scenario(walls, seed=SEED):
+    map = MapGenerator(seed).generate('maze', walls)
+    env = RobotEnv(map=map, seed=seed)
+    env.reset()
+    return map, env.robot
+
+#Measurements of count landmarks around the current filter estimate, with the measurement noise added
+def landmark_measurements(kf, count, rng):
+    x, y, theta = kf.state
+    distances = rng.uniform(20, 200, count)
+    bearings = rng.uniform(-math.pi, math.pi, count)
+    features = np.column_stack((x + distances * np.cos(bearings + theta), y + distances * np.sin(bearings + theta)))
+    noise = rng.multivariate_normal([0, 0], MEASUREMENT_NOISE, count)
+    return [(d + n[0], b + n[1], (fx, fy)) for d, b, n, (fx, fy) in zip(distances, bearings, noise, features.tolist())]
+
+# Description: Function for a benchmark that changes the state of owner (a Robot or filter with snapshot/restore),
+# every call restores the state at creation and then calls function ticks times. measure calls it a timing dependent
+# number of times, so every call has to do the same work for results to compare between runs
+def from_snapshot(owner, function, ticks=1):
+    start = owner.snapshot()
+    def call():
+        owner.restore(start)
+        for _ in range(ticks):
+            function()
+    return call
+
+# Micro benchmarks, each yields (name, function) for every size
+def wall_sensor_benchmarks():
+    for walls in MAP_SIZES:
+        map, robot = scenario(walls)
+        sensors = robot.wall_sensors
+        yield 'WallSensor.check_intersect_all/%d' % walls, lambda: WallSensor.check_intersect_all(sensors, map.segments)
+        yield 'Robot.update_sensors/%d' % walls, lambda: robot.update_sensors(map.segments, map.index)
+        if len(map.walls) <= SHAPELY_MAX_WALLS:
+            walls_list = list(map.walls)
+            yield 'WallSensor.check_intersect/%d' % walls, lambda: [sensor.check_intersect(walls_list) for sensor in sensors]
+
+def feature_sensor_benchmarks():
+    for walls in MAP_SIZES:
+        map, robot = scenario(walls)
+        sensor = robot.feature_sensor
+        yield 'FeatureSensor.sense_features/%d' % walls, lambda: sensor.sense_features(map.walls, map.features, map.index)
+        if len(map.walls) <= SHAPELY_MAX_WALLS:
+            yield 'FeatureSensor.sense_features_shapely/%d' % walls, lambda: sensor.sense_features(map.walls, map.features)
+
+def robot_update_benchmarks():
+    for walls in MAP_SIZES:
+        map, robot = scenario(walls)
+        robot.set_motors(robot.power, robot.power * 0.9)      #drives into walls and slides along them
+        #one simulated second from the same pose per call, the restore is small against 60 ticks
+        yield 'Robot.update_60/%d' % walls, from_snapshot(robot, lambda: robot.update(1/60, map.segments, map.index), 60)
+
+def extract_features_benchmarks():
+    for walls in MAP_SIZES + [100000]:
+        map = MapGenerator(SEED).generate('polygons', walls)
+        yield 'Map.extract_features/%d' % walls, map.extract_features
+
+def kalman_filter_benchmarks():
+    rng = np.random.default_rng(SEED)
+    kf = KalmanFilter([400.0, 400.0, 0.0], INITIAL_COVARIANCE, PROCESS_NOISE / 60, MEASUREMENT_NOISE, None, None)
+    control_input = np.array([100, 0.5])
+    yield 'KalmanFilter.predict_60', from_snapshot(kf, lambda: kf.predict(control_input, 1/60), 60)
+    for count in LANDMARK_COUNTS:
+        for joint_update in (False, True):
+            filter = KalmanFilter([400.0, 400.0, 0.0], INITIAL_COVARIANCE, PROCESS_NOISE / 60, MEASUREMENT_NOISE, None, None, joint_update)
+            measurements = landmark_measurements(filter, count, rng)
+            name = 'KalmanFilter.update_joint' if joint_update else 'KalmanFilter.update'
+            yield '%s/%d' % (name, count), from_snapshot(filter, lambda filter=filter, measurements=measurements: filter.update(measurements))
+
+def occupancy_grid_benchmarks():
+    map, robot = scenario(1000)
+    grid = OccupancyGrid(map.width, map.height)
+    yield 'OccupancyGrid.integrate_robot', lambda: grid.integrate_robot(robot)
+    #the beams of 1000 ticks at random poses, as integrate_recording hands them over
+    rng = np.random.default_rng(SEED)
+    poses = np.column_stack((rng.uniform(0, map.width, 1000), rng.uniform(0, map.height, 1000), rng.uniform(0, 2 * math.pi, 1000)))
+    distances = rng.uniform(0, 100, (1000, 12))
+    beams = OccupancyGrid.sensor_beams(poses, distances, np.radians(np.arange(12) * 30), robot.radius, 120)
+    yield 'OccupancyGrid.integrate_beams/12000', lambda: grid.integrate_beams(*beams)
+
+def planner_benchmarks():
+    for walls in MAP_SIZES[:2]:
+        map, robot = scenario(walls)
+        planner = Planner(map, robot.radius)
+        goal = (map.width - 70, map.height - 70)
+        #a new goal each call is a full A* search, the same goal again follows the cached cost-to-goal tree
+        yield 'Planner.plan/%d' % walls, lambda: (setattr(planner, 'goal_links', None), planner.plan((robot.x, robot.y), goal))
+        yield 'Planner.replan/%d' % walls, lambda: planner.plan((robot.x, robot.y), goal)
+
+def telemetry_benchmarks():
+    simulation = Simulation.create(seed=SEED)
+    simulation.run_script(motor_script(SEED, 1))
+    #the per tick cost in the simulation loop while a viewer is connected, and the viewer side of a default batch
+    yield 'Telemetry.encode_tick', lambda: encode_tick(simulation)
+    batch = BATCH_HEADER.pack(32) + encode_tick(simulation) * 32
+    yield 'Telemetry.decode_batch/32', lambda: decode_batch(batch)
+
+# Macro benchmarks, a full headless episode of 10 simulated seconds per call
+def episode_benchmarks():
+    def default_episode():
+        simulation = Simulation.create(seed=SEED)
+        simulation.run_script(motor_script(SEED, 10))
+    yield 'episode/default', default_episode
+
+    for walls in MAP_SIZES:
+        map, robot = scenario(walls)
+        def episode(map=map, x=robot.x, y=robot.y, orientation=robot.orientation):
+            robot = Robot(x, y, 100)
+            robot.orientation = orientation
+            kf = KalmanFilter([x, y, orientation], INITIAL_COVARIANCE, PROCESS_NOISE / 60, MEASUREMENT_NOISE, robot, map)
+            Simulation(map, robot, kf).run_script(motor_script(SEED, 10))
+        yield 'episode/maze/%d' % walls, episode
+
+MICRO = [wall_sensor_benchmarks, feature_sensor_benchmarks, robot_update_benchmarks, extract_features_benchmarks, kalman_filter_benchmarks,
+         occupancy_grid_benchmarks, planner_benchmarks, telemetry_benchmarks]
+MACRO = [episode_benchmarks]
+
+# Description: Runs the micro and/or macro benchmarks whose name contains pattern, returns the results document
+def run(pattern='', micro=True, macro=True, warmup=3, repeats=7, min_time=0.05, verbose=True):
+    groups = (MICRO if micro else []) + (MACRO if macro else [])
+    results = {}
+    for group in groups:
+        for name, function in group():
+            if pattern not in name:
+                continue
+            #the macro benchmarks are long already, one warm-up and single calls
+            if group in MACRO:
+                times, number = measure(function, 1, max(repeats // 2, 3), 0)
+            else:
+                times, number = measure(function, warmup, repeats, min_time)
+            results[name] = summarize(times, number)
+            if verbose:
+                print("%-48s %12s ± %s" % (name, format_time(results[name]['median']), format_time(results[name]['iqr'])))
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'seed': SEED,
+        'results': results,
+    }
+
+def format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('µs', 1e-6)):
+        if seconds >= scale:
+            return "%.3f %s" % (seconds / scale, unit)
+    return "%.1f ns" % (seconds / 1e-9)
+
+# Description: Compares the medians of two results documents. A benchmark regressed when its median grew by more
+# than threshold (relative) and by more than its spread in both runs, returns [(name, baseline, current, ratio, status)]
+def compare(baseline, current, threshold=0.1):
+    rows = []
+    for name, result in current['results'].items():
+        if name not in baseline['results']:
+            rows.append((name, None, result['median'], None, 'new'))
+            continue
+        base = baseline['results'][name]
+        ratio = result['median'] / base['median']
+        noise = (base['iqr'] + result['iqr']) / base['median']
+        if ratio > 1 + max(threshold, noise):
+            status = 'slower'
+        elif ratio < 1 - max(threshold, noise):
+            status = 'faster'
+        else:
+            status = 'same'
+        rows.append((name, base['median'], result['median'], ratio, status))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Micro and macro benchmarks of the simulation, sensors and filter")
+    parser.add_argument('--filter', default='', help="only benchmarks whose name contains this text")
+    parser.add_argument('--micro', action='store_true', help="only the micro benchmarks")
+    parser.add_argument('--macro', action='store_true', help="only the macro benchmarks")
+    parser.add_argument('--repeats', type=int, default=7)
+    parser.add_argument('--save', help="write the results to this JSON file, e.g. as a new baseline")
+    parser.add_argument('--compare', help="baseline JSON file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.1, help="relative slowdown reported as regression")
+    args = parser.parse_args()
+
+    both = not args.micro and not args.macro
+    document = run(args.filter, args.micro or both, args.macro or both, repeats=args.repeats)
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(document, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        rows = compare(baseline, document, args.threshold)
+        print()
+        for name, base, current, ratio, status in rows:
+            if ratio is None:
+                print("%-48s %12s %12s %8s  %s" % (name, "", format_time(current), "", status))
+            else:
+                print("%-48s %12s %12s %7.2fx  %s" % (name, format_time(base), format_time(current), ratio, status))
+        if any(status == 'slower' for *_, status in rows):
+            sys.exit(1)
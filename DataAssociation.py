@@ -0,0 +1,269 @@
+import math
+import numpy as np
+
+from SpatialIndex import KDTree
+
+#Association results besides a landmark number
+NEW_LANDMARK = -1       #far from every landmark, a SLAMFilter adds it as a new landmark
+UNMATCHED = -2          #no compatible landmark but too close to one to be a new landmark, the observation is dropped
+
+# Description: Threshold the squared Mahalanobis distance of a dof-dimensional Gaussian stays below with the given
+# probability, the chi-squared quantile. dof is even here (two per observation), where the distribution function
+# has the closed form 1 - e^(-x/2) Σ_{i<dof/2} (x/2)^i / i!, inverted by bisection
+def chi2_quantile(dof, probability):
+    def cdf(x):
+        term, total = 1.0, 1.0
+        for i in range(1, dof // 2):
+            term *= x / 2 / i
+            total += term
+        return 1 - math.exp(-x / 2) * total
+
+    low, high = 0.0, 2.0 * dof + 10
+    while cdf(high) < probability:
+        high *= 2
+    for _ in range(60):
+        middle = (low + high) / 2
+        if cdf(middle) < probability:
+            low = middle
+        else:
+            high = middle
+    return high
+
+
+class DataAssociation:
+    # Description: Matches range/bearing observations without identity to landmarks, between the feature sensor and
+    # the filter update. Candidates come from a KD-tree radius query around the position the observation puts the
+    # landmark at, so a query costs O(log n) in the number of landmarks. Each candidate is gated on the squared
+    # Mahalanobis distance of its innovation, with the robot and landmark uncertainty of the filter.
+    # mode 'nn' pairs every observation with its nearest compatible landmark (closest pairs first, each landmark once),
+    # mode 'jcbb' searches the largest set of pairings that is jointly compatible (joint compatibility branch and
+    # bound), which rejects pairings that only fit individually, e.g. with a large pose error in cluttered areas.
+    # With landmarks (an (n, 2) array, e.g. Map.feature_coords) the map is known and fixed, without them the
+    # landmarks and their covariances are read from a SLAMFilter and the tree follows them as they move.
+
+    def __init__(self, measurement_noise, mode='nn', gate=0.99, new_landmark_gate=0.999, landmarks=None, rebuild_distance=5.0):
+        if mode not in ('nn', 'jcbb'):
+            raise ValueError("unknown association mode " + repr(mode) + ", expected 'nn' or 'jcbb'")
+        self.measurement_noise = np.asarray(measurement_noise, dtype=float)
+        self.mode = mode
+        self.gate = gate
+        self.gate_threshold = chi2_quantile(2, gate)
+        self.new_landmark_threshold = chi2_quantile(2, new_landmark_gate)
+        self.joint_thresholds = {}      #pairings -> chi2_quantile(2 * pairings, gate)
+        self.rebuild_distance = rebuild_distance    #landmark movement after which the tree of a SLAMFilter is rebuilt
+
+        self.fixed = landmarks is not None
+        self.tree = None
+        self.tree_positions = np.zeros((0, 2))
+        if self.fixed:
+            self.tree_positions = np.asarray(landmarks, dtype=float).reshape(-1, 2)
+            self.tree = KDTree(self.tree_positions)
+
+    #Landmark positions of the filter, for a known map the fixed ones
+    def landmark_positions(self, filter):
+        return self.tree_positions if self.fixed else filter.landmarks
+
+    #Sub-covariance of the robot and the given landmarks, in the column order [robot, landmark 1, landmark 2, ...]
+    #The landmarks of a known map are exact, only the robot block is nonzero
+    def covariance_of(self, filter, ids):
+        P = filter.covariance
+        if self.fixed:
+            covariance = np.zeros((3 + 2 * len(ids), 3 + 2 * len(ids)))
+            covariance[:3, :3] = P[:3, :3]
+            return covariance
+        columns = np.concatenate(([0, 1, 2], np.column_stack((3 + 2 * np.asarray(ids), 4 + 2 * np.asarray(ids))).ravel()))
+        return P[np.ix_(columns, columns)].copy()
+
+    #Tree over the current landmark positions; a SLAMFilter tree is rebuilt when landmarks were added or moved far.
+    #Returns the distance the landmarks moved since the build, queries widen their radius by it
+    def update_tree(self, positions):
+        if self.fixed:
+            return 0.0
+        if self.tree is None or len(positions) != len(self.tree_positions):
+            moved = math.inf
+        else:
+            moved = float(np.sqrt(np.max(np.sum((positions - self.tree_positions)**2, axis=1)))) if len(positions) else 0.0
+        if moved > self.rebuild_distance:
+            self.tree_positions = positions.copy()
+            self.tree = KDTree(self.tree_positions)
+            moved = 0.0
+        return moved
+
+    # Description: Innovations, Jacobians and innovation covariances of observation/landmark pairs - (k, 2), (k, 2, 3),
+    # (k, 2, 2). Landmark Jacobians are minus the position columns of the robot Jacobian
+    def innovations(self, filter, observations, landmark_ids):
+        x, y, theta = filter.state[:3]
+        landmarks = self.landmark_positions(filter)[landmark_ids]
+        dx = landmarks[:, 0] - x
+        dy = landmarks[:, 1] - y
+        d_squared = dx**2 + dy**2
+        d = np.sqrt(d_squared)
+
+        nu = observations - np.column_stack((d, np.arctan2(dy, dx) - theta))
+        nu[:, 1] = (nu[:, 1] + np.pi) % (2 * np.pi) - np.pi
+
+        H = np.zeros((len(landmark_ids), 2, 3))
+        H[:, 0, 0] = -dx / d
+        H[:, 0, 1] = -dy / d
+        H[:, 1, 0] = dy / d_squared
+        H[:, 1, 1] = -dx / d_squared
+        H[:, 1, 2] = -1
+
+        P = filter.covariance
+        S = H @ P[:3, :3] @ H.transpose(0, 2, 1) + self.measurement_noise
+        if not self.fixed:
+            #landmark terms H_l P_ll H_l^T + H_r P_rl H_l^T + (H_r P_rl H_l^T)^T, with H_l = -H_r[:, :, :2]
+            H_l = -H[:, :, :2]
+            rows = 3 + 2 * np.asarray(landmark_ids)
+            P_rl = np.stack((P[:3, rows], P[:3, rows + 1]), axis=2).transpose(1, 0, 2)    # (k, 3, 2)
+            P_ll = np.stack((np.stack((P[rows, rows], P[rows, rows + 1]), axis=1),
+                             np.stack((P[rows + 1, rows], P[rows + 1, rows + 1]), axis=1)), axis=1)
+            cross = H @ P_rl @ H_l.transpose(0, 2, 1)
+            S = S + H_l @ P_ll @ H_l.transpose(0, 2, 1) + cross + cross.transpose(0, 2, 1)
+        return nu, H, S
+
+    # Description: Landmark number, NEW_LANDMARK or UNMATCHED for every observation [(distance, bearing)]
+    def associate(self, observations, filter):
+        observations = np.array([(distance, bearing) for distance, bearing, *_ in observations], dtype=float).reshape(-1, 2)
+        result = [NEW_LANDMARK] * len(observations)
+        positions = self.landmark_positions(filter)
+        if len(observations) == 0 or len(positions) == 0:
+            return result
+        moved = self.update_tree(positions)
+
+        # search radius around the observed position: the new landmark gate scaled by the largest standard deviation
+        # of the observed position (robot pose and measurement noise) plus the largest landmark standard deviation
+        x, y, theta = filter.state[:3]
+        P_rr = filter.covariance[:3, :3]
+        angles = theta + observations[:, 1]
+        c, s = np.cos(angles), np.sin(angles)
+        distances = observations[:, 0]
+        G_r = np.zeros((len(observations), 2, 3))
+        G_r[:, 0, 0] = G_r[:, 1, 1] = 1
+        G_r[:, 0, 2] = -distances * s
+        G_r[:, 1, 2] = distances * c
+        G_z = np.stack((np.column_stack((c, -distances * s)), np.column_stack((s, distances * c))), axis=1)
+        spread = G_r @ P_rr @ G_r.transpose(0, 2, 1) + G_z @ self.measurement_noise @ G_z.transpose(0, 2, 1)
+        sigma = np.sqrt(np.trace(spread, axis1=1, axis2=2))
+        if not self.fixed:
+            variances = np.diagonal(filter.covariance)[3:]
+            sigma = sigma + math.sqrt(np.max(variances[0::2] + variances[1::2]))
+        radii = math.sqrt(self.new_landmark_threshold) * sigma + moved
+
+        observation_ids, landmark_ids = [], []
+        for i, (px, py, radius) in enumerate(zip((x + distances * c).tolist(), (y + distances * s).tolist(), radii.tolist())):
+            ids = self.tree.within(px, py, radius)
+            observation_ids.extend([i] * len(ids))
+            landmark_ids.extend(ids.tolist())
+        if not landmark_ids:
+            return result
+
+        observation_ids = np.array(observation_ids)
+        landmark_ids = np.array(landmark_ids)
+        nu, H, S = self.innovations(filter, observations[observation_ids], landmark_ids)
+        mahalanobis = np.einsum('ki,ki->k', nu, np.linalg.solve(S, nu[:, :, np.newaxis])[:, :, 0])
+
+        for i in np.unique(observation_ids[mahalanobis <= self.new_landmark_threshold]).tolist():
+            result[i] = UNMATCHED
+        compatible = mahalanobis <= self.gate_threshold
+        pairs = sorted(zip(mahalanobis[compatible].tolist(), observation_ids[compatible].tolist(), landmark_ids[compatible].tolist()))
+        if self.mode == 'nn':
+            used = set()
+            for _, i, j in pairs:
+                if result[i] < 0 and j not in used:
+                    result[i] = j
+                    used.add(j)
+        else:
+            for i, j in self.jcbb(filter, observations, [(i, j) for _, i, j in pairs]).items():
+                result[i] = j
+        return result
+
+    # Description: Joint compatibility branch and bound over the individually compatible (observation, landmark) pairs,
+    # closest first. Returns the hypothesis {observation: landmark} with the most pairings that is jointly compatible,
+    # the smallest joint Mahalanobis distance among those. Branches that cannot reach the most pairings found so far
+    # are cut, and after max_nodes joint tests the best hypothesis so far is returned, which bounds the search when
+    # many observations are ambiguous.
+    # The innovation covariance of all pairs is built once, a joint test then extends the factorization of the
+    # hypothesis by one pair through its Schur complement, O(m²) for m pairings instead of a new O(m³) solve
+    def jcbb(self, filter, observations, pairs, max_nodes=2000):
+        if not pairs:
+            return {}
+        pair_observations = np.array([i for i, _ in pairs])
+        pair_landmarks = np.array([j for _, j in pairs])
+        nu, H_r, _ = self.innovations(filter, observations[pair_observations], pair_landmarks)
+
+        #Jacobian of all pairs over [robot, landmarks of the pairs], landmark blocks are minus the robot position blocks
+        landmarks, columns = np.unique(pair_landmarks, return_inverse=True)
+        count = len(pairs)
+        H = np.zeros((count, 2, 3 + 2 * len(landmarks)))
+        H[:, :, :3] = H_r
+        rows = np.arange(count)
+        H[rows, :, 3 + 2 * columns] = -H_r[:, :, 0]
+        H[rows, :, 4 + 2 * columns] = -H_r[:, :, 1]
+        H = H.reshape(2 * count, -1)
+        S = H @ self.covariance_of(filter, landmarks) @ H.T + np.kron(np.eye(count), self.measurement_noise)
+
+        candidates = {}
+        for p, i in enumerate(pair_observations.tolist()):
+            candidates.setdefault(i, []).append(p)
+        order = list(candidates)
+        best = [[], math.inf]
+        tests = [0]
+
+        #chosen: pair numbers of the hypothesis, L_inv the inverse Cholesky factor of their joint innovation covariance
+        #and y = L_inv nu the whitened joint innovation, so the joint distance is y·y. Extending the factor keeps the
+        #test numerically stable, an updated inverse of the covariance itself loses precision with every pairing
+        def search(depth, chosen, used, L_inv, y):
+            distance = float(y @ y)
+            if depth == len(order):
+                if len(chosen) > len(best[0]) or (len(chosen) == len(best[0]) and distance < best[1]):
+                    best[0], best[1] = list(chosen), distance
+                return
+            remaining = len(order) - depth - 1
+            rows = np.array([2 * q + k for q in chosen for k in (0, 1)], dtype=np.int64)
+            for p in candidates[order[depth]]:
+                if tests[0] >= max_nodes or len(chosen) + 1 + remaining < len(best[0]):
+                    break
+                if pair_landmarks[p] in used:
+                    continue
+                tests[0] += 1
+                b = L_inv @ S[rows, 2 * p:2 * p + 2]
+                E_inv = np.linalg.inv(np.linalg.cholesky(S[2 * p:2 * p + 2, 2 * p:2 * p + 2] - b.T @ b))
+                r = E_inv @ (nu[p] - b.T @ y)
+                if distance + float(r @ r) <= self.joint_threshold(len(chosen) + 1):
+                    extended = np.zeros((len(rows) + 2, len(rows) + 2))
+                    extended[:-2, :-2] = L_inv
+                    extended[-2:, :-2] = -E_inv @ b.T @ L_inv
+                    extended[-2:, -2:] = E_inv
+                    used.add(pair_landmarks[p])
+                    search(depth + 1, chosen + [p], used, extended, np.concatenate((y, r)))
+                    used.discard(pair_landmarks[p])
+            #leaving the observation unpaired only pays off if the remaining observations can still beat the best
+            if len(chosen) + remaining > len(best[0]) or not best[0]:
+                search(depth + 1, chosen, used, L_inv, y)
+
+        search(0, [], set(), np.zeros((0, 0)), np.zeros(0))
+        return {int(pair_observations[p]): int(pair_landmarks[p]) for p in best[0]}
+
+    def joint_threshold(self, pairings):
+        if pairings not in self.joint_thresholds:
+            self.joint_thresholds[pairings] = chi2_quantile(2 * pairings, self.gate)
+        return self.joint_thresholds[pairings]
+
+    # Description: Associated measurements in the format of the filter update. For a known map [(distance, bearing,
+    # (x, y))] with the landmark position, for a SLAMFilter [(distance, bearing, key)] with the key of the landmark,
+    # or for a new landmark its observed position as key. UNMATCHED observations are left out
+    def measurements(self, observations, filter):
+        observations = list(observations)
+        matches = self.associate(observations, filter)
+        x, y, theta = filter.state[:3]
+        measurements = []
+        for (distance, bearing, *_), j in zip(observations, matches):
+            if j >= 0:
+                key = tuple(self.tree_positions[j].tolist()) if self.fixed else filter.landmark_keys[j]
+            elif j == NEW_LANDMARK and not self.fixed:
+                key = (float(x + distance * math.cos(theta + bearing)), float(y + distance * math.sin(theta + bearing)))
+            else:
+                continue
+            measurements.append((distance, bearing, key))
+        return measurements
@@ -0,0 +1,186 @@
+import math
+import random
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+
+import Geometry
+from Robot import Robot
+from Map import Map
+
+class RobotEnv:
+    # Description: reset/step environment around the robot, map and wall sensors for controller learning
+    # Observations are the 12 wall sensor distances followed by the pose (x, y, orientation),
+    # actions are the left and right motor speeds, an episode ends on Robot.is_collision or after max_steps
+
+    observation_size = 15
+    action_size = 2
+
+    def __init__(self, width=800, height=800, power=100, dt=1/60, max_steps=1000, seed=None, map=None):
+        if map is None:
+            map = Map(width, height)
+            map.populate_map(width, height)
+            map.extract_features()
+        self.map = map
+        self.power = power
+        self.dt = dt
+        self.max_steps = max_steps
+        self.rng = random.Random(seed)
+
+        self.robot = None
+        self.steps = 0
+
+    #Starts a new episode with the robot at a random collision free pose inside the bounds of the walls,
+    #returns the first observation
+    def reset(self, seed=None):
+        if seed is not None:
+            self.rng = random.Random(seed)
+
+        points = self.map.segments.reshape(-1, 2)
+        (x_min, y_min), (x_max, y_max) = points.min(axis=0), points.max(axis=0)
+        while True:
+            x = self.rng.uniform(x_min, x_max)
+            y = self.rng.uniform(y_min, y_max)
+            self.robot = Robot(x, y, self.power)
+            if Geometry.point_segment_distances((x, y), self.map.segments).min(initial=math.inf) > self.robot.radius:
+                break
+        self.robot.orientation = self.rng.uniform(0, 2 * math.pi)
+        self.robot.update_sensors(self.map.segments, self.map.index)
+
+        self.steps = 0
+        return self.observation()
+
+    #Applies motor speeds for one tick, returns (observation, reward, terminated, truncated, info)
+    #The reward is the distance travelled relative to full speed, a collision costs -1 and ends the episode
+    def step(self, action):
+        robot = self.robot
+        v_left, v_right = np.clip(action, -self.power, self.power)
+        robot.set_motors(float(v_left), float(v_right))
+
+        x, y = robot.x, robot.y
+        robot.update(self.dt, self.map.segments, self.map.index)
+        robot.update_sensors(self.map.segments, self.map.index)
+        self.steps += 1
+
+        terminated = robot.is_collision()
+        truncated = self.steps >= self.max_steps
+        reward = -1.0 if terminated else math.hypot(robot.x - x, robot.y - y) / (self.power * self.dt)
+        return self.observation(), reward, terminated, truncated, {}
+
+    def observation(self):
+        robot = self.robot
+        return np.array(robot.wall_sensor_distances + [robot.x, robot.y, robot.orientation], dtype=float)
+
+
+#Worker process of VectorEnv, steps its slice of environments and writes the results into the shared buffers
+def run_worker(connection, memory_name, count, start, stop, env_factory, seeds):
+    memory = shared_memory.SharedMemory(name=memory_name)
+    buffers = VectorEnv.buffers(memory, count)
+    envs = [env_factory() for _ in range(start, stop)]
+    try:
+        while True:
+            command = connection.recv()
+            if command == 'reset':
+                for i, env in enumerate(envs, start):
+                    buffers['observations'][i] = env.reset(seeds[i])
+                    seeds[i] = None
+            elif command == 'step':
+                for i, env in enumerate(envs, start):
+                    observation, reward, terminated, truncated, _ = env.step(buffers['actions'][i])
+                    buffers['final_observations'][i] = observation
+                    if terminated or truncated:
+                        observation = env.reset()   #auto reset, the final observation stays available
+                    buffers['observations'][i] = observation
+                    buffers['rewards'][i] = reward
+                    buffers['terminated'][i] = terminated
+                    buffers['truncated'][i] = truncated
+            elif command == 'close':
+                break
+            connection.send(True)
+    finally:
+        del buffers
+        memory.close()
+        connection.close()
+
+
+class VectorEnv:
+    # Description: N environments stepped in parallel by a pool of worker processes
+    # Actions, observations, rewards and done flags live in one shared memory block, so a step only sends
+    # a short command to every worker instead of pickling arrays. Finished environments are reset automatically.
+
+    def __init__(self, count, env_factory=RobotEnv, workers=None, seed=None):
+        self.count = count
+        self.workers = min(workers or mp.cpu_count(), count)
+
+        size = sum(np.prod(shape) * np.dtype(dtype).itemsize for _, shape, dtype in self.layout(count))
+        self.memory = shared_memory.SharedMemory(create=True, size=int(size))
+        self.arrays = self.buffers(self.memory, count)
+
+        seeds = [None if seed is None else seed + i for i in range(count)]
+        bounds = np.linspace(0, count, self.workers + 1).astype(int)
+        self.connections = []
+        self.processes = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            parent, child = mp.Pipe()
+            process = mp.Process(target=run_worker, args=(child, self.memory.name, count, start, stop, env_factory, seeds), daemon=True)
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+
+    #Name, shape and dtype of every shared buffer, in memory order
+    @staticmethod
+    def layout(count):
+        return [
+            ('observations', (count, RobotEnv.observation_size), np.float64),
+            ('final_observations', (count, RobotEnv.observation_size), np.float64),
+            ('actions', (count, RobotEnv.action_size), np.float64),
+            ('rewards', (count,), np.float64),
+            ('terminated', (count,), np.bool_),
+            ('truncated', (count,), np.bool_),
+        ]
+
+    @staticmethod
+    def buffers(memory, count):
+        arrays = {}
+        offset = 0
+        for name, shape, dtype in VectorEnv.layout(count):
+            arrays[name] = np.ndarray(shape, dtype=dtype, buffer=memory.buf, offset=offset)
+            offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+        return arrays
+
+    def broadcast(self, command):
+        for connection in self.connections:
+            connection.send(command)
+        for connection in self.connections:
+            connection.recv()
+
+    #Returns the observations of all environments, the returned arrays are copies of the shared buffers
+    def reset(self):
+        self.broadcast('reset')
+        return self.arrays['observations'].copy()
+
+    #Steps all environments with an (N, 2) array of motor speeds
+    #Returns (observations, rewards, terminated, truncated, final_observations)
+    def step(self, actions):
+        self.arrays['actions'][:] = actions
+        self.broadcast('step')
+        return tuple(self.arrays[name].copy() for name in ('observations', 'rewards', 'terminated', 'truncated', 'final_observations'))
+
+    def close(self):
+        if self.memory is None:
+            return
+        for connection in self.connections:
+            connection.send('close')
+        for process in self.processes:
+            process.join()
+        self.arrays = None
+        self.memory.close()
+        self.memory.unlink()
+        self.memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,115 @@
+import numpy as np
+
+# Description: Vectorized NumPy geometry shared by the sensors and collision handling
+# Segments are (N, 4) arrays of [x1, y1, x2, y2], points and line ends are (..., 2) arrays that broadcast against them
+# With pairwise=True line ends and segments are instead matched element by element, for (P, 2) and (P, 4) arrays
+
+END_POINTS = np.array([0.0, 1.0])
+TINY = np.finfo(float).tiny
+
+#Converts a list of walls (or the walls of a map, or an existing segment array) to an (N, 4) float array
+def as_segments(walls):
+    if isinstance(walls, np.ndarray):
+        return walls
+    if hasattr(walls, '__array__'):
+        return np.asarray(walls, dtype=float)
+    return np.array([(wall.x1, wall.y1, wall.x2, wall.y2) for wall in walls], dtype=float).reshape(-1, 4)
+
+#2D cross product of vectors a and b
+def cross(ax, ay, bx, by):
+    return ax * by - ay * bx
+
+#Intersects lines from start to end with every segment, returns the parameter t along each line (0 at start, 1 at end)
+#of its first common point with each segment, or np.inf where they do not meet - shape (..., N)
+def ray_cast(starts, ends, segments, pairwise=False):
+    starts = np.asarray(starts, dtype=float)
+    ends = np.asarray(ends, dtype=float)
+    if not pairwise:
+        starts = starts[..., np.newaxis, :]
+        ends = ends[..., np.newaxis, :]
+    ox, oy = starts[..., 0], starts[..., 1]
+    dx, dy = ends[..., 0] - ox, ends[..., 1] - oy
+    ax, ay = segments[:, 0], segments[:, 1]
+    ex, ey = segments[:, 2] - ax, segments[:, 3] - ay
+
+    wx, wy = ax - ox, ay - oy
+    denom = cross(dx, dy, ex, ey)
+    t_num = cross(wx, wy, ex, ey)
+    u_num = cross(wx, wy, dx, dy)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = t_num / denom
+        u = u_num / denom
+        hit = (denom != 0) & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+        result = np.where(hit, t, np.inf)
+
+        #Collinear overlap: the first point of the overlap along the line
+        collinear = (denom == 0) & (u_num == 0)
+        if np.any(collinear):
+            d_squared = dx * dx + dy * dy
+            t_a = (wx * dx + wy * dy) / d_squared
+            t_b = ((segments[:, 2] - ox) * dx + (segments[:, 3] - oy) * dy) / d_squared
+            t_low = np.maximum(np.minimum(t_a, t_b), 0)
+            t_high = np.minimum(np.maximum(t_a, t_b), 1)
+            overlap = collinear & (t_low <= t_high)
+            result = np.where(overlap, t_low, result)
+
+    return result
+
+#Squared distance from the point (px, py) to segments starting at (ax, ay) with direction (ex, ey)
+def point_distances_squared(px, py, ax, ay, ex, ey, length_squared):
+    t = ((px - ax) * ex + (py - ay) * ey) / length_squared
+    t = np.minimum(np.maximum(t, 0), 1)
+    qx = px - ax - t * ex
+    qy = py - ay - t * ey
+    return qx * qx + qy * qy
+
+#Distance from points to every segment - shape (..., N)
+def point_segment_distances(points, segments):
+    points = np.asarray(points, dtype=float)[..., np.newaxis, :]
+    ax, ay = segments[:, 0], segments[:, 1]
+    ex, ey = segments[:, 2] - ax, segments[:, 3] - ay
+    return np.sqrt(point_distances_squared(points[..., 0], points[..., 1], ax, ay, ex, ey, ex * ex + ey * ey))
+
+#Shortest distance between the segments from start to end and every segment, 0 where they cross - shape (..., N)
+#A disc of radius R moved from start to end touches a segment exactly when this distance is at most R
+def segment_distances(starts, ends, segments, pairwise=False):
+    starts = np.asarray(starts, dtype=float)
+    ends = np.asarray(ends, dtype=float)
+    if not pairwise:
+        starts = starts[..., np.newaxis, :]
+        ends = ends[..., np.newaxis, :]
+    px, py = starts[..., 0], starts[..., 1]
+    dx, dy = ends[..., 0] - px, ends[..., 1] - py
+    ax, ay = segments[:, 0], segments[:, 1]
+    ex, ey = segments[:, 2] - ax, segments[:, 3] - ay
+
+    #both end points of the moving segments against the segments and the other way around, stacked on a leading axis
+    ends_axis = END_POINTS.reshape((2,) + (1,) * px.ndim)
+    move_length_squared = np.maximum(dx * dx + dy * dy, TINY)     #zero length moves are points
+    distances = np.minimum(
+        point_distances_squared(px + ends_axis * dx, py + ends_axis * dy, ax, ay, ex, ey, ex * ex + ey * ey),
+        point_distances_squared(ax + ends_axis * ex, ay + ends_axis * ey, px, py, dx, dy, move_length_squared)).min(axis=0)
+
+    #proper crossings, collinear pairs are fully described by their end point distances
+    wx, wy = ax - px, ay - py
+    side_a = dx * wy - dy * wx
+    side_b = side_a + dx * ey - dy * ex
+    side_start = ey * wx - ex * wy
+    side_end = side_start + ex * dy - ey * dx
+    crossing = (side_a * side_b <= 0) & (side_start * side_end <= 0) & ((side_a != 0) | (side_b != 0))
+
+    return np.where(crossing, 0, np.sqrt(distances))
+
+#Indices (in order) of the segments touched by a disc of the given radius moved from start to end
+def swept_disc_collisions(start, end, radius, segments):
+    (x0, y0), (x1, y1) = start, end
+    #bounding box prefilter, only segments whose box overlaps the box of the swept disc need the exact test
+    near = ((np.minimum(segments[:, 0], segments[:, 2]) <= max(x0, x1) + radius)
+            & (np.maximum(segments[:, 0], segments[:, 2]) >= min(x0, x1) - radius)
+            & (np.minimum(segments[:, 1], segments[:, 3]) <= max(y0, y1) + radius)
+            & (np.maximum(segments[:, 1], segments[:, 3]) >= min(y0, y1) - radius))
+    candidates = np.flatnonzero(near)
+    if len(candidates) == 0:
+        return candidates
+    return candidates[segment_distances(start, end, segments[candidates]) <= radius]
@@ -1,21 +1,50 @@
 import numpy as np
 
+from Trajectory import Trajectory
+
+# Description: Appends the estimate of a filter (KalmanFilter, SLAMFilter or ParticleFilter) to its path, and every 100
+# estimates the ellipse of covariance (the robot block) to its covariance_history
+def append_estimate(filter, covariance):
+    filter.path.append((filter.state[0], filter.state[1]))
+
+    # every 100 steps: calculate covariance ellipse
+    if filter.path.appended % 100 == 0:
+        filter.covariance_history.append(((filter.state[0], filter.state[1]), covariance_ellipse(covariance)))
+
+# Author: Jannick Smeets
+# Description: Calculates the properties needed to draw the covariance ellipse
+def covariance_ellipse(covariance):
+    eigen_values, eigen_vectors = np.linalg.eigh(covariance)
+    eigen_values = np.flip(eigen_values, 0)     # flip to decreasing order
+    eigen_vectors = np.flip(eigen_vectors, 0)   # flip to decreasing order
+
+    # calculate major and minor axis of covariance ellipse
+    major_axis = 2 * np.sqrt(5.991 * eigen_values[0])
+    minor_axis = 2 * np.sqrt(5.991 * eigen_values[1])
+
+    # calculate angle of ellipse
+    ellipse_angle = np.degrees(np.arctan2(eigen_vectors[1,0], eigen_vectors[0,0]))
+
+    return major_axis, minor_axis, ellipse_angle
+
 class KalmanFilter:
     # Authors: Guilherme De Sequeira, Dino Pasic, Jannick Smeets
     # Description: Class that holds the logistics of the implemented Kalman Filter
 
-    def __init__(self, initial_state, initial_covariance, process_noise, measurement_noise, robot, map):
+    def __init__(self, initial_state, initial_covariance, process_noise, measurement_noise, robot, map, joint_update=False):
         self.state = np.array(initial_state)  # State includes [x, y, orientation]
         self.covariance = np.array(initial_covariance)  # Initial covariance matrix
         self.process_noise = process_noise  # Process noise covariance matrix
         self.measurement_noise = measurement_noise  # Measurement noise covariance matrix
-        self.path = [(self.state[0], self.state[1])]
+        self.path = Trajectory((self.state[0], self.state[1]))    # Bounded history of estimated positions
 
         self.covariance_history = []    # holds ellipse properties from covariance matrices - [(x, y), (major-axis, minor-axis, angle)]
 
         self.robot = robot  # Reference to the robot object, assuming it holds map information
         self.map = map
 
+        self.joint_update = joint_update    # Update with all measurements at once (update_joint) instead of one by one
+
     # Authors: Guilherme De Sequeira, Dino Pasic
     # Description: Predicts the next state of the robot and updates error covariance
     def predict(self, control_input, dt):
@@ -46,11 +75,17 @@ class KalmanFilter:
     # Authors: Dino Pasic, Guilherme De Sequeira
     # Description: Refines estimate of state and adjusts error covariance
     def update(self, measurements):
+        if self.joint_update:
+            self.update_joint(measurements)
+            self.record_estimate()
+            return
+
         for distance, bearing, feature in measurements:
             feature_x, feature_y = feature[0], feature[1]
             expected_distance, expected_bearing = self.calculate_expected_measurement(feature_x, feature_y)
 
             z_res = np.array([distance - expected_distance, bearing - expected_bearing])
+            z_res[1] = (z_res[1] + np.pi) % (2 * np.pi) - np.pi    # bearing residual wrapped to [-π, π]
 
             # Calculate the correct Jacobian H for the measurement function
             H = self.calculate_jacobian_H(feature_x, feature_y)
@@ -67,11 +102,72 @@ class KalmanFilter:
             # Update the covariance
             self.covariance = (np.eye(len(self.state)) - K @ H) @ self.covariance
 
-        self.path.append((self.state[0], self.state[1]))
-        
-        # every 100 steps: calculate covariance ellipse
-        if len(self.path) % 100 == 0:
-            self.covariance_history.append(((self.state[0], self.state[1]), self.calculate_covariance_ellipse(self.covariance)))
+        self.record_estimate()
+
+    # Description: Refines the estimate with all measurements stacked into one measurement vector
+    # Uses a block-diagonal R, solve() instead of an explicit inverse of the innovation covariance and the Joseph form
+    # covariance update, which keeps the covariance symmetric positive definite in areas with many landmarks
+    def update_joint(self, measurements):
+        measurements = list(measurements)
+        if len(measurements) == 0:
+            return
+
+        z = np.array([(distance, bearing) for distance, bearing, _ in measurements], dtype=float)
+        features = np.array([(feature[0], feature[1]) for _, _, feature in measurements], dtype=float)
+
+        x, y, theta = self.state
+        dx = features[:, 0] - x
+        dy = features[:, 1] - y
+        d_squared = dx**2 + dy**2
+        d = np.sqrt(d_squared)
+
+        # Stacked residuals [distance, bearing, distance, bearing, ...], bearings wrapped to [-π, π]
+        z_res = z - np.column_stack((d, np.arctan2(dy, dx) - theta))
+        z_res[:, 1] = (z_res[:, 1] + np.pi) % (2 * np.pi) - np.pi
+        z_res = z_res.ravel()
+
+        # Stacked Jacobians, two rows per measurement as in calculate_jacobian_H
+        H = np.zeros((len(measurements), 2, 3))
+        H[:, 0, 0] = -dx / d
+        H[:, 0, 1] = -dy / d
+        H[:, 1, 0] = dy / d_squared
+        H[:, 1, 1] = -dx / d_squared
+        H[:, 1, 2] = -1
+
+        # With the block-diagonal R the gain K = P H^T (H P H^T + R)^-1 equals (I + P H^T R^-1 H)^-1 P H^T R^-1,
+        # which only needs a 3x3 solve, so the cost grows linearly with the number of measurements
+        R_inv = np.linalg.solve(self.measurement_noise, np.eye(2))
+        HtR_inv = np.einsum('mji,jk->imk', H, R_inv).reshape(3, -1)
+        H = H.reshape(-1, 3)
+        P = self.covariance
+        K = np.linalg.solve(np.eye(3) + P @ HtR_inv @ H, P @ HtR_inv)
+
+        self.state = self.state + K @ z_res
+
+        # Joseph form (I - KH) P (I - KH)^T + K R K^T, stays symmetric positive definite under rounding errors
+        I_KH = np.eye(len(self.state)) - K @ H
+        K_blocks = K.reshape(3, -1, 2)
+        KRKt = np.einsum('imj,jk,lmk->il', K_blocks, self.measurement_noise, K_blocks)
+        covariance = I_KH @ P @ I_KH.T + KRKt
+        self.covariance = (covariance + covariance.T) / 2
+
+    # Description: Stores the current estimate in the path and every 100 steps its covariance ellipse
+    def record_estimate(self):
+        append_estimate(self, self.covariance)
+
+    # Description: Mutable state of the filter as a flat array [n, state (n), covariance (n x n), trajectory counters,
+    # number of covariance ellipses], the noise matrices, robot and map are shared and not stored
+    def snapshot(self):
+        n = len(self.state)
+        return np.concatenate(([n], self.state, self.covariance.ravel(), self.path.snapshot(), [len(self.covariance_history)]))
+
+    def restore(self, state):
+        n = int(state[0])
+        self.state = state[1:n + 1].copy()
+        self.covariance = state[n + 1:n + 1 + n * n].reshape(n, n).copy()
+        appended, stored, ellipses = state[n + 1 + n * n:n + 4 + n * n].tolist()
+        self.path.restore(appended, stored)
+        del self.covariance_history[int(ellipses):]
 
     # Author: Guilherme De Sequeira
     # Description: Calculates the expected measurements
@@ -103,15 +199,4 @@ class KalmanFilter:
     # Author: Jannick Smeets
     # Description: Calculates the properties needed to draw the covariance ellipse
     def calculate_covariance_ellipse(self, covariance):
-        eigen_values, eigen_vectors = np.linalg.eigh(covariance)
-        eigen_values = np.flip(eigen_values, 0)     # flip to decreasing order
-        eigen_vectors = np.flip(eigen_vectors, 0)   # flip to decreasing order
-
-        # calculate major and minor axis of covariance ellipse
-        major_axis = 2 * np.sqrt(5.991 * eigen_values[0])
-        minor_axis = 2 * np.sqrt(5.991 * eigen_values[1])
-
-        # calculate angle of ellipse
-        ellipse_angle = np.degrees(np.arctan2(eigen_vectors[1,0], eigen_vectors[0,0]))
-
-        return major_axis, minor_axis, ellipse_angle
+        return covariance_ellipse(covariance)
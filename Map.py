@@ -1,59 +1,211 @@
+import json
 import math
+import numpy as np
 from shapely.geometry import LineString, Point
 
+from SpatialIndex import GridIndex
+
 class Map:
     # Author: Dino Pasic, Jannick Smeets
     # Description: Class representing the full map to be populated with walls and features
+    # Walls and features are stored in contiguous NumPy arrays, Wall and Feature objects are light views onto them
 
     class Wall:
         # Author: Dino Pasic
-        # Description: Class that represents each wall within the map
-
-        def __init__(self, x1, y1, x2, y2):
-            self.x1 = x1
-            self.y1 = y1
-            self.x2 = x2
-            self.y2 = y2
-            self.line = LineString([(x1, y1), (x2, y2)])
-            self.vector_normalized = self.normalize_wall_vector()
-            self.angle = self.calculate_angle()
-
-        #Neccessary for vector decomposition
-        def calculate_angle(self):
-            if self.x2 - self.x1 == 0:
-                return math.pi / 2 if self.y2 > self.y1 else 3 * math.pi / 2
-            else:
-                angle = math.atan2(self.y2 - self.y1, self.x2 - self.x1)
-                return angle if angle >= 0 else angle + 2 * math.pi
-            
-        #Calculate normalized vector of wall for collision handling
-        def normalize_wall_vector(self):
-            wall_vector = (self.x2 - self.x1, self.y2 - self.y1)
-            wall_vector_normalized = (
-                wall_vector[0] / math.hypot(wall_vector[0], wall_vector[1]),
-                wall_vector[1] / math.hypot(wall_vector[0], wall_vector[1])
-            )
-            return wall_vector_normalized
-        
+        # Description: Class that represents each wall within the map, a view onto row index of the wall arrays
+        # Wall(x1, y1, x2, y2) still builds a standalone wall in map coordinates, backed by a map of its own
+
+        __slots__ = ('map', 'index')
+
+        def __init__(self, *args):
+            if len(args) == 4:
+                map = Map(0, 0)
+                map.add_segments([args])
+                args = (map, 0)
+            self.map, self.index = args
+
+        @property
+        def x1(self):
+            return float(self.map.wall_coords[self.index, 0])
+
+        @property
+        def y1(self):
+            return float(self.map.wall_coords[self.index, 1])
+
+        @property
+        def x2(self):
+            return float(self.map.wall_coords[self.index, 2])
+
+        @property
+        def y2(self):
+            return float(self.map.wall_coords[self.index, 3])
+
+        #Shapely geometry is only built on demand for callers that still want it
+        @property
+        def line(self):
+            return LineString([(self.x1, self.y1), (self.x2, self.y2)])
+
+        @property
+        def vector_normalized(self):
+            return tuple(self.map.wall_vectors[self.index].tolist())
+
+        @property
+        def angle(self):
+            return float(self.map.wall_angles[self.index])
+
+        def __eq__(self, other):
+            return isinstance(other, Map.Wall) and self.map is other.map and self.index == other.index
+
+        def __hash__(self):
+            return hash((id(self.map), self.index))
+
     class Feature:
         # Author: Jannick Smeets
-        # Description: Class representing each feature within the map
+        # Description: Class representing each feature within the map, a view onto row index of the feature array
+        # Feature(x, y) still builds a standalone feature in map coordinates, backed by a map of its own
+
+        __slots__ = ('map', 'index')
+        radius = 5
+
+        def __init__(self, *args):
+            if len(args) == 2 and not isinstance(args[0], Map):
+                map = Map(0, 0)
+                map.feature_coords = np.array([args], dtype=float)
+                args = (map, 0)
+            self.map, self.index = args
+
+        @property
+        def x(self):
+            return float(self.map.feature_coords[self.index, 0])
+
+        @property
+        def y(self):
+            return float(self.map.feature_coords[self.index, 1])
+
+        #Shapely geometry is only built on demand for callers that still want it
+        @property
+        def point(self):
+            return Point((self.x, self.y))
+
+        def __eq__(self, other):
+            return isinstance(other, Map.Feature) and self.map is other.map and self.index == other.index
+
+        def __hash__(self):
+            return hash((id(self.map), self.index))
+
+    class Views:
+        # Description: Read-only sequence of Wall or Feature views over the first count rows of an array of the map
 
-        def __init__(self, x, y):
-            self.x = x
-            self.y = y
-            self.point = Point((x, y))
+        def __init__(self, map, view, array_name):
+            self.map = map
+            self.view = view
+            self.array_name = array_name
 
-            self.radius = 5
+        #The rows as an array, a read-only view onto the map storage unless copy is requested or dtype needs one
+        def __array__(self, dtype=None, copy=None):
+            array = getattr(self.map, self.array_name)
+            if copy or (dtype is not None and np.dtype(dtype) != array.dtype):
+                if copy is False:
+                    raise ValueError("map " + self.array_name + " cannot be converted to " + str(dtype) + " without a copy")
+                return np.array(array, dtype=dtype)
+            view = array.view()
+            view.flags.writeable = False
+            return view
+
+        def __len__(self):
+            return len(getattr(self.map, self.array_name))
+
+        def __getitem__(self, index):
+            if isinstance(index, slice):
+                return [self.view(self.map, i) for i in range(*index.indices(len(self)))]
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError("map index out of range")
+            return self.view(self.map, index)
+
+        def __iter__(self):
+            return (self.view(self.map, i) for i in range(len(self)))
 
     def __init__(self, width, height):
         self.width = width
         self.height = height
-        self.walls = []
-        self.features = []
+
+        #wall storage grows by doubling, only the first wall_count rows are in use
+        self.wall_count = 0
+        self.wall_storage = np.zeros((0, 4))
+        self.vector_storage = np.zeros((0, 2))
+        self.angle_storage = np.zeros(0)
+        self.feature_coords = np.zeros((0, 2))
+
+        self.walls = self.Views(self, self.Wall, 'wall_coords')
+        self.features = self.Views(self, self.Feature, 'feature_coords')
+
+        self.spatial_index = None       #cached grid over walls and features, rebuilt after walls or features are added
+
+    @property
+    def wall_coords(self):
+        return self.wall_storage[:self.wall_count]
+
+    #Normalized direction vector of every wall, used for the vector decomposition in collision handling
+    @property
+    def wall_vectors(self):
+        return self.vector_storage[:self.wall_count]
+
+    #Angle of every wall in [0, 2π)
+    @property
+    def wall_angles(self):
+        return self.angle_storage[:self.wall_count]
+
+    #All walls as an (N, 4) array of [x1, y1, x2, y2] for the vectorized sensor and collision code
+    @property
+    def segments(self):
+        return self.wall_coords
 
     def add_wall(self, x1, y1, x2, y2):
-        self.walls.append(self.Wall(x1, self.height - y1, x2, self.height - y2))
+        self.add_walls([(x1, y1, x2, y2)])
+
+    #Adds an (N, 4) array of walls at once, in the same coordinates as add_wall
+    def add_walls(self, walls):
+        walls = np.array(walls, dtype=float).reshape(-1, 4)
+        walls[:, [1, 3]] = self.height - walls[:, [1, 3]]
+        self.add_segments(walls)
+
+    #Adds an (N, 4) array of walls in map coordinates (y already flipped), as stored in segments
+    def add_segments(self, walls):
+        walls = np.array(walls, dtype=float).reshape(-1, 4)
+        count = self.wall_count + len(walls)
+        if count > len(self.wall_storage):
+            capacity = max(count, 2 * len(self.wall_storage), 16)
+            self.wall_storage = np.resize(self.wall_storage, (capacity, 4))
+            self.vector_storage = np.resize(self.vector_storage, (capacity, 2))
+            self.angle_storage = np.resize(self.angle_storage, capacity)
+
+        dx = walls[:, 2] - walls[:, 0]
+        dy = walls[:, 3] - walls[:, 1]
+        length = np.hypot(dx, dy)
+        #Neccessary for vector decomposition, vertical walls point straight up or down
+        angle = np.arctan2(dy, dx)
+        angle = np.where(angle >= 0, angle, angle + 2 * math.pi)
+        angle = np.where(dx == 0, np.where(dy > 0, math.pi / 2, 3 * math.pi / 2), angle)
+
+        self.wall_storage[self.wall_count:count] = walls
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.vector_storage[self.wall_count:count] = np.column_stack((dx / length, dy / length))
+        self.angle_storage[self.wall_count:count] = angle
+        self.wall_count = count
+        self.spatial_index = None
+
+    #Grid index over the walls and features, built on first use after populate_map/extract_features
+    @property
+    def index(self):
+        if self.spatial_index is None:
+            self.build_index()
+        return self.spatial_index
+
+    def build_index(self, cell_size=None):
+        self.spatial_index = GridIndex(self.segments, self.feature_coords, cell_size)
+        return self.spatial_index
 
     def add_square_walls(self, x, y, size):
         self.add_wall(x, y, x + size, y)
@@ -87,21 +239,50 @@ class Map:
             y = center_y + size * math.sin(angle)
             points.append((x, y))
 
-        for i in range(6):
-            x1, y1 = points[i]
-            x2, y2 = points[(i + 1) % 6]
-            self.add_wall(x1, y1, x2, y2)
+        #all six walls in one call
+        self.add_walls([(*points[i], *points[(i + 1) % 6]) for i in range(6)])
 
     # Author: Jannick Smeets
     # Description: Extracts map features/landmarks using vertices of wall lines
+    # Vertices are deduplicated with np.unique on the coordinate rows, keeping the order in which they first appear
     def extract_features(self):
-        existing_features = []
-        for wall in self.walls:
-            if (wall.x1, wall.y1) not in existing_features:
-                existing_features.append((wall.x1, wall.y1))
-                self.features.append(self.Feature(wall.x1, wall.y1))
-            if (wall.x2, wall.y2) not in existing_features:
-                existing_features.append((wall.x2, wall.y2))
-                self.features.append(self.Feature(wall.x2, wall.y2))       
-
-            
+        vertices = self.wall_coords.reshape(-1, 2) + 0.0     #+ 0.0 turns -0.0 into 0.0 so both count as one vertex
+        _, first = np.unique(vertices, axis=0, return_index=True)
+        self.feature_coords = vertices[np.sort(first)]
+        self.spatial_index = None
+
+    # Description: Saves the walls and features, as .npz (binary, fast for large maps) or .json (readable, editable)
+    # Coordinates are stored as passed to add_wall, so a hand-written file uses the same convention as populate_map
+    def save(self, path):
+        walls = self.wall_coords.copy()
+        walls[:, [1, 3]] = self.height - walls[:, [1, 3]]
+        features = self.feature_coords.copy()
+        features[:, 1] = self.height - features[:, 1]
+        if path.endswith('.json'):
+            with open(path, 'w') as file:
+                json.dump({'width': self.width, 'height': self.height, 'walls': walls.tolist(), 'features': features.tolist()}, file)
+        else:
+            np.savez(path, size=np.array([self.width, self.height]), walls=walls, features=features)
+
+    # Description: Loads a map written by save, files without features get them from extract_features
+    @classmethod
+    def load(cls, path):
+        if path.endswith('.json'):
+            with open(path) as file:
+                data = json.load(file)
+            width, height = data['width'], data['height']
+            walls, features = data['walls'], data.get('features')
+        else:
+            with np.load(path) as data:
+                width, height = data['size'].tolist()
+                walls, features = data['walls'], data['features'] if 'features' in data else None
+
+        map = cls(width, height)
+        map.add_walls(walls)
+        if features is None:
+            map.extract_features()
+        else:
+            features = np.array(features, dtype=float).reshape(-1, 2)
+            features[:, 1] = height - features[:, 1]
+            map.feature_coords = features
+        return map
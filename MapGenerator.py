@@ -0,0 +1,119 @@
+import math
+import numpy as np
+
+from Map import Map
+
+class MapGenerator:
+    # Description: Procedural maps of a given size in walls, for sensor and collision work on representative large maps
+    # Layouts are mazes, warehouses (shelf rows and aisles) and open areas with polygon obstacles. The map grows with
+    # the number of walls so corridors stay wide enough for the robot. Every layout is reproducible from its seed,
+    # walls go in through Map.add_walls/add_hexagon_walls and features come from Map.extract_features.
+
+    def __init__(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+
+    #kind is 'maze', 'warehouse' or 'polygons', walls the approximate number of walls
+    def generate(self, kind, walls=1000, **options):
+        layouts = {'maze': self.maze, 'warehouse': self.warehouse, 'polygons': self.polygons}
+        if kind not in layouts:
+            raise ValueError("unknown map kind " + repr(kind) + ", expected one of " + ", ".join(layouts))
+        return layouts[kind](walls, **options)
+
+    #Square map of size x size with its boundary walls
+    def empty_map(self, size, margin):
+        map = Map(size + 2 * margin, size + 2 * margin)
+        map.add_walls([(margin, margin, margin + size, margin), (margin, margin + size, margin + size, margin + size),
+                       (margin, margin, margin, margin + size), (margin + size, margin, margin + size, margin + size)])
+        return map
+
+    # Description: Perfect maze (one path between any two cells) carved by a randomized depth-first search over a
+    # grid of cells cell_size wide, every remaining cell edge is a wall. A maze of n cells has about n walls
+    def maze(self, walls=1000, cell_size=60, margin=40):
+        n = max(int(math.sqrt(walls)), 2)
+        visited = np.zeros((n, n), dtype=bool)
+        right = np.ones((n, n), dtype=bool)     #wall on the right edge of cell (i, j)
+        top = np.ones((n, n), dtype=bool)       #wall on the top edge of cell (i, j)
+
+        stack = [(0, 0)]
+        visited[0, 0] = True
+        while stack:
+            i, j = stack[-1]
+            neighbours = [(i + di, j + dj) for di, dj in ((1, 0), (-1, 0), (0, 1), (0, -1))
+                          if 0 <= i + di < n and 0 <= j + dj < n and not visited[i + di, j + dj]]
+            if not neighbours:
+                stack.pop()
+                continue
+            ni, nj = neighbours[self.rng.integers(len(neighbours))]
+            if ni != i:
+                right[min(i, ni), j] = False
+            else:
+                top[i, min(j, nj)] = False
+            visited[ni, nj] = True
+            stack.append((ni, nj))
+
+        map = self.empty_map(n * cell_size, margin)
+        #interior edges only, the last column and row are covered by the boundary
+        i, j = np.nonzero(right[:-1, :])
+        x = margin + (i + 1) * cell_size
+        y = margin + j * cell_size
+        map.add_walls(np.column_stack((x, y, x, y + cell_size)))
+        i, j = np.nonzero(top[:, :-1])
+        x = margin + i * cell_size
+        y = margin + (j + 1) * cell_size
+        map.add_walls(np.column_stack((x, y, x + cell_size, y)))
+        map.extract_features()
+        return map
+
+    # Description: Warehouse floor with rectangular shelves (4 walls each) in rows and columns separated by aisles,
+    # a random fraction of the shelves is left out to open cross aisles
+    def warehouse(self, walls=1000, shelf_size=(120, 30), aisle=60, missing=0.1, margin=40):
+        shelves = max(int((walls - 4) / 4 / (1 - missing)), 1)
+        shelf_w, shelf_h = shelf_size
+        columns = max(int(math.sqrt(shelves * (shelf_h + aisle) / (shelf_w + aisle))), 1)
+        rows = math.ceil(shelves / columns)
+        size = max(columns * (shelf_w + aisle), rows * (shelf_h + aisle)) + aisle
+
+        map = self.empty_map(size, margin)
+        c, r = np.meshgrid(np.arange(columns), np.arange(rows))
+        keep = self.rng.random(c.size) >= missing
+        x0 = (margin + aisle + c.ravel() * (shelf_w + aisle))[keep]
+        y0 = (margin + aisle + r.ravel() * (shelf_h + aisle))[keep]
+        x1, y1 = x0 + shelf_w, y0 + shelf_h
+        map.add_walls(np.stack((np.column_stack((x0, y0, x1, y0)), np.column_stack((x1, y0, x1, y1)),
+                                np.column_stack((x1, y1, x0, y1)), np.column_stack((x0, y1, x0, y0))), axis=1))
+        map.extract_features()
+        return map
+
+    # Description: Open area with convex polygon obstacles on a jittered grid of cells spacing wide
+    # Obstacles are hexagons (add_hexagon_walls) or random convex polygons with 3 to 8 sides. Every obstacle stays
+    # robot_radius inside its cell and the boundary is robot_radius outside the cells, so the robot fits between any
+    # two obstacles and between obstacles and the boundary
+    def polygons(self, walls=1000, spacing=110, radius=(15, 35), hexagons=0.3, margin=40, robot_radius=20):
+        if spacing < 2 * (radius[1] + robot_radius):
+            raise ValueError("spacing " + str(spacing) + " leaves no room for the robot between obstacles of radius " +
+                             str(radius[1]) + ", it needs at least " + str(2 * (radius[1] + robot_radius)))
+        obstacles = max(int((walls - 4) / 5.5), 1)     #5.5 sides on average
+        n = max(math.ceil(math.sqrt(obstacles)), 1)
+        map = self.empty_map(n * spacing + 2 * robot_radius, margin)
+
+        radii = self.rng.uniform(radius[0], radius[1], obstacles)
+        jitter = self.rng.uniform(-1, 1, (obstacles, 2)) * (spacing / 2 - radii[:, np.newaxis] - robot_radius)
+        cells = np.arange(obstacles)
+        centers = margin + robot_radius + (np.column_stack((cells % n, cells // n)) + 0.5) * spacing + jitter
+
+        polygons = []
+        for (x, y), r in zip(centers.tolist(), radii.tolist()):
+            if self.rng.random() < hexagons:
+                map.add_hexagon_walls(x, y, r)
+                continue
+            sides = int(self.rng.integers(3, 9))
+            #sorted random angles keep the polygon convex, every side spans less than half a turn
+            angles = np.sort(self.rng.uniform(0, 2 * math.pi, sides))
+            while np.max(np.diff(np.append(angles, angles[0] + 2 * math.pi))) >= math.pi:
+                angles = np.sort(self.rng.uniform(0, 2 * math.pi, sides))
+            points = np.column_stack((x + r * np.cos(angles), y + r * np.sin(angles)))
+            polygons.append(np.column_stack((points, np.roll(points, -1, axis=0))))
+        if polygons:
+            map.add_walls(np.concatenate(polygons))
+        map.extract_features()
+        return map
@@ -0,0 +1,203 @@
+import math
+import os
+import re
+import numpy as np
+
+#Log-odds increments of a cell at the end of a beam that hit a wall and of a cell the beam passed through,
+#and the range the log-odds are clamped to so cells can still change their state after many observations
+LOG_ODDS_HIT = 0.85
+LOG_ODDS_FREE = -0.4
+LOG_ODDS_LIMITS = (-5.0, 5.0)
+
+class OccupancyGrid:
+    # Description: Log-odds occupancy grid built from the wall sensor readings, in map coordinates
+    # A reading d of a sensor at angle a is a beam from the robot center to radius + d along orientation + a. Every
+    # cell the beam passes through gets LOG_ODDS_FREE, the end cell LOG_ODDS_HIT when the reading is shorter than the
+    # sensor range (init_distance) and LOG_ODDS_FREE otherwise. Beams are traversed exactly (every cell the segment
+    # touches) for all beams of a batch at once: the crossings of all beams with the grid lines are computed as one
+    # padded array and sorted, consecutive crossings bound the cells. The updates of the batch are summed per cell,
+    # so one batch costs a few NumPy calls whether it holds the 12 beams of a tick or the beams of thousands of ticks.
+    # Storage is a dense (nx, ny) float32 array, or tiles of tile_size x tile_size cells allocated when first touched
+    # (large, mostly unexplored maps). With path the storage is memory-mapped: a .npy file for the dense grid, a
+    # directory of tile_i_j.npy files when tiled. An existing store at path is opened and updated, not overwritten.
+
+    def __init__(self, width, height, resolution=5, origin=(0, 0), tile_size=None, path=None):
+        self.resolution = resolution
+        self.x_min, self.y_min = origin
+        self.nx = int(math.ceil(width / resolution))
+        self.ny = int(math.ceil(height / resolution))
+        self.tile_size = tile_size
+        self.path = path
+
+        self.grid = None        #dense storage, (nx, ny) log-odds
+        self.tiles = {}         #(tile i, tile j) -> (tile_size, tile_size) log-odds, when tiled
+        if tile_size is None:
+            if path is None:
+                self.grid = np.zeros((self.nx, self.ny), dtype=np.float32)
+            elif os.path.exists(path):
+                self.grid = np.load(path, mmap_mode='r+')
+                if self.grid.shape != (self.nx, self.ny):
+                    raise ValueError("occupancy grid at " + path + " has shape " + str(self.grid.shape) +
+                                     ", expected " + str((self.nx, self.ny)))
+            else:
+                self.grid = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(self.nx, self.ny))
+        elif path is not None:
+            os.makedirs(path, exist_ok=True)
+            for name in os.listdir(path):
+                match = re.fullmatch(r'tile_(\d+)_(\d+)\.npy', name)
+                if match:
+                    self.tiles[int(match.group(1)), int(match.group(2))] = np.load(os.path.join(path, name), mmap_mode='r+')
+
+    #Tile (i, j), allocated (and with a path created on disk) on first use
+    def tile(self, i, j):
+        tile = self.tiles.get((i, j))
+        if tile is None:
+            shape = (self.tile_size, self.tile_size)
+            if self.path is None:
+                tile = np.zeros(shape, dtype=np.float32)
+            else:
+                tile = np.lib.format.open_memmap(os.path.join(self.path, 'tile_%d_%d.npy' % (i, j)), mode='w+', dtype=np.float32, shape=shape)
+            self.tiles[i, j] = tile
+        return tile
+
+    # Description: Cells touched by every beam from starts to ends ((B, 2) arrays in map coordinates)
+    # Returns (beam, cell x, cell y) of the cells before the end cell, and the end cells as (B,) x and y. Cells may
+    # lie outside the grid
+    def traverse(self, starts, ends):
+        origin = np.array([self.x_min, self.y_min])
+        a = (np.asarray(starts, dtype=float) - origin) / self.resolution       #in cell units
+        b = (np.asarray(ends, dtype=float) - origin) / self.resolution
+        #ends are moved a tiny step further along the beam, walls on grid lines (hits land exactly on them) then
+        #always end a beam in the cell behind the line instead of either cell depending on rounding
+        length = np.hypot(b[:, 0] - a[:, 0], b[:, 1] - a[:, 1])
+        b = b + (b - a) * (1e-6 / np.maximum(length, 1e-6))[:, np.newaxis]
+        delta = b - a
+        first = np.floor(a)
+        last = np.floor(b)
+
+        #parameters t in (0, 1) where each beam crosses the grid lines of both axes, (B, 2, crossings) padded with
+        #2 (past the end), followed by the beam start and end
+        crossings = int(np.abs(last - first).max(initial=0))
+        step = np.sign(delta)[:, :, np.newaxis]
+        lines = first[:, :, np.newaxis] + (step > 0) + step * np.arange(crossings)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = (lines - a[:, :, np.newaxis]) / delta[:, :, np.newaxis]
+        t[~((t > 0) & (t < 1))] = 2
+        t = np.concatenate((t.reshape(len(a), -1), np.zeros((len(a), 1)), np.ones((len(a), 1))), axis=1)
+        t.sort(axis=1)
+
+        #a cell lies between two consecutive crossings, the interval ending at t = 1 is the end cell
+        lower, upper = t[:, :-1], t[:, 1:]
+        inside = (upper < 1) & (upper - lower > 1e-12)
+        beams, columns = np.nonzero(inside)
+        middle = ((lower + upper) / 2)[beams, columns]
+        cells = np.floor(a[beams] + middle[:, np.newaxis] * delta[beams]).astype(np.int64)
+        return beams, cells[:, 0], cells[:, 1], last[:, 0].astype(np.int64), last[:, 1].astype(np.int64)
+
+    # Description: Integrates a batch of beams from starts to ends, hit (B,) tells which ended on a wall
+    def integrate_beams(self, starts, ends, hit):
+        _, free_x, free_y, end_x, end_y = self.traverse(starts, ends)
+        x = np.concatenate((free_x, end_x))
+        y = np.concatenate((free_y, end_y))
+        log_odds = np.concatenate((np.full(len(free_x), LOG_ODDS_FREE), np.where(hit, LOG_ODDS_HIT, LOG_ODDS_FREE)))
+
+        within = (x >= 0) & (x < self.nx) & (y >= 0) & (y < self.ny)
+        cells, inverse = np.unique(x[within] * self.ny + y[within], return_inverse=True)
+        self.add(cells, np.bincount(inverse.ravel(), log_odds[within], len(cells)))
+
+    # Description: Adds log_odds to the flat cells (unique, x * ny + y) and clamps them to LOG_ODDS_LIMITS
+    def add(self, cells, log_odds):
+        if len(cells) == 0:
+            return
+        if self.grid is not None:
+            grid = self.grid.reshape(-1)
+            grid[cells] = np.clip(grid[cells] + log_odds, *LOG_ODDS_LIMITS)
+            return
+
+        x, y = cells // self.ny, cells % self.ny
+        size = self.tile_size
+        tile_ids = (x // size) * (self.ny // size + 1) + y // size
+        order = np.argsort(tile_ids, kind='stable')
+        x, y, tile_ids, log_odds = x[order], y[order], tile_ids[order], log_odds[order]
+        bounds = np.flatnonzero(np.diff(tile_ids)) + 1
+        for start, stop in zip(np.concatenate(([0], bounds)).tolist(), np.concatenate((bounds, [len(x)])).tolist()):
+            tile = self.tile(int(x[start]) // size, int(y[start]) // size)
+            lx, ly = x[start:stop] % size, y[start:stop] % size
+            tile[lx, ly] = np.clip(tile[lx, ly] + log_odds[start:stop], *LOG_ODDS_LIMITS)
+
+    # Description: Beams of the wall sensor readings taken at poses, (T, 3) poses and (T, S) distances for S sensors
+    # at angles (radians, relative to the orientation). Returns (T*S, 2) starts and ends and (T*S,) hit
+    @staticmethod
+    def sensor_beams(poses, distances, angles, radius, length):
+        poses = np.asarray(poses, dtype=float).reshape(-1, 3)
+        distances = np.asarray(distances, dtype=float).reshape(len(poses), -1)
+        headings = poses[:, 2, np.newaxis] + np.asarray(angles, dtype=float)
+        ranges = radius + distances
+        starts = np.repeat(poses[:, :2], distances.shape[1], axis=0)
+        ends = starts + np.column_stack(((ranges * np.cos(headings)).ravel(), (ranges * np.sin(headings)).ravel()))
+        return starts, ends, (distances < length - radius).ravel()
+
+    #Integrates the current wall sensor readings of a robot at its true pose
+    def integrate_robot(self, robot):
+        sensors = robot.wall_sensors
+        self.integrate_beams(*self.sensor_beams([robot.x, robot.y, robot.orientation], [sensor.distance for sensor in sensors],
+                                                [sensor.angle for sensor in sensors], robot.radius, sensors[0].length))
+
+    # Description: Integrates the wall sensor readings of the recorded ticks start:stop of a Recording at the recorded
+    # poses, batch_size ticks per batch. The recording does not store the sensor layout, the defaults are the robot's
+    # (evenly spaced sensors starting at the orientation, radius 20, sensor length 120). Log-odds are clamped once
+    # per batch, so cells that saturate can differ from integrating tick by tick, the sums are the same otherwise
+    def integrate_recording(self, recording, start=0, stop=None, radius=20, length=120, batch_size=4096):
+        stop = len(recording) if stop is None else min(stop, len(recording))
+        sensor_count = recording.wall_sensor_distances.shape[1]
+        angles = np.arange(sensor_count) * 2 * math.pi / sensor_count
+        for batch in range(start, stop, batch_size):
+            end = min(batch + batch_size, stop)
+            self.integrate_beams(*self.sensor_beams(recording.pose[batch:end], recording.wall_sensor_distances[batch:end],
+                                                    angles, radius, length))
+
+    #Full (nx, ny) log-odds array, assembled from the tiles when tiled (unallocated tiles are 0, unknown)
+    def log_odds(self):
+        if self.grid is not None:
+            return np.asarray(self.grid)
+        size = self.tile_size
+        log_odds = np.zeros((self.nx, self.ny), dtype=np.float32)
+        for (i, j), tile in self.tiles.items():
+            block = log_odds[i * size:(i + 1) * size, j * size:(j + 1) * size]
+            block[...] = tile[:block.shape[0], :block.shape[1]]
+        return log_odds
+
+    #Occupancy probability of every cell, 0.5 for unknown
+    def probabilities(self):
+        return 1 / (1 + np.exp(-self.log_odds()))
+
+    # Description: Occupancy probability at map coordinates, 0.5 outside the grid and in unallocated tiles
+    def probability(self, x, y):
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        ix = np.floor((x.ravel() - self.x_min) / self.resolution).astype(np.int64)
+        iy = np.floor((y.ravel() - self.y_min) / self.resolution).astype(np.int64)
+        within = np.flatnonzero((ix >= 0) & (ix < self.nx) & (iy >= 0) & (iy < self.ny))
+        log_odds = np.zeros(len(ix))
+        if self.grid is not None:
+            log_odds[within] = self.grid[ix[within], iy[within]]
+        elif len(within):
+            #points grouped by tile as in add, one read per allocated tile
+            size = self.tile_size
+            cx, cy = ix[within], iy[within]
+            tile_ids = (cx // size) * (self.ny // size + 1) + cy // size
+            order = np.argsort(tile_ids, kind='stable')
+            cx, cy, tile_ids, within = cx[order], cy[order], tile_ids[order], within[order]
+            bounds = np.flatnonzero(np.diff(tile_ids)) + 1
+            for start, stop in zip(np.concatenate(([0], bounds)).tolist(), np.concatenate((bounds, [len(cx)])).tolist()):
+                tile = self.tiles.get((int(cx[start]) // size, int(cy[start]) // size))
+                if tile is not None:
+                    log_odds[within[start:stop]] = tile[cx[start:stop] % size, cy[start:stop] % size]
+        return (1 / (1 + np.exp(-log_odds))).reshape(x.shape)
+
+    #Writes the memory-mapped storage to disk
+    def flush(self):
+        if self.grid is not None and isinstance(self.grid, np.memmap):
+            self.grid.flush()
+        for tile in self.tiles.values():
+            if isinstance(tile, np.memmap):
+                tile.flush()
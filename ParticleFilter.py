@@ -0,0 +1,142 @@
+import numpy as np
+
+from KalmanFilter import append_estimate
+from Trajectory import Trajectory
+
+class ParticleFilter:
+    # Description: Monte Carlo localization with the same predict/update/path interface as KalmanFilter
+    # Particles are rows of one (N, 3) array [x, y, orientation], so motion sampling, range-bearing likelihoods and
+    # low-variance resampling are all vectorized. Without an initial state the particles are spread over the whole map
+    # (global localization). The particle count adapts with KLD-sampling: it shrinks once the estimate has converged.
+
+    def __init__(self, process_noise, measurement_noise, robot, map, initial_state=None, initial_covariance=None,
+                 max_particles=20000, min_particles=500, kld_error=0.05, kld_z=2.326, bin_size=(10, 10, np.deg2rad(10)), seed=None):
+        self.process_noise = process_noise  # Process noise covariance matrix
+        self.measurement_noise = measurement_noise  # Measurement noise covariance matrix
+        self.robot = robot
+        self.map = map
+        self.rng = np.random.default_rng(seed)
+
+        self.max_particles = max_particles
+        self.min_particles = min_particles
+        self.kld_error = kld_error      # Maximum KL divergence between the particle and the true distribution
+        self.kld_z = kld_z              # Upper standard normal quantile, 2.326 for 99% confidence
+        self.bin_size = np.array(bin_size)
+
+        if initial_state is None:
+            self.particles = np.column_stack((
+                self.rng.uniform(0, map.width, max_particles),
+                self.rng.uniform(0, map.height, max_particles),
+                self.rng.uniform(0, 2 * np.pi, max_particles)))
+        else:
+            if initial_covariance is None:
+                initial_covariance = np.zeros((3, 3))
+            self.particles = self.rng.multivariate_normal(initial_state, initial_covariance, max_particles)
+            self.particles[:, 2] %= 2 * np.pi
+        self.log_weights = np.zeros(len(self.particles))
+
+        self.state = np.zeros(3)
+        self.covariance = np.zeros((3, 3))
+        self.estimate()
+        self.path = Trajectory((self.state[0], self.state[1]))
+
+        self.covariance_history = []    # holds ellipse properties from covariance matrices - [(x, y), (major-axis, minor-axis, angle)]
+
+    @property
+    def weights(self):
+        weights = np.exp(self.log_weights - self.log_weights.max())
+        return weights / weights.sum()
+
+    # Description: Moves every particle with the motion model of KalmanFilter.predict plus sampled process noise
+    def predict(self, control_input, dt):
+        v, omega = control_input
+        theta = self.particles[:, 2]
+
+        self.particles[:, 0] += v * np.cos(theta) * dt
+        self.particles[:, 1] += v * np.sin(theta) * dt
+        self.particles[:, 2] += omega * dt
+        self.particles += self.rng.standard_normal(self.particles.shape) @ np.linalg.cholesky(self.process_noise).T
+        self.particles[:, 2] %= 2 * np.pi
+
+    # Description: Weighs the particles with the range-bearing likelihood of all measurements, resamples when the
+    # weights have degenerated, and records the estimate like KalmanFilter.update
+    def update(self, measurements):
+        measurements = list(measurements)
+        if len(measurements) > 0:
+            z = np.array([(distance, bearing) for distance, bearing, _ in measurements], dtype=float)
+            features = np.array([(feature[0], feature[1]) for _, _, feature in measurements], dtype=float)
+
+            # Expected measurements of every particle for every feature - (N, m), as in calculate_expected_measurement
+            dx = features[:, 0] - self.particles[:, 0, np.newaxis]
+            dy = features[:, 1] - self.particles[:, 1, np.newaxis]
+            distance_res = z[:, 0] - np.sqrt(dx**2 + dy**2)
+            bearing_res = z[:, 1] - (np.arctan2(dy, dx) - self.particles[:, 2, np.newaxis])
+            bearing_res = (bearing_res + np.pi) % (2 * np.pi) - np.pi
+
+            # Gaussian log-likelihood, summed over the measurements
+            R_inv = np.linalg.solve(self.measurement_noise, np.eye(2))
+            mahalanobis = (R_inv[0, 0] * distance_res**2 + (R_inv[0, 1] + R_inv[1, 0]) * distance_res * bearing_res
+                           + R_inv[1, 1] * bearing_res**2)
+            self.log_weights += -0.5 * mahalanobis.sum(axis=1)
+            self.resample_if_degenerate()
+
+        self.estimate()
+        self.record_estimate()
+
+    # Description: Weighs the particles with the wall sensor readings, the expected readings of every particle are
+    # array lookups in a RangeTable of the map instead of ray casts. Call it before update, which records the estimate
+    def update_ranges(self, wall_sensor_distances, range_table, range_noise=2.0):
+        sensors = self.robot.wall_sensors
+        angles = np.array([sensor.angle for sensor in sensors])
+        lengths = np.array([sensor.length for sensor in sensors], dtype=float)
+
+        # Expected readings of every particle for every sensor - (N, sensors)
+        expected = range_table.sensor_distances(self.particles[:, 0, np.newaxis], self.particles[:, 1, np.newaxis],
+                                                self.particles[:, 2, np.newaxis] + angles, self.robot.radius, lengths)
+        residuals = np.asarray(wall_sensor_distances, dtype=float) - expected
+        self.log_weights += -0.5 * np.sum(residuals**2, axis=1) / range_noise**2
+        self.resample_if_degenerate()
+
+    # Resamples when the effective number of particles has dropped below half of the particles
+    def resample_if_degenerate(self):
+        weights = self.weights
+        if 1 / np.sum(weights**2) < len(self.particles) / 2:
+            self.resample(weights)
+
+    # Description: Low-variance resampling with the number of particles chosen by KLD-sampling
+    def resample(self, weights):
+        # Systematic draw of the maximum number of particles, shuffled so every prefix is a random sample
+        count = self.max_particles
+        positions = (self.rng.random() + np.arange(count)) / count
+        indices = np.minimum(np.searchsorted(np.cumsum(weights), positions), len(weights) - 1)
+        indices = self.rng.permutation(indices)
+
+        # KLD-sampling: k occupied histogram bins after each draw need n(k) particles, keep the first prefix that has them
+        bins = np.floor(self.particles[indices] / self.bin_size).astype(np.int64)
+        keys = (bins[:, 0] * 1000003 + bins[:, 1]) * 1000003 + bins[:, 2]
+        first = np.zeros(count, dtype=bool)
+        first[np.unique(keys, return_index=True)[1]] = True
+        k = np.cumsum(first)
+        required = np.full(count, float(self.min_particles))
+        many = k > 1
+        a = 2 / (9 * (k[many] - 1))
+        required[many] = np.maximum((k[many] - 1) / (2 * self.kld_error) * (1 - a + np.sqrt(a) * self.kld_z)**3, self.min_particles)
+        enough = np.flatnonzero(np.arange(1, count + 1) >= required)
+        size = enough[0] + 1 if len(enough) > 0 else count
+
+        self.particles = self.particles[indices[:size]]
+        self.log_weights = np.zeros(size)
+
+    # Description: Weighted mean and covariance of the particles, with the circular mean for the orientation
+    def estimate(self):
+        weights = self.weights
+        theta = np.arctan2(weights @ np.sin(self.particles[:, 2]), weights @ np.cos(self.particles[:, 2])) % (2 * np.pi)
+        self.state = np.array([weights @ self.particles[:, 0], weights @ self.particles[:, 1], theta])
+
+        residuals = self.particles - self.state
+        residuals[:, 2] = (residuals[:, 2] + np.pi) % (2 * np.pi) - np.pi
+        self.covariance = (residuals * weights[:, np.newaxis]).T @ residuals
+
+    #Stores the estimate in the path and every 100 steps its covariance ellipse, as KalmanFilter does
+    def record_estimate(self):
+        append_estimate(self, self.covariance)
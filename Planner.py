@@ -0,0 +1,421 @@
+import hashlib
+import heapq
+import math
+import os
+import tempfile
+import numpy as np
+
+import Geometry
+from SpatialIndex import GridIndex
+
+class Planner:
+    # Description: Path planning for the robot over a visibility roadmap of the map
+    # The configuration space is the map with every wall inflated by radius + clearance (the robot is a disc, so the
+    # robot center has to stay that far from the walls). Roadmap nodes sit on a polygon of corner_nodes vertices
+    # around every obstacle corner (Map.extract_features), whose sides just clear the inflated corner; nodes inside
+    # the inflated walls are dropped. Every node is connected to the nearest candidates nodes up to max_edge_length
+    # away that it sees in the configuration space (a k-nearest visibility roadmap, the edge count stays linear in
+    # the nodes on large maps), checked in batches against the walls near each edge through the map's grid index.
+    # The roadmap is built once and cached on disk (named after a hash of the walls and settings, like RangeTable).
+    # Walls added to the map later are folded in by update: the nodes and edges they block are removed and the
+    # corners of the new walls are connected, without rebuilding. A query only connects start and goal to the
+    # nodes they see and runs A*, replanning towards the same goal follows a cached cost-to-goal tree instead, so at
+    # control rate a query costs a few visibility checks and a walk along the path.
+
+    def __init__(self, map, radius=20, clearance=5, corner_nodes=8, max_edge_length=400, candidates=32, cache_dir=None, chunk_size=4096):
+        self.map = map
+        self.radius = radius
+        self.clearance = clearance
+        self.inflation = radius + clearance     #distance the roadmap keeps from every wall
+        self.corner_nodes = corner_nodes
+        self.max_edge_length = max_edge_length
+        self.candidates = candidates            #nearest nodes in range every new node tries to connect to
+        self.cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), 'roadmaps')
+        self.chunk_size = chunk_size
+
+        self.nodes = np.zeros((0, 2))           #node positions, removed nodes keep their row
+        self.alive = np.zeros(0, dtype=bool)
+        self.edges = np.zeros((0, 2), dtype=np.int64)     #(i, j) node pairs with i < j
+        self.neighbours = []                    #node -> {neighbour: edge length}, the graph A* walks
+        self.corners = set()                    #corners that already have nodes
+        self.node_index = None                  #grid over the nodes for the start and goal connections
+        self.goal_links = None                  #(goal, node ids, distances) of the last goal
+        self.goal_tree = None                   #(cost to the goal, next node towards it) of every node for the last goal
+
+        self.wall_count = map.wall_count
+        self.cache_file = self.cache_path()
+        if os.path.exists(self.cache_file):
+            self.load(self.cache_file)
+        else:
+            self.build()
+            self.save(self.cache_file)
+
+    #Cache file of the roadmap of the current walls, the map bounds limit where nodes go (ring)
+    def cache_path(self):
+        key = hashlib.sha1(np.ascontiguousarray(self.map.segments, dtype=np.float64).tobytes())
+        key.update(repr((self.map.width, self.map.height, self.radius, self.clearance, self.corner_nodes, self.max_edge_length, self.candidates)).encode())
+        return os.path.join(self.cache_dir, key.hexdigest() + '.npz')
+
+    def build(self):
+        self.add_nodes(self.map.feature_coords)
+
+    # Description: Candidate nodes around corners (an (N, 2) array), keeps those clear of all walls and within the map
+    # The polygon circumscribes a circle of radius inflation + clearance, so its sides keep clearance to the inflated corner
+    def ring(self, corners):
+        angles = (np.arange(self.corner_nodes) + 0.5) * 2 * math.pi / self.corner_nodes
+        distance = (self.inflation + self.clearance) / math.cos(math.pi / self.corner_nodes)
+        points = (corners[:, np.newaxis, :] + distance * np.column_stack((np.cos(angles), np.sin(angles)))).reshape(-1, 2)
+        inside = ((points[:, 0] >= 0) & (points[:, 0] <= self.map.width) & (points[:, 1] >= 0) & (points[:, 1] <= self.map.height))
+        points = points[inside]
+        return points[self.clear_points(points, self.map.segments, self.map.index)]
+
+    #Whether every point is more than inflation away from all segments, index is a GridIndex over those segments
+    def clear_points(self, points, segments, index):
+        clear = np.ones(len(points), dtype=bool)
+        if len(points) == 0 or len(segments) == 0:
+            return clear
+        queries, walls = index.pairs_in_boxes(points[:, 0], points[:, 1], points[:, 0], points[:, 1], self.inflation, index.wall_starts, index.wall_ids)
+        distances = Geometry.point_distances_squared(points[queries, 0], points[queries, 1], *self.segment_terms(segments[walls]))
+        clear[queries[distances <= self.inflation ** 2]] = False
+        return clear
+
+    @staticmethod
+    def segment_terms(segments):
+        ax, ay = segments[:, 0], segments[:, 1]
+        ex, ey = segments[:, 2] - ax, segments[:, 3] - ay
+        return ax, ay, ex, ey, ex * ex + ey * ey
+
+    # Description: Whether the robot center can move from starts to ends ((N, 2) arrays) keeping more than clearance
+    # from all segments, checked chunk_size moves at a time against the walls near each move
+    def visible(self, starts, ends, clearance, segments=None, index=None):
+        if segments is None:
+            segments, index = self.map.segments, self.map.index
+        visible = np.ones(len(starts), dtype=bool)
+        if len(segments) == 0:
+            return visible
+        for start in range(0, len(starts), self.chunk_size):
+            a, b = starts[start:start + self.chunk_size], ends[start:start + self.chunk_size]
+            moves, walls = index.pairs_in_boxes(a[:, 0], a[:, 1], b[:, 0], b[:, 1], clearance, index.wall_starts, index.wall_ids)
+            distances = Geometry.segment_distances(a[moves], b[moves], segments[walls], pairwise=True)
+            visible[start + moves[distances <= clearance]] = False
+        return visible
+
+    # Description: Adds the nodes around corners not seen before and connects them to each other and to the existing
+    # nodes they see
+    def add_corners(self, corners):
+        corners = np.unique(np.asarray(corners, dtype=float).reshape(-1, 2) + 0.0, axis=0)
+        keep = [corner not in self.corners for corner in map(tuple, corners.tolist())]
+        self.add_nodes(corners[np.array(keep, dtype=bool)])
+
+    def add_nodes(self, corners):
+        self.corners.update(map(tuple, corners.tolist()))
+        points = self.ring(corners)
+        first = len(self.nodes)
+        self.nodes = np.concatenate((self.nodes, points))
+        self.alive = np.concatenate((self.alive, np.ones(len(points), dtype=bool)))
+        self.neighbours.extend({} for _ in range(len(points)))
+        if len(self.nodes) == 0:
+            return
+
+        #pairs of a new node with its nearest nodes in range, each pair once. Pairs are first gathered within the
+        #radius that holds about twice the candidates at the average node density, nodes with fewer candidates
+        #there search up to max_edge_length
+        extent = np.ptp(self.nodes, axis=0)
+        radius = min(math.sqrt(2 * self.candidates * max(extent[0] * extent[1], 1) / (math.pi * len(self.nodes))), self.max_edge_length)
+        self.node_index = GridIndex(np.zeros((0, 4)), self.nodes, max(radius, 25))
+        if len(points) == 0:
+            return
+        new = np.arange(first, len(self.nodes))
+        queries, others, lengths = self.pairs_within(points, radius)
+        counts = np.bincount(queries, minlength=len(points))
+        sparse = np.flatnonzero(counts < self.candidates)
+        if radius < self.max_edge_length and len(sparse) > 0:
+            far = self.pairs_within(points[sparse], self.max_edge_length)
+            keep = counts[queries] >= self.candidates
+            queries = np.concatenate((queries[keep], sparse[far[0]]))
+            others = np.concatenate((others[keep], far[1]))
+            lengths = np.concatenate((lengths[keep], far[2]))
+        nodes = new[queries]
+        keep = others != nodes
+        queries, nodes, others, lengths = queries[keep], nodes[keep], others[keep], lengths[keep]
+        order = np.lexsort((lengths, queries))
+        rank = np.arange(len(order)) - np.searchsorted(queries[order], queries[order])
+        order = order[rank < self.candidates]
+        nodes, others, lengths = nodes[order], others[order], lengths[order]
+        #a pair found from both of its new nodes is checked once
+        keys = np.unique(np.minimum(nodes, others) * len(self.nodes) + np.maximum(nodes, others), return_index=True)[1]
+        nodes, others, lengths = nodes[keys], others[keys], lengths[keys]
+
+        visible = self.visible(self.nodes[nodes], self.nodes[others], self.inflation)
+        self.add_edges(np.column_stack((np.minimum(nodes, others), np.maximum(nodes, others)))[visible], lengths[visible])
+
+    #(point, node, distance) of the alive nodes within radius of points
+    def pairs_within(self, points, radius):
+        index = self.node_index
+        queries, others = index.pairs_in_boxes(points[:, 0], points[:, 1], points[:, 0], points[:, 1], radius,
+                                               index.feature_starts, index.feature_ids)
+        lengths = np.hypot(*(self.nodes[others] - points[queries]).T)
+        keep = self.alive[others] & (lengths <= radius)
+        return queries[keep], others[keep], lengths[keep]
+
+    def add_edges(self, edges, lengths):
+        self.edges = np.concatenate((self.edges, edges))
+        for (i, j), length in zip(edges.tolist(), lengths.tolist()):
+            self.neighbours[i][j] = length
+            self.neighbours[j][i] = length
+
+    # Description: Folds the walls added to the map since the roadmap was built into it, nodes and edges within
+    # inflation of a new wall are removed, the new corners get nodes. Returns whether the roadmap changed
+    def update(self):
+        if self.map.wall_count == self.wall_count:
+            return False
+        segments = self.map.segments[self.wall_count:]
+        self.wall_count = self.map.wall_count
+        self.goal_links = None
+        self.goal_tree = None
+        index = GridIndex(segments, np.zeros((0, 2)))
+
+        blocked_nodes = np.flatnonzero(self.alive & ~self.clear_points(self.nodes, segments, index))
+        self.alive[blocked_nodes] = False
+        i, j = self.edges[:, 0], self.edges[:, 1]
+        blocked = ~(self.alive[i] & self.alive[j])
+        blocked[~blocked] = ~self.visible(self.nodes[i[~blocked]], self.nodes[j[~blocked]], self.inflation, segments, index)
+        for a, b in self.edges[blocked].tolist():
+            del self.neighbours[a][b]
+            del self.neighbours[b][a]
+        self.edges = self.edges[~blocked]
+
+        self.add_corners(segments.reshape(-1, 2))
+        self.cache_file = self.cache_path()
+        self.save(self.cache_file)
+        return True
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = path + '.' + str(os.getpid()) + '.tmp.npz'
+        np.savez(temporary, nodes=self.nodes, alive=self.alive, edges=self.edges, corners=np.array(sorted(self.corners)).reshape(-1, 2))
+        os.replace(temporary, path)
+
+    def load(self, path):
+        with np.load(path) as data:
+            self.nodes, self.alive, self.edges = data['nodes'], data['alive'], data['edges']
+            self.corners = set(map(tuple, data['corners'].tolist()))
+        self.neighbours = [{} for _ in range(len(self.nodes))]
+        lengths = np.hypot(*(self.nodes[self.edges[:, 1]] - self.nodes[self.edges[:, 0]]).T)
+        for (i, j), length in zip(self.edges.tolist(), lengths.tolist()):
+            self.neighbours[i][j] = length
+            self.neighbours[j][i] = length
+        self.node_index = GridIndex(np.zeros((0, 4)), self.nodes, max(self.max_edge_length / 4, 25))
+
+    # Description: Nodes a point (start or goal) sees, with the distances to them. The nearest neighbours nodes are
+    # tried first and the rest only when none of them is visible. Links keep the clearance of the roadmap where there
+    # are any, otherwise only the robot radius (the robot may stand closer to a wall than the roadmap keeps)
+    def links(self, point):
+        if self.node_index is None:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        ids = self.node_index.features_within(point[0], point[1], self.max_edge_length)
+        ids = ids[self.alive[ids]]
+        distances = np.hypot(*(self.nodes[ids] - point).T)
+        order = np.argsort(distances, kind='stable')
+        ids, distances = ids[order], distances[order]
+        for group in (slice(0, self.candidates), slice(self.candidates, None)):
+            points = self.nodes[ids[group]]
+            starts = np.broadcast_to(np.asarray(point, dtype=float), points.shape)
+            for clearance in (self.inflation, self.radius):
+                visible = self.visible(starts, points, clearance)
+                if visible.any():
+                    return ids[group][visible], distances[group][visible]
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    # Description: Shortest path from start to goal over the roadmap, as a list of (x, y) waypoints from start to goal,
+    # or None when the goal cannot be reached. Walls added to the map since the last query are folded in first.
+    # A new goal is searched with A*. Asked for the same goal again (replanning while driving there) the planner
+    # computes the cost to the goal of every node once, later queries then only pick the best start link
+    def plan(self, start, goal):
+        self.update()
+        start = (float(start[0]), float(start[1]))
+        goal = (float(goal[0]), float(goal[1]))
+        if self.visible(np.array([start]), np.array([goal]), self.radius)[0]:
+            return [start, goal]
+
+        #the goal usually stays while the start moves, its links are kept until the goal or the walls change
+        if self.goal_links is None or self.goal_links[0] != goal:
+            self.goal_links = (goal,) + self.links(goal)
+            self.goal_tree = None
+        elif self.goal_tree is None:
+            self.goal_tree = self.costs_to_goal(self.goal_links[1].tolist(), self.goal_links[2].tolist())
+        _, goal_ids, goal_distances = self.goal_links
+        start_ids, start_distances = self.links(start)
+        if self.goal_tree is not None:
+            nodes = self.follow_tree(start_ids, start_distances)
+        else:
+            nodes = self.search(start_ids.tolist(), start_distances.tolist(), dict(zip(goal_ids.tolist(), goal_distances.tolist())), goal)
+        if nodes is None:
+            return None
+        return [start] + [tuple(point) for point in self.nodes[nodes].tolist()] + [goal]
+
+    # Description: Dijkstra from the goal links over the whole roadmap, returns the cost to the goal of every node
+    # (inf when unreachable) and the next node on the way there (-1 for the goal itself)
+    def costs_to_goal(self, goal_ids, goal_distances):
+        costs = [math.inf] * len(self.nodes)
+        next_nodes = [-1] * len(self.nodes)
+        queue = []
+        for node, distance in zip(goal_ids, goal_distances):
+            if distance < costs[node]:
+                costs[node] = distance
+                heapq.heappush(queue, (distance, node))
+        while queue:
+            cost, node = heapq.heappop(queue)
+            if cost > costs[node]:
+                continue
+            for neighbour, length in self.neighbours[node].items():
+                total = cost + length
+                if total < costs[neighbour]:
+                    costs[neighbour] = total
+                    next_nodes[neighbour] = node
+                    heapq.heappush(queue, (total, neighbour))
+        return np.array(costs), next_nodes
+
+    #Roadmap nodes of the shortest path from the start links along the goal tree
+    def follow_tree(self, start_ids, start_distances):
+        costs, next_nodes = self.goal_tree
+        if len(start_ids) == 0:
+            return None
+        totals = start_distances + costs[start_ids]
+        best = int(np.argmin(totals))
+        if not np.isfinite(totals[best]):
+            return None
+        nodes = [int(start_ids[best])]
+        while next_nodes[nodes[-1]] >= 0:
+            nodes.append(next_nodes[nodes[-1]])
+        return nodes
+
+    # Description: A* from the start links to the goal links with the straight line distance as heuristic,
+    # returns the roadmap nodes of the path in order
+    def search(self, start_ids, start_distances, goal_distances, goal):
+        if not start_ids or not goal_distances:
+            return None
+        heuristic = np.hypot(self.nodes[:, 0] - goal[0], self.nodes[:, 1] - goal[1]).tolist()
+        GOAL = -1
+
+        costs = {}
+        parents = {}
+        queue = []
+        for node, distance in zip(start_ids, start_distances):
+            if distance < costs.get(node, math.inf):
+                costs[node] = distance
+                parents[node] = None
+                heapq.heappush(queue, (distance + heuristic[node], distance, node))
+        closed = set()
+        while queue:
+            _, cost, node = heapq.heappop(queue)
+            if node == GOAL:
+                path = []
+                node = parents[GOAL]
+                while node is not None:
+                    path.append(node)
+                    node = parents[node]
+                return path[::-1]
+            if node in closed:
+                continue
+            closed.add(node)
+
+            if node in goal_distances:
+                total = cost + goal_distances[node]
+                if total < costs.get(GOAL, math.inf):
+                    costs[GOAL] = total
+                    parents[GOAL] = node
+                    heapq.heappush(queue, (total, total, GOAL))
+            for neighbour, length in self.neighbours[node].items():
+                total = cost + length
+                if total < costs.get(neighbour, math.inf):
+                    costs[neighbour] = total
+                    parents[neighbour] = node
+                    heapq.heappush(queue, (total + heuristic[neighbour], total, neighbour))
+        return None
+
+
+#Smallest signed angle from the current heading to the target heading, in [-π, π)
+def heading_error(target, current):
+    return (target - current + math.pi) % (2 * math.pi) - math.pi
+
+# Description: Open loop motor script [(duration, v_left, v_right)] for Simulation.run_script that follows path
+# (waypoints from Planner.plan) from the given orientation: for every waypoint the robot turns on the spot towards it
+# (one motor forward, the other backward) and then drives straight to it (both forward), with the motor values of
+# Robot.left_motor/right_motor. With dt the durations are whole ticks as run_script runs them, and every turn and
+# straight starts from the pose the rounded commands before it reach, so the rounding errors do not add up
+def motor_commands(path, orientation, power=100, radius=20, dt=None):
+    script = []
+    turn_rate = power / radius      #omega = (v_right - v_left) / (2 * radius) with the motors at ±power
+    x, y = path[0]
+    for x1, y1 in path[1:]:
+        turn = heading_error(math.atan2(y1 - y, x1 - x), orientation)
+        duration = abs(turn) / turn_rate
+        if dt is not None:
+            duration = round(duration / dt) * dt
+        if duration > 0:
+            script.append((duration, -power if turn > 0 else power, power if turn > 0 else -power))
+            orientation += math.copysign(duration * turn_rate, turn)
+
+        duration = math.hypot(x1 - x, y1 - y) / power
+        if dt is not None:
+            duration = round(duration / dt) * dt
+        if duration > 0:
+            script.append((duration, power, power))
+            x += power * duration * math.cos(orientation)
+            y += power * duration * math.sin(orientation)
+    return script
+
+
+class PathFollower:
+    # Description: Closed loop controller driving the robot to goal, called as controller(simulation) by Simulation.run
+    # (or the Scheduler in main.py) and returning (v_left, v_right) with the motor values of Robot.left_motor/right_motor.
+    # The path is replanned from the current pose every replan_interval calls. Towards the next waypoint the robot
+    # turns on the spot when it is off by more than turn_angle, steers with one motor off when off by more than
+    # steer_angle and drives straight otherwise. With estimate the pose comes from the filter instead of the robot.
+    # done is set once the robot is within goal_tolerance of the goal, path is None when the goal is unreachable
+
+    def __init__(self, planner, goal, power=100, replan_interval=1, turn_angle=0.5, steer_angle=0.05, goal_tolerance=5, estimate=False):
+        self.planner = planner
+        self.goal = goal
+        self.power = power
+        self.replan_interval = replan_interval
+        self.turn_angle = turn_angle
+        self.steer_angle = steer_angle
+        self.goal_tolerance = goal_tolerance
+        self.estimate = estimate
+
+        self.calls = 0
+        self.path = None
+        self.waypoint = 1       #index in path of the waypoint the robot drives to
+        self.done = False
+
+    def __call__(self, simulation):
+        if self.estimate and simulation.kf is not None:
+            x, y, orientation = simulation.kf.state[:3].tolist()
+        else:
+            robot = simulation.robot
+            x, y, orientation = robot.x, robot.y, robot.orientation
+
+        self.done = math.hypot(self.goal[0] - x, self.goal[1] - y) <= self.goal_tolerance
+        if self.done:
+            return 0, 0
+        if self.path is None or self.calls % self.replan_interval == 0:
+            self.path = self.planner.plan((x, y), self.goal)
+            self.waypoint = 1
+        self.calls += 1
+        if self.path is None:
+            return 0, 0
+
+        #waypoints count as reached within goal_tolerance, the goal itself ends the run above
+        while self.waypoint < len(self.path) - 1 and math.hypot(self.path[self.waypoint][0] - x, self.path[self.waypoint][1] - y) <= self.goal_tolerance:
+            self.waypoint += 1
+        target_x, target_y = self.path[self.waypoint]
+        error = heading_error(math.atan2(target_y - y, target_x - x), orientation)
+
+        power = self.power
+        if abs(error) > self.turn_angle:
+            return (-power, power) if error > 0 else (power, -power)
+        if abs(error) > self.steer_angle:
+            return (0, power) if error > 0 else (power, 0)
+        return power, power
@@ -0,0 +1,134 @@
+import csv
+import json
+import time
+import numpy as np
+
+class Timings:
+    # Description: Call count, total time and the durations of the last window calls of one timed method
+
+    def __init__(self, window=1024):
+        self.samples = np.zeros(window)
+        self.window = window
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, duration):
+        self.samples[self.count % self.window] = duration
+        self.count += 1
+        self.total += duration
+
+    def recent(self):
+        return self.samples[:min(self.count, self.window)]
+
+    #Histogram of the recent durations over log-spaced bins from 1 µs to 1 s, returns (counts, edges in seconds)
+    def histogram(self, bins=24):
+        edges = np.logspace(-6, 0, bins + 1)
+        return np.histogram(np.clip(self.recent(), edges[0], edges[-1]), edges)
+
+
+class Profiler:
+    # Description: Timing of selected methods of the simulation objects, with rolling percentiles over the last calls
+    # Methods are registered with attach and only wrapped while the profiler is enabled, disabling it puts the
+    # original methods back, so a disabled profiler costs nothing. Results are shown by Renderer.draw_profiler
+    # and/or written to export_path (.csv or .json) every export_interval seconds by tick.
+
+    def __init__(self, window=1024, export_path=None, export_interval=10):
+        self.window = window
+        self.export_path = export_path
+        self.export_interval = export_interval
+
+        self.targets = []       #[(object, method name, label)]
+        self.stats = {}         #label -> Timings
+        self.active = False
+        self.last_export = time.perf_counter()
+
+    @property
+    def enabled(self):
+        return self.active
+
+    @enabled.setter
+    def enabled(self, enabled):
+        if enabled and not self.active:
+            for target, name, label in self.targets:
+                self.wrap(target, name, label)
+        elif not enabled and self.active:
+            for target, name, _ in self.targets:
+                self.unwrap(target, name)
+        self.active = bool(enabled)
+
+    #Registers methods of an object for timing under the labels "prefix.name"
+    def attach(self, target, names, prefix=None):
+        prefix = prefix or type(target).__name__
+        for name in names:
+            label = prefix + "." + name
+            self.targets.append((target, name, label))
+            self.stats.setdefault(label, Timings(self.window))
+            if self.active:
+                self.wrap(target, name, label)
+
+    #Replaces the method on the instance by a timed version, the class keeps the original
+    def wrap(self, target, name, label):
+        method = getattr(target, name)
+        add = self.stats[label].add
+        clock = time.perf_counter
+
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                add(clock() - start)
+
+        setattr(target, name, timed)
+
+    def unwrap(self, target, name):
+        if name in vars(target):
+            delattr(target, name)
+
+    def reset(self):
+        for label in self.stats:
+            self.stats[label] = Timings(self.window)
+        if self.active:
+            self.enabled = False
+            self.enabled = True
+
+    #One row per timed method that has been called, durations in milliseconds
+    def report(self):
+        rows = []
+        for label, timings in self.stats.items():
+            if timings.count == 0:
+                continue
+            p50, p99 = np.percentile(timings.recent(), [50, 99]) * 1000
+            rows.append({
+                'name': label,
+                'count': timings.count,
+                'mean_ms': timings.total / timings.count * 1000,
+                'p50_ms': p50,
+                'p99_ms': p99,
+                'max_ms': timings.recent().max() * 1000,
+                'total_s': timings.total,
+            })
+        return rows
+
+    def export(self, path):
+        rows = self.report()
+        if path.endswith('.json'):
+            for row in rows:
+                counts, edges = self.stats[row['name']].histogram()
+                row['histogram'] = {'edges_s': edges.tolist(), 'counts': counts.tolist()}
+            with open(path, 'w') as file:
+                json.dump({'time': time.time(), 'timings': rows}, file, indent=2)
+        else:
+            with open(path, 'w', newline='') as file:
+                writer = csv.DictWriter(file, ['name', 'count', 'mean_ms', 'p50_ms', 'p99_ms', 'max_ms', 'total_s'])
+                writer.writeheader()
+                writer.writerows(rows)
+
+    #Called once per frame, writes export_path when the export interval has passed
+    def tick(self):
+        if not self.active or self.export_path is None:
+            return
+        now = time.perf_counter()
+        if now - self.last_export >= self.export_interval:
+            self.last_export = now
+            self.export(self.export_path)
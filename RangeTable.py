@@ -0,0 +1,104 @@
+import hashlib
+import math
+import os
+import tempfile
+import numpy as np
+
+import Geometry
+
+class RangeTable:
+    # Description: Precomputed ray-cast distances of a static map, for sensor reads as array lookups
+    # The map bounds are rasterized into a lattice of points resolution apart and for every point and each of
+    # heading_bins directions the distance to the first wall is stored (max_range when nothing is hit).
+    # Lookups interpolate linearly between the 8 surrounding (x, y, heading) samples. The table is cached on disk
+    # as a .npy file named after a hash of the walls and the table settings, and opened memory-mapped.
+    # Interpolation smooths corners and thin walls within about one resolution, use the exact ray cast of
+    # WallSensor.check_intersect_all where that matters.
+
+    def __init__(self, map, resolution=5, heading_bins=72, max_range=120, cache_dir=None, chunk_size=1024):
+        self.resolution = resolution
+        self.heading_bins = heading_bins
+        self.max_range = max_range
+        self.cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), 'range_tables')
+
+        segments = map.segments
+        points = segments.reshape(-1, 2)
+        self.x_min, self.y_min = np.floor(points.min(axis=0) / resolution) * resolution
+        x_max, y_max = np.ceil(points.max(axis=0) / resolution) * resolution
+        self.nx = int(round((x_max - self.x_min) / resolution)) + 1
+        self.ny = int(round((y_max - self.y_min) / resolution)) + 1
+
+        key = hashlib.sha1(np.ascontiguousarray(segments, dtype=np.float64).tobytes())
+        key.update(repr((resolution, heading_bins, max_range)).encode())
+        self.key = key.hexdigest()
+        self.path = os.path.join(self.cache_dir, self.key + '.npy')
+
+        if not os.path.exists(self.path):
+            self.compute(map, chunk_size)
+        self.table = np.load(self.path, mmap_mode='r')    #(nx, ny, heading_bins) float32
+
+    # Description: Casts heading_bins rays from every lattice point, chunk_size points at a time, against the walls
+    # near them and writes the table to a temporary file that is renamed into the cache when complete
+    def compute(self, map, chunk_size):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        index = map.index
+        angles = np.arange(self.heading_bins) * 2 * math.pi / self.heading_bins
+        directions = self.max_range * np.column_stack((np.cos(angles), np.sin(angles)))
+
+        lattice_x, lattice_y = np.meshgrid(self.x_min + np.arange(self.nx) * self.resolution,
+                                           self.y_min + np.arange(self.ny) * self.resolution, indexing='ij')
+        lattice_x, lattice_y = lattice_x.ravel(), lattice_y.ravel()
+
+        temporary = self.path + '.' + str(os.getpid()) + '.tmp'
+        table = np.lib.format.open_memmap(temporary, mode='w+', dtype=np.float32, shape=(self.nx, self.ny, self.heading_bins))
+        rows = table.reshape(-1, self.heading_bins)
+        for start in range(0, len(lattice_x), chunk_size):
+            x, y = lattice_x[start:start + chunk_size], lattice_y[start:start + chunk_size]
+            distances = np.full((len(x), self.heading_bins), float(self.max_range))
+
+            #candidate (point, wall) pairs within range, every pair is checked in all directions
+            points, walls = index.pairs_in_boxes(x, y, x, y, self.max_range, index.wall_starts, index.wall_ids)
+            if len(points) > 0:
+                points = np.repeat(points, self.heading_bins)
+                headings = np.tile(np.arange(self.heading_bins), len(walls))
+                starts = np.column_stack((x[points], y[points]))
+                t = Geometry.ray_cast(starts, starts + directions[headings], index.segments[np.repeat(walls, self.heading_bins)], pairwise=True)
+                hit = np.isfinite(t)
+                np.minimum.at(distances, (points[hit], headings[hit]), t[hit] * self.max_range)
+            rows[start:start + len(x)] = distances
+        table.flush()
+        del rows, table
+        os.replace(temporary, self.path)
+
+    # Description: Distance from (x, y) to the first wall in direction angle, all arguments broadcast together
+    def lookup(self, x, y, angle):
+        x, y, angle = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float), np.asarray(angle, dtype=float))
+
+        #fractional lattice coordinates, positions outside the lattice are clamped to its border
+        fx = np.clip((x - self.x_min) / self.resolution, 0, self.nx - 1)
+        fy = np.clip((y - self.y_min) / self.resolution, 0, self.ny - 1)
+        fh = (angle % (2 * math.pi)) * self.heading_bins / (2 * math.pi)
+        ix = np.minimum(fx.astype(np.int64), self.nx - 2) if self.nx > 1 else np.zeros(fx.shape, dtype=np.int64)
+        iy = np.minimum(fy.astype(np.int64), self.ny - 2) if self.ny > 1 else np.zeros(fy.shape, dtype=np.int64)
+        ih = np.minimum(fh.astype(np.int64), self.heading_bins - 1)
+        wx, wy, wh = fx - ix, fy - iy, fh - ih
+        ix1 = np.minimum(ix + 1, self.nx - 1)
+        iy1 = np.minimum(iy + 1, self.ny - 1)
+        ih1 = (ih + 1) % self.heading_bins    #headings wrap around
+
+        table = self.table
+        result = 0
+        for cx, weight_x in ((ix, 1 - wx), (ix1, wx)):
+            for cy, weight_y in ((iy, 1 - wy), (iy1, wy)):
+                result = result + weight_x * weight_y * ((1 - wh) * table[cx, cy, ih] + wh * table[cx, cy, ih1])
+        return result
+
+    # Description: Wall sensor readings as WallSensor computes them, the distance between the sensor start point on the
+    # robot's edge and the first wall, or init_distance (length - radius) without a wall in range. A length beyond
+    # max_range raises ValueError, the table does not know the walls between max_range and length
+    def sensor_distances(self, x, y, angles, radius, length=None):
+        length = np.asarray(self.max_range if length is None else length, dtype=float)
+        if np.any(length > self.max_range):
+            raise ValueError("sensor length " + str(length.max()) + " exceeds the range table max_range " + str(self.max_range))
+        distances = self.lookup(x, y, angles)
+        return np.where(distances < length, np.abs(distances - radius), length - radius)
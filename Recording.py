@@ -0,0 +1,143 @@
+import json
+import os
+import numpy as np
+
+#One row per feature measurement, measurements of tick i are rows measurement_offsets[i]:measurement_offsets[i+1]
+MEASUREMENT_DTYPE = np.dtype([('distance', np.float64), ('bearing', np.float64), ('feature', np.float64, (2,))])
+
+class Recorder:
+    # Description: Streams every simulation tick to a directory of raw columnar files plus a meta.json
+    # Columns: dt, control_input (v, omega), ground truth pose (x, y, orientation), wall_sensor_distances and the
+    # feature measurements as MEASUREMENT_DTYPE rows with per-tick offsets. Ticks are buffered in chunks of
+    # chunk_size and appended to the column files, so memory use stays flat however long the run is.
+
+    def __init__(self, directory, sensor_count=12, chunk_size=4096, info=None):
+        self.directory = directory
+        self.sensor_count = sensor_count
+        self.chunk_size = chunk_size
+        self.info = info or {}     #free form run description stored in meta.json, e.g. seed and noise settings
+        os.makedirs(directory, exist_ok=True)
+
+        self.columns = {
+            'dt': ((), np.float64),
+            'control_input': ((2,), np.float64),
+            'pose': ((3,), np.float64),
+            'wall_sensor_distances': ((sensor_count,), np.float64),
+            'measurement_offsets': ((), np.int64),
+            'measurements': ((), MEASUREMENT_DTYPE),
+        }
+        self.files = {name: open(os.path.join(directory, name + '.bin'), 'wb') for name in self.columns}
+        self.buffers = {name: np.zeros((chunk_size,) + shape, dtype=dtype) for name, (shape, dtype) in self.columns.items()
+                        if name != 'measurements'}
+        self.measurements = []     #measurements of the buffered ticks, written with the chunk
+
+        self.ticks = 0              #ticks recorded, including the buffered ones
+        self.measurement_count = 0
+        self.buffered = 0
+
+        #offsets hold one more entry than there are ticks, the leading zero
+        np.zeros(1, dtype=np.int64).tofile(self.files['measurement_offsets'])
+
+    #Records one tick, measurements as handed to the filter - [(distance, bearing, (x, y))]
+    def record(self, dt, control_input, pose, wall_sensor_distances, measurements):
+        i = self.buffered
+        self.buffers['dt'][i] = dt
+        self.buffers['control_input'][i] = control_input
+        self.buffers['pose'][i] = pose
+        self.buffers['wall_sensor_distances'][i] = wall_sensor_distances
+        self.measurements.extend(measurements)
+        self.measurement_count += len(measurements)
+        self.buffers['measurement_offsets'][i] = self.measurement_count
+
+        self.buffered += 1
+        self.ticks += 1
+        if self.buffered == self.chunk_size:
+            self.flush()
+
+    #Records the tick the simulation has just taken
+    def record_simulation(self, simulation, dt, control_input):
+        robot = simulation.robot
+        self.record(dt, control_input, (robot.x, robot.y, robot.orientation), robot.wall_sensor_distances, simulation.measurements)
+
+    #Writes the buffered ticks and an up to date meta.json, the files are then a complete recording
+    def flush(self):
+        for name, buffer in self.buffers.items():
+            buffer[:self.buffered].tofile(self.files[name])
+        np.array(self.measurements, dtype=MEASUREMENT_DTYPE).tofile(self.files['measurements'])
+        self.buffered = 0
+        self.measurements = []
+        for file in self.files.values():
+            file.flush()
+
+        meta = {
+            'version': 1,
+            'ticks': self.ticks,
+            'measurements': self.measurement_count,
+            'columns': {name: {'shape': list(shape), 'dtype': np.lib.format.dtype_to_descr(np.dtype(dtype))}
+                        for name, (shape, dtype) in self.columns.items()},
+            'info': self.info,
+        }
+        with open(os.path.join(self.directory, 'meta.json'), 'w') as file:
+            json.dump(meta, file, indent=2)
+
+    def close(self):
+        if self.files is None:
+            return
+        self.flush()
+        for file in self.files.values():
+            file.close()
+        self.files = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Recording:
+    # Description: Read-only view of a Recorder directory, every column is a memory-mapped NumPy array
+    # (zero-copy, pages are only read when touched), and replay feeds the recorded ticks to a filter
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json')) as file:
+            self.meta = json.load(file)
+        self.ticks = self.meta['ticks']
+        self.info = self.meta['info']
+
+        counts = {'measurement_offsets': self.ticks + 1, 'measurements': self.meta['measurements']}
+        self.columns = {}
+        for name, column in self.meta['columns'].items():
+            dtype = np.lib.format.descr_to_dtype(column['dtype'])
+            shape = (counts.get(name, self.ticks),) + tuple(column['shape'])
+            if shape[0] == 0:
+                self.columns[name] = np.zeros(shape, dtype=dtype)
+            else:
+                self.columns[name] = np.memmap(os.path.join(directory, name + '.bin'), dtype=dtype, mode='r', shape=shape)
+
+        self.dt = self.columns['dt']
+        self.control_input = self.columns['control_input']
+        self.pose = self.columns['pose']
+        self.wall_sensor_distances = self.columns['wall_sensor_distances']
+        self.measurement_offsets = self.columns['measurement_offsets']
+        self.measurements = self.columns['measurements']
+
+    def __len__(self):
+        return self.ticks
+
+    #Measurements of one tick, a MEASUREMENT_DTYPE view that unpacks like [(distance, bearing, (x, y))]
+    def measurements_at(self, tick):
+        return self.measurements[self.measurement_offsets[tick]:self.measurement_offsets[tick + 1]]
+
+    # Description: Runs a filter (KalmanFilter, ParticleFilter or anything with predict/update) over the recorded
+    # ticks in the order of Simulation.step, as fast as the filter allows. Calls callback(tick, filter) after each
+    # tick when given, e.g. to collect the estimation error against self.pose
+    def replay(self, filter, start=0, stop=None, callback=None):
+        stop = self.ticks if stop is None else min(stop, self.ticks)
+        for tick in range(start, stop):
+            filter.predict(self.control_input[tick], self.dt[tick])
+            filter.update(self.measurements_at(tick))
+            if callback is not None:
+                callback(tick, filter)
+        return filter
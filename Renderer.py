@@ -0,0 +1,240 @@
+import math
+import time
+from collections import OrderedDict
+import pygame
+
+WHITE = (255, 255, 255)
+BLACK = (0, 0, 0)
+RED = (255, 0, 0)
+BLUE = (0, 0, 255)
+GREEN = (0, 255, 0)
+PURPLE_ALPHA = (160, 32, 240, 75)
+YELLOW = (255, 255, 0)
+
+class Renderer:
+    # Description: pygame front-end drawing the map, robot, sensors and filter estimate with as little work per frame
+    # as possible. Walls and features are pre-rendered once into a background surface, paths and covariance ellipses
+    # are accumulated into transparent overlays as they appear (composited over the background only while visible),
+    # text is rendered through an LRU glyph cache, and only the rectangles that changed since the last frame are
+    # pushed to the display.
+
+    def __init__(self, screen, map, font, glyph_cache_size=512):
+        self.screen = screen
+        self.map = map
+        self.font = font
+        self.height = screen.get_height()
+
+        #Enable or disable force vector sensor, sensor value, and motor value visibility
+        self.force_vector_visible = False
+        self.sensor_lines_visible = False
+        self.sensor_values_always_visible = False
+        self.feature_distance_visible = True
+        self.feature_bearing_visible = True
+        self.robot_orientation_visible = True
+        self.paths_visible = True
+        self.covariance_ellipse_visible = True
+        self.profiler_visible = False
+
+        self.profiler = None            #Profiler shown as overlay when profiler_visible
+        self.profiler_lines = []        #overlay text, refreshed every profiler_refresh seconds so it stays readable
+        self.profiler_refresh = 0.5
+        self.profiler_updated = 0
+
+        self.glyphs = OrderedDict()     #(text, color) -> rendered surface, least recently used first
+        self.glyph_cache_size = glyph_cache_size
+
+        self.background = pygame.Surface(screen.get_size())
+        self.background.fill(WHITE)
+        self.draw_walls(self.background)
+        self.draw_features(self.background)
+
+        #paths and covariance ellipses persist in overlays of their own, so their toggles can hide them again
+        self.path_overlay = pygame.Surface(screen.get_size(), pygame.SRCALPHA)
+        self.ellipse_overlay = pygame.Surface(screen.get_size(), pygame.SRCALPHA)
+        self.overlays_shown = None      #(paths_visible, covariance_ellipse_visible) of the last frame
+
+        self.trail_progress = {}        #number of points of each path already drawn onto the path overlay
+        self.ellipse_progress = {}      #number of ellipses of each covariance history already drawn onto the ellipse overlay
+
+        self.full_redraw = True
+        self.previous_rects = []        #rectangles of the dynamic layer drawn in the last frame
+        self.rects = []                 #rectangles of the dynamic layer drawn in this frame
+        self.changed_rects = []         #rectangles of the background or overlays that changed in this frame
+
+    #Rendered text from the glyph cache, rendering it on a miss and evicting the least recently used glyph when full
+    def text(self, text, color):
+        key = (text, color)
+        glyph = self.glyphs.get(key)
+        if glyph is None:
+            glyph = self.font.render(text, True, color)
+            self.glyphs[key] = glyph
+            if len(self.glyphs) > self.glyph_cache_size:
+                self.glyphs.popitem(last=False)
+        else:
+            self.glyphs.move_to_end(key)
+        return glyph
+
+    def blit_text(self, text, color, **position):
+        glyph = self.text(text, color)
+        self.rects.append(self.screen.blit(glyph, glyph.get_rect(**position)))
+
+    #Draws one frame of the robot and the filter estimate and pushes the changed areas to the display
+    def draw_frame(self, robot, kf):
+        overlays = (self.paths_visible, self.covariance_ellipse_visible)
+        if overlays != self.overlays_shown:
+            self.overlays_shown = overlays
+            self.full_redraw = True
+        if self.full_redraw:
+            self.restore(self.screen.get_rect())
+        else:
+            #restore the areas drawn over in the last frame
+            for rect in self.previous_rects:
+                self.restore(rect)
+        self.rects = []
+        self.changed_rects = []
+
+        self.draw_path(robot.path, BLUE)
+        self.draw_path(kf.path, RED)
+        self.draw_covariance_ellipse(kf.covariance_history, 20)
+
+        if getattr(kf, 'landmarks', None) is not None:
+            self.draw_landmarks(kf.landmarks)
+        self.draw_feature_lines(robot, robot.detected_features)
+        self.draw_robot(robot)
+        self.draw_sensors(robot)
+        self.draw_motor_values(robot)
+        self.draw_force_vector(robot)
+        if self.profiler_visible and self.profiler is not None:
+            self.draw_profiler(self.profiler)
+
+        if self.full_redraw:
+            pygame.display.flip()
+            self.full_redraw = False
+        else:
+            pygame.display.update(self.previous_rects + self.changed_rects + self.rects)
+        self.previous_rects = self.rects
+
+    #Static layer, drawn once into the background
+    def draw_walls(self, surface):
+        HEIGHT = self.height
+        for wall in self.map.walls:
+            pygame.draw.line(surface, BLACK, (wall.x1, HEIGHT - wall.y1), (wall.x2, HEIGHT - wall.y2), 2)
+
+    def draw_features(self, surface):
+        HEIGHT = self.height
+        #Draw small black circle on each feature position
+        for feature in self.map.features:
+            pygame.draw.circle(surface, BLACK, (feature.x, HEIGHT - feature.y), feature.radius, 0)
+
+    #Copies an area of the background with the visible overlays on top to the screen
+    def restore(self, rect):
+        self.screen.blit(self.background, rect, rect)
+        if self.paths_visible:
+            self.screen.blit(self.path_overlay, rect, rect)
+        if self.covariance_ellipse_visible:
+            self.screen.blit(self.ellipse_overlay, rect, rect)
+
+    #Copies a changed area of the background or an overlay to the screen
+    def update_background(self, rect):
+        self.restore(rect)
+        self.changed_rects.append(rect)
+
+    #Landmark positions estimated by a SLAMFilter, as rings around the features of the map
+    def draw_landmarks(self, landmarks):
+        HEIGHT = self.height
+        for x, y in landmarks.tolist():
+            self.rects.append(pygame.draw.circle(self.screen, RED, (int(x), HEIGHT - int(y)), 8, 2))
+
+    def draw_robot(self, robot):
+        HEIGHT = self.height
+        #Draw robot + line indicating forward
+        self.rects.append(pygame.draw.circle(self.screen, RED, (int(robot.x), HEIGHT - int(robot.y)), robot.radius))
+        end_x = robot.x + robot.radius * math.cos(robot.orientation)
+        end_y = HEIGHT - (robot.y + robot.radius * math.sin(robot.orientation))
+        self.rects.append(pygame.draw.line(self.screen, BLACK, (int(robot.x), HEIGHT - int(robot.y)), (int(end_x), int(end_y)), 2))
+
+        #Draw robot orientation [debugging]
+        if self.robot_orientation_visible:
+            self.blit_text(str(int(math.degrees(robot.orientation))) + "°", YELLOW,
+                           center=(int((robot.x+end_x)/2), int(((HEIGHT - robot.y)+end_y)/2)))
+
+    def draw_sensors(self, robot):
+        HEIGHT = self.height
+        for sensor in robot.wall_sensors:
+            #Draw wall sensor lines [debugging]
+            if self.sensor_lines_visible:
+                self.rects.append(pygame.draw.line(self.screen, GREEN, (int(sensor.start_coord[0]), HEIGHT - int(sensor.start_coord[1])),
+                                                   (int(sensor.end_coord[0]), int(HEIGHT - sensor.end_coord[1])), 1))
+            #Draw wall sensor distances (always [debugging] or only when inside sensor range)
+            if self.sensor_values_always_visible or int(sensor.distance < sensor.init_distance):
+                self.blit_text(str(int(sensor.distance)), BLUE, center=(int(sensor.text_coord[0]), HEIGHT - int(sensor.text_coord[1])))
+
+    def draw_motor_values(self, robot):
+        HEIGHT = self.height
+        motor_text_scale = robot.radius * 0.5
+        left_motor_text_x = robot.x - motor_text_scale * math.sin(robot.orientation)
+        left_motor_text_y = robot.y + motor_text_scale * math.cos(robot.orientation)
+        right_motor_text_x = robot.x + motor_text_scale * math.sin(robot.orientation)
+        right_motor_text_y = robot.y - motor_text_scale * math.cos(robot.orientation)
+        self.blit_text(str(robot.v_left), BLACK, center=(int(left_motor_text_x), HEIGHT - int(left_motor_text_y)))
+        self.blit_text(str(robot.v_right), BLACK, center=(int(right_motor_text_x), HEIGHT - int(right_motor_text_y)))
+
+    def draw_force_vector(self, robot):
+        HEIGHT = self.height
+        #Draw force vector [debugging]
+        if self.force_vector_visible:
+            force_scale = 1
+            force_end_x = robot.x + robot.velocity_vector[0] * force_scale
+            force_end_y = HEIGHT - (robot.y + robot.velocity_vector[1] * force_scale)
+            self.rects.append(pygame.draw.line(self.screen, BLUE, (int(robot.x), HEIGHT - int(robot.y)), (int(force_end_x), int(force_end_y)), 2))
+
+    def draw_feature_lines(self, robot, detected_features):
+        HEIGHT = self.height
+        #Draw lines between feature and robot when inside sensor range
+        for feature in detected_features:
+            self.rects.append(pygame.draw.line(self.screen, GREEN, (int(feature[2].x), HEIGHT - int(feature[2].y)), ((int(robot.x), int(HEIGHT - robot.y))), 1))
+            #Draw feature distance [debugging]
+            if self.feature_distance_visible:
+                self.blit_text(str(int(feature[0])), BLACK, midbottom=(int((feature[2].x + robot.x)/2), HEIGHT - int((feature[2].y + robot.y)/2)))
+            #Draw relative feature bearing [debugging]
+            if self.feature_bearing_visible:
+                self.blit_text(str(int(math.degrees(feature[1]))) + "°", RED, midtop=(int((feature[2].x + robot.x)/2), HEIGHT - int((feature[2].y + robot.y)/2)))
+
+    #Paths are drawn incrementally onto the path overlay, only the segments added since the last frame
+    def draw_path(self, path, color):
+        HEIGHT = self.height
+        drawn = self.trail_progress.get(id(path), 0)
+        #include the last drawn point so the new segments connect to the trail
+        points = path.since(max(drawn - 1, 0))
+        if len(points) > 1:
+            points[:, 1] = HEIGHT - points[:, 1]
+            self.update_background(pygame.draw.lines(self.path_overlay, color, False, points.tolist(), 2))
+        self.trail_progress[id(path)] = path.stored
+
+    # draws intermediate estimates of position and covariance, each ellipse is blended into the ellipse overlay once
+    def draw_covariance_ellipse(self, covariance_history, scale_factor):
+        HEIGHT = self.height
+        drawn = self.ellipse_progress.get(id(covariance_history), 0)
+        for ellipse in covariance_history[drawn:]:
+
+            x_axis = ellipse[1][0]*scale_factor
+            y_axis = ellipse[1][1]*scale_factor
+
+            ellipse_rect = pygame.Rect(0, 0, x_axis, y_axis)
+            ellipse_surface = pygame.Surface(ellipse_rect.size, pygame.SRCALPHA)
+            pygame.draw.ellipse(ellipse_surface, PURPLE_ALPHA, ellipse_rect)
+            rotated_surface = pygame.transform.rotate(ellipse_surface, ellipse[1][2])   # rotate ellipse using angle
+            blit_position = (ellipse[0][0] - x_axis / 2, HEIGHT - ellipse[0][1] - x_axis / 2)   # get center position of ellipse
+            self.update_background(self.ellipse_overlay.blit(rotated_surface, blit_position))
+        self.ellipse_progress[id(covariance_history)] = len(covariance_history)
+
+    #Overlay with the timings of the profiler, milliseconds over its recent calls
+    def draw_profiler(self, profiler):
+        now = time.perf_counter()
+        if now - self.profiler_updated >= self.profiler_refresh:
+            self.profiler_updated = now
+            self.profiler_lines = ["%-32s %8s %8s %8s" % ("", "calls", "p50 ms", "p99 ms")]
+            self.profiler_lines += ["%-32s %8d %8.3f %8.3f" % (row['name'], row['count'], row['p50_ms'], row['p99_ms'])
+                                    for row in profiler.report()]
+        for idx, line in enumerate(self.profiler_lines):
+            self.blit_text(line, BLACK, topleft=(5, 5 + idx * 12))
@@ -1,8 +1,16 @@
 import math
 import random
-from shapely.geometry import LineString, Point
+import numpy as np
+from shapely.geometry import Point
 
+import Geometry
 from Sensor import WallSensor, FeatureSensor
+from Trajectory import Trajectory
+
+#Layout of Robot.snapshot: pose, motors and motion, trajectory counters and the wall sensor distances,
+#followed by a (distance, bearing, feature index) row for every detected feature
+STATE_SIZE = 24
+SENSOR_DISTANCES = slice(12, 24)
 
 class Robot:
     # Author: Dino Pasic, Jannick Smeets
@@ -13,7 +21,7 @@ class Robot:
         self.x = x
         self.y = y
         self.power = power
-        self.path  = [(x,y)]
+        self.path  = Trajectory((x,y))     #bounded history of positions, see Trajectory for retention and decimation
 
         #indicating the motor speed values
         self.v_right = 0
@@ -31,6 +39,7 @@ class Robot:
         self.velocity_vector = (0, 0)
         self.v = 0
         self.omega = 0
+        self.collided = False       #whether a wall blocked or redirected the movement of the last update
 
     def right_motor(self, boolean, forward):
         if boolean:
@@ -50,9 +59,15 @@ class Robot:
         else:
             self.v_left = 0
 
+    #Sets both motor speeds directly, used for scripted or programmatic control instead of the keypad
+    def set_motors(self, v_left, v_right):
+        self.v_left = v_left
+        self.v_right = v_right
+
     # Author: Dino Pasic
     # Description: Updates the location and the orientation of the robot with collision handling
-    def update(self, dt, walls):
+    # Optionally takes the spatial index of the map, so only walls near the movement are checked
+    def update(self, dt, walls, index=None):
         R = self.radius
         L = 2 * R
 
@@ -74,32 +89,36 @@ class Robot:
 
         proposed_x = self.x + dx
         proposed_y = self.y + dy
+        self.collided = False
+
+        #Collision check on the disc swept along the movement, closed form over all walls at once
+        #A stationary robot cannot run into a wall, so the check is skipped when there is no movement
+        if dx != 0 or dy != 0:
+            segments = Geometry.as_segments(walls)
+            if index is not None:
+                segments = segments[index.walls_near_segment(self.x, self.y, proposed_x, proposed_y, R + self.power * dt)]
+            collisions = Geometry.swept_disc_collisions((self.x, self.y), (proposed_x, proposed_y), R, segments)
+
+            #Detect initial collision, decomposes the vector onto the first wall that is hit
+            if len(collisions) > 0:
+                self.collided = True
+                x1, y1, x2, y2 = segments[collisions[0]]
+                wall_length = math.hypot(x2 - x1, y2 - y1)
+                wall_vector_normalized = ((x2 - x1) / wall_length, (y2 - y1) / wall_length)
 
-        #Used for initial collision check
-        movement_line = LineString([(self.x, self.y), (proposed_x, proposed_y)]).buffer(R)
-
-        #Detect initial collision, also decomposes the vector
-        for wall in walls:
-            if movement_line.intersects(wall.line):
                 movement_vector = (self.direction * self.power * math.cos(self.orientation), self.direction * self.power * math.sin(self.orientation))
-                dot_product = movement_vector[0] * wall.vector_normalized[0] + movement_vector[1] * \
-                              wall.vector_normalized[1]
-                parallel_component = (dot_product * wall.vector_normalized[0], dot_product * wall.vector_normalized[1])
+                dot_product = movement_vector[0] * wall_vector_normalized[0] + movement_vector[1] * \
+                              wall_vector_normalized[1]
+                parallel_component = (dot_product * wall_vector_normalized[0], dot_product * wall_vector_normalized[1])
                 dx = parallel_component[0] * dt
                 dy = parallel_component[1] * dt
                 proposed_x = self.x + dx
                 proposed_y = self.y + dy
-                break
-
-        #Recreate movement line using the parallel component only
-        movement_line = LineString([(self.x, self.y), (proposed_x, proposed_y)]).buffer(R)
 
-        #Secondary collision check to ensure that the parallel component will not lead to penetrating walls
-        for wall in walls:
-            if movement_line.intersects(wall.line):
-                proposed_x = self.x
-                proposed_y = self.y
-                break
+                #Secondary collision check to ensure that the parallel component will not lead to penetrating walls
+                if len(Geometry.swept_disc_collisions((self.x, self.y), (proposed_x, proposed_y), R, segments)) > 0:
+                    proposed_x = self.x
+                    proposed_y = self.y
 
         self.x = proposed_x
         self.y = proposed_y
@@ -107,18 +126,58 @@ class Robot:
 
         self.path.append((self.x, self.y))
 
-    def update_sensors(self, walls):
-        for idx, sensor in enumerate(self.wall_sensors):
+    def update_sensors(self, walls, index=None, range_table=None):
+        for sensor in self.wall_sensors:
             sensor.update_lines()   #update sensor line positions
-            sensor.check_intersect(walls)   #check for intersections with walls
+        if range_table is not None:
+            #precomputed distances of the static map instead of ray casting, see RangeTable
+            angles = [self.orientation + sensor.angle for sensor in self.wall_sensors]
+            lengths = [sensor.length for sensor in self.wall_sensors]
+            distances = range_table.sensor_distances(self.x, self.y, angles, self.radius, lengths)
+            for idx, sensor in enumerate(self.wall_sensors):
+                sensor.distance = float(distances[idx])
+                self.wall_sensor_distances[idx] = sensor.distance
+            return
+        if index is not None:
+            #only the walls in the grid cells the sensor lines pass through
+            origins = [sensor.origin_coord for sensor in self.wall_sensors]
+            ends = [sensor.end_coord for sensor in self.wall_sensors]
+            walls = Geometry.as_segments(walls)[index.walls_crossing_segments(origins, ends)]
+        WallSensor.check_intersect_all(self.wall_sensors, walls)   #check for intersections with walls, all sensors at once
+        for idx, sensor in enumerate(self.wall_sensors):
             self.wall_sensor_distances[idx] = sensor.distance    #add distance of sensor to distance array for ANN
 
-    def update_feature_sensors(self, map_walls, map_features):
-        self.detected_features = self.feature_sensor.sense_features(map_walls, map_features)
-
+    def update_feature_sensors(self, map_walls, map_features, index=None):
+        self.detected_features = self.feature_sensor.sense_features(map_walls, map_features, index)
+
+    # Description: Mutable state of the robot as a flat array in the STATE_SIZE layout, the sensor lines follow from the
+    # pose and are not stored. Restoring rolls the trajectory back to its length at the snapshot
+    def snapshot(self):
+        state = np.empty(STATE_SIZE + 3 * len(self.detected_features))
+        state[:12] = (self.x, self.y, self.orientation, self.v_left, self.v_right, self.direction,
+                      self.velocity_vector[0], self.velocity_vector[1], self.v, self.omega, *self.path.snapshot())
+        state[SENSOR_DISTANCES] = [sensor.distance for sensor in self.wall_sensors]
+        state[STATE_SIZE:] = [value for distance, bearing, feature in self.detected_features for value in (distance, bearing, feature.index)]
+        return state
+
+    #map_features turns the stored feature indices back into features, without it the detected features are cleared
+    def restore(self, state, map_features=None):
+        (self.x, self.y, self.orientation, self.v_left, self.v_right, self.direction,
+         vx, vy, self.v, self.omega, appended, stored) = state[:12].tolist()
+        self.velocity_vector = (vx, vy)
+        self.collided = False
+        self.path.restore(appended, stored)
+        self.wall_sensor_distances = state[SENSOR_DISTANCES].tolist()
+        for sensor, distance in zip(self.wall_sensors, self.wall_sensor_distances):
+            sensor.distance = distance
+            sensor.update_lines()
+        detected = state[STATE_SIZE:].reshape(-1, 3).tolist() if map_features is not None else []
+        self.detected_features = [[distance, bearing, map_features[int(index)]] for distance, bearing, index in detected]
+
+    #Whether the robot ran into a wall during the last update. The collision handling always stops the robot outside
+    #the walls, so the wall sensor distances (measured from the rim) never reach 0 and cannot tell
     def is_collision(self):
-        collision = any(x<=0 for x in self.wall_sensor_distances)
-        return collision
+        return self.collided
     
     # Author: Jannick Smeets
     # Description: Detects features within omni-sensor range and calculates distance + relative bearing
@@ -0,0 +1,159 @@
+import math
+import numpy as np
+
+import Geometry
+from Robot import STATE_SIZE, SENSOR_DISTANCES
+
+class RobotBatch:
+    # Description: K robots on a shared map, simulated together with their state held in arrays
+    # Kinematics, collision handling and the 12 wall sensors follow Robot.update and Robot.update_sensors exactly,
+    # but every tick is a single batched call, e.g. to evaluate a whole population of controllers at once
+
+    def __init__(self, map, x, y, power, orientation=0, count=None):
+        if count is None:
+            count = len(np.atleast_1d(x))
+        self.map = map
+        self.count = count
+        self.radius = 20
+        self.power = np.broadcast_to(np.asarray(power, dtype=float), (count,)).copy()
+
+        self.x = np.broadcast_to(np.asarray(x, dtype=float), (count,)).copy()
+        self.y = np.broadcast_to(np.asarray(y, dtype=float), (count,)).copy()
+        self.orientation = np.broadcast_to(np.asarray(orientation, dtype=float), (count,)).copy()
+
+        #indicating the motor speed values
+        self.v_left = np.zeros(count)
+        self.v_right = np.zeros(count)
+
+        self.direction = np.ones(count)          #direction of movement (1: forward/stationary, -1: backward)
+        self.v = np.zeros(count)
+        self.omega = np.zeros(count)
+        self.velocity_vector = np.zeros((count, 2))
+        self.collided = np.zeros(count, dtype=bool)     #whether a wall blocked or redirected the last movement of each robot
+
+        #same layout as Robot.wall_sensors, 12 sensors 30 degrees apart
+        self.sensor_angles = np.radians(np.arange(12) * 30)
+        self.sensor_length = 120
+        self.init_distance = self.sensor_length - self.radius
+        self.wall_sensor_distances = np.full((count, len(self.sensor_angles)), float(self.init_distance))
+        self.range_table = None     #optional RangeTable of the map, sensor reads then become array lookups
+
+        self.update_sensors()
+
+    def set_motors(self, v_left, v_right):
+        self.v_left[:] = v_left
+        self.v_right[:] = v_right
+
+    #One tick for all robots: motion with collision handling followed by the wall sensors
+    def step(self, dt, v_left=None, v_right=None):
+        if v_left is not None or v_right is not None:
+            self.set_motors(self.v_left if v_left is None else v_left, self.v_right if v_right is None else v_right)
+        self.update(dt)
+        self.update_sensors()
+
+    # Description: Updates the location and the orientation of all robots with collision handling, see Robot.update
+    def update(self, dt):
+        R = self.radius
+        L = 2 * R
+
+        self.omega = (self.v_right - self.v_left) / L
+        self.v = (self.v_right + self.v_left) / 2
+
+        self.orientation = (self.orientation + self.omega * dt) % (2 * math.pi)
+        self.direction = np.copysign(1, self.v)
+
+        cos, sin = np.cos(self.orientation), np.sin(self.orientation)
+        dx = self.v * dt * cos
+        dy = self.v * dt * sin
+
+        #stationary robots cannot run into a wall
+        moving = np.flatnonzero((dx != 0) | (dy != 0))
+        proposed_x = self.x + dx
+        proposed_y = self.y + dy
+        self.collided = np.zeros(self.count, dtype=bool)
+
+        if len(moving) > 0:
+            #candidate (robot, wall) pairs near each movement, grown by the longest possible sliding movement
+            index = self.map.index
+            robots, walls = index.pairs_in_boxes(self.x[moving], self.y[moving], proposed_x[moving], proposed_y[moving],
+                                                 R + self.power[moving] * dt, index.wall_starts, index.wall_ids)
+            robots = moving[robots]
+            segments = index.segments[walls]
+            starts = np.column_stack((self.x[robots], self.y[robots]))
+
+            #Detect initial collision, decomposes the vector onto the first wall (lowest index) that is hit
+            hit = Geometry.segment_distances(starts, np.column_stack((proposed_x[robots], proposed_y[robots])), segments, pairwise=True) <= R
+            colliding, first = np.unique(robots[hit], return_index=True)
+            if len(colliding) > 0:
+                self.collided[colliding] = True
+                wall_vector = self.map.wall_vectors[walls[hit][first]]
+                movement_x = self.direction[colliding] * self.power[colliding] * cos[colliding]
+                movement_y = self.direction[colliding] * self.power[colliding] * sin[colliding]
+                dot_product = movement_x * wall_vector[:, 0] + movement_y * wall_vector[:, 1]
+                dx[colliding] = dot_product * wall_vector[:, 0] * dt
+                dy[colliding] = dot_product * wall_vector[:, 1] * dt
+                proposed_x[colliding] = self.x[colliding] + dx[colliding]
+                proposed_y[colliding] = self.y[colliding] + dy[colliding]
+
+                #Secondary collision check to ensure that the parallel component will not lead to penetrating walls
+                recheck = np.isin(robots, colliding)
+                ends = np.column_stack((proposed_x[robots[recheck]], proposed_y[robots[recheck]]))
+                penetrating = Geometry.segment_distances(starts[recheck], ends, segments[recheck], pairwise=True) <= R
+                blocked = np.unique(robots[recheck][penetrating])
+                proposed_x[blocked] = self.x[blocked]
+                proposed_y[blocked] = self.y[blocked]
+
+        self.x = proposed_x
+        self.y = proposed_y
+        self.velocity_vector = np.column_stack((dx / dt, dy / dt))
+
+    # Description: Updates the 12 wall sensors of all robots at once, see Robot.update_sensors
+    def update_sensors(self):
+        if self.range_table is not None:
+            angles = self.orientation[:, np.newaxis] + self.sensor_angles
+            self.wall_sensor_distances = self.range_table.sensor_distances(self.x[:, np.newaxis], self.y[:, np.newaxis], angles,
+                                                                           self.radius, self.sensor_length)
+            return
+
+        index = self.map.index
+        sensor_count = len(self.sensor_angles)
+        self.wall_sensor_distances = np.full((self.count, sensor_count), float(self.init_distance))
+
+        #candidate (robot, wall) pairs within sensor range, every pair is checked for all sensors of the robot
+        robots, walls = index.pairs_in_boxes(self.x, self.y, self.x, self.y, self.sensor_length, index.wall_starts, index.wall_ids)
+        if len(robots) == 0:
+            return
+        robots = np.repeat(robots, sensor_count)
+        sensors = np.tile(np.arange(sensor_count), len(walls))
+        segments = index.segments[np.repeat(walls, sensor_count)]
+
+        angles = self.orientation[robots] + self.sensor_angles[sensors]
+        starts = np.column_stack((self.x[robots], self.y[robots]))
+        ends = starts + self.sensor_length * np.column_stack((np.cos(angles), np.sin(angles)))
+
+        t = Geometry.ray_cast(starts, ends, segments, pairwise=True)
+        hit = np.isfinite(t)
+        #distance between intersection and start point of the sensor, which lies radius along the line
+        np.minimum.at(self.wall_sensor_distances, (robots[hit], sensors[hit]), np.abs(t[hit] * self.sensor_length - self.radius))
+
+    # Description: States of all robots as a (count, STATE_SIZE) array in the layout of Robot.snapshot, without trajectory
+    # counters or detected features. restore takes the same rows or Robot snapshots, one row is broadcast to all
+    # robots, so a batch of rollouts can branch off the current state of a single robot
+    def snapshot(self):
+        state = np.zeros((self.count, STATE_SIZE))
+        state[:, :10] = np.column_stack((self.x, self.y, self.orientation, self.v_left, self.v_right, self.direction,
+                                         self.velocity_vector, self.v, self.omega))
+        state[:, SENSOR_DISTANCES] = self.wall_sensor_distances
+        return state
+
+    def restore(self, state):
+        state = np.broadcast_to(np.atleast_2d(state)[:, :STATE_SIZE], (self.count, STATE_SIZE))
+        (self.x, self.y, self.orientation, self.v_left, self.v_right, self.direction,
+         vx, vy, self.v, self.omega) = state[:, :10].T.copy()
+        self.velocity_vector = np.column_stack((vx, vy))
+        self.collided = np.zeros(self.count, dtype=bool)
+        self.wall_sensor_distances = state[:, SENSOR_DISTANCES].copy()
+
+    #Whether each robot ran into a wall during the last update, see Robot.is_collision
+    def is_collision(self):
+        return self.collided
@@ -0,0 +1,177 @@
+import numpy as np
+
+from KalmanFilter import KalmanFilter, append_estimate
+
+class SLAMFilter(KalmanFilter):
+    # Description: EKF-SLAM, the Kalman filter with the landmark positions in the state instead of a known map
+    # The state is [x, y, orientation, l1x, l1y, l2x, l2y, ...], a landmark is added with its covariance when it is
+    # first observed. Updates work on the partitioned covariance: the gain only needs the columns of the robot and
+    # the observed landmarks, and the covariance update is one rank-2k correction, so a tick costs O(k n²) for k
+    # measurements and n state entries instead of the O(n³) dense matrix products of KalmanFilter.update.
+    # Measurements are (distance, bearing, key) as for KalmanFilter, the key (the feature coordinates handed out by
+    # Simulation) only identifies the landmark, its value is never used as a position.
+
+    def __init__(self, initial_state, initial_covariance, process_noise, measurement_noise, robot, map=None, capacity=64):
+        #state and covariance storage grow by doubling, only the first size entries are in use
+        self.size = 3
+        self.state_storage = np.zeros(3 + 2 * capacity)
+        self.covariance_storage = np.zeros((3 + 2 * capacity, 3 + 2 * capacity))
+        super().__init__(initial_state, initial_covariance, process_noise, measurement_noise, robot, map)
+
+        self.landmark_keys = []     #key of every landmark in state order
+        self.landmark_slots = {}    #key -> landmark number
+
+    @property
+    def state(self):
+        return self.state_storage[:self.size]
+
+    @state.setter
+    def state(self, state):
+        self.state_storage[:self.size] = state
+
+    @property
+    def covariance(self):
+        return self.covariance_storage[:self.size, :self.size]
+
+    @covariance.setter
+    def covariance(self, covariance):
+        self.covariance_storage[:self.size, :self.size] = covariance
+
+    #Estimated landmark positions - (m, 2) view onto the state
+    @property
+    def landmarks(self):
+        return self.state_storage[3:self.size].reshape(-1, 2)
+
+    @property
+    def landmark_count(self):
+        return (self.size - 3) // 2
+
+    # Description: Motion update of the robot part, the landmarks are static. Only the robot block and the robot-landmark
+    # cross covariances change, O(n)
+    def predict(self, control_input, dt):
+        x, y, theta = self.state[:3]
+        v, omega = control_input
+
+        x += v * np.cos(theta) * dt
+        y += v * np.sin(theta) * dt
+        theta = (theta + omega * dt) % (2 * np.pi)
+        self.state[:3] = (x, y, theta)
+
+        # Jacobian of the motion model as in KalmanFilter.predict
+        F = np.array([
+            [1, 0, -v * np.sin(theta) * dt],
+            [0, 1,  v * np.cos(theta) * dt],
+            [0, 0, 1]
+        ])
+        P = self.covariance
+        P[:3, :3] = F @ P[:3, :3] @ F.T + self.process_noise
+        P[:3, 3:] = F @ P[:3, 3:]
+        P[3:, :3] = P[:3, 3:].T
+
+    #Landmark numbers of the measurements, -1 for landmarks not in the state yet
+    def associate(self, measurements):
+        return [self.landmark_slots.get((feature[0], feature[1]), -1) for _, _, feature in measurements]
+
+    # Description: Updates with the measurements of known landmarks, then adds the new landmarks to the state
+    def update(self, measurements):
+        measurements = list(measurements)
+        slots = self.associate(measurements)
+        known = [(m, slot) for m, slot in zip(measurements, slots) if slot >= 0]
+        if known:
+            self.update_landmarks([m for m, _ in known], [slot for _, slot in known])
+        for m, slot in zip(measurements, slots):
+            key = (m[2][0], m[2][1])
+            if slot < 0 and key not in self.landmark_slots:
+                self.add_landmark(m[0], m[1], key)
+        self.record_estimate()
+
+    # Description: Joint update with k measurements of landmarks already in the state
+    # H is nonzero only in the robot columns and the columns of the measured landmark, so P H^T is built from those
+    # q = 3 + 2k columns of P. The gain K = P H^T S^-1 comes from a 2k x 2k solve and P - K H P is a single
+    # (n x 2k) @ (2k x n) product, in place on the covariance
+    def update_landmarks(self, measurements, slots):
+        k = len(measurements)
+        z = np.array([(distance, bearing) for distance, bearing, _ in measurements], dtype=float)
+        slots = np.asarray(slots)
+
+        x, y, theta = self.state[:3]
+        landmarks = self.landmarks[slots]
+        dx = landmarks[:, 0] - x
+        dy = landmarks[:, 1] - y
+        d_squared = dx**2 + dy**2
+        d = np.sqrt(d_squared)
+
+        # Stacked residuals [distance, bearing, ...], bearings wrapped to [-π, π]
+        z_res = z - np.column_stack((d, np.arctan2(dy, dx) - theta))
+        z_res[:, 1] = (z_res[:, 1] + np.pi) % (2 * np.pi) - np.pi
+        z_res = z_res.ravel()
+
+        # Jacobian restricted to the columns [robot, landmark 1, ..., landmark k], landmark blocks are minus the
+        # robot position blocks
+        H = np.zeros((k, 2, 3 + 2 * k))
+        rows = np.arange(k)
+        H[:, 0, 0] = -dx / d
+        H[:, 0, 1] = -dy / d
+        H[:, 1, 0] = dy / d_squared
+        H[:, 1, 1] = -dx / d_squared
+        H[:, 1, 2] = -1
+        H[rows, :, 3 + 2 * rows] = -H[:, :, 0]
+        H[rows, :, 4 + 2 * rows] = -H[:, :, 1]
+        H = H.reshape(2 * k, -1)
+
+        columns = np.concatenate(([0, 1, 2], np.column_stack((3 + 2 * slots, 4 + 2 * slots)).ravel()))
+        P = self.covariance
+        PHt = P[:, columns] @ H.T                                   # n x 2k
+        S = H @ PHt[columns] + np.kron(np.eye(k), self.measurement_noise)
+        S = (S + S.T) / 2       # an asymmetric S from rounding would make the correction asymmetric and grow every tick
+        Kt = np.linalg.solve(S, PHt.T)                              # K^T, 2k x n
+
+        self.state += Kt.T @ z_res
+        P -= PHt @ Kt
+        self.state[2] %= 2 * np.pi
+
+    # Description: Appends a landmark at the position the measurement puts it, with covariance from the robot
+    # uncertainty (through G_r) and the measurement noise (through G_z); its cross covariances are G_r times the
+    # robot rows of P, O(n)
+    def add_landmark(self, distance, bearing, key):
+        if self.size + 2 > len(self.state_storage):
+            self.grow(2 * len(self.state_storage))
+        n = self.size
+        x, y, theta = self.state[:3]
+        angle = theta + bearing
+        c, s = np.cos(angle), np.sin(angle)
+
+        G_r = np.array([[1, 0, -distance * s], [0, 1, distance * c]])
+        G_z = np.array([[c, -distance * s], [s, distance * c]])
+
+        self.size = n + 2
+        self.state[n:] = (x + distance * c, y + distance * s)
+        P = self.covariance
+        P[n:, :n] = G_r @ P[:3, :n]
+        P[:n, n:] = P[n:, :n].T
+        P[n:, n:] = G_r @ P[:3, :3] @ G_r.T + G_z @ self.measurement_noise @ G_z.T
+
+        self.landmark_slots[key] = len(self.landmark_keys)
+        self.landmark_keys.append(key)
+
+    def grow(self, capacity):
+        state_storage = np.zeros(capacity)
+        covariance_storage = np.zeros((capacity, capacity))
+        state_storage[:self.size] = self.state
+        covariance_storage[:self.size, :self.size] = self.covariance
+        self.state_storage, self.covariance_storage = state_storage, covariance_storage
+
+    #The ellipses show the robot position uncertainty, as for KalmanFilter
+    def record_estimate(self):
+        append_estimate(self, self.covariance[:3, :3])
+
+    #Snapshot as KalmanFilter.snapshot, restoring an earlier snapshot drops the landmarks added since
+    def restore(self, state):
+        n = int(state[0])
+        if n > len(self.state_storage):
+            self.grow(n)
+        self.size = n
+        super().restore(state)
+        for key in self.landmark_keys[self.landmark_count:]:
+            del self.landmark_slots[key]
+        del self.landmark_keys[self.landmark_count:]
@@ -0,0 +1,150 @@
+import threading
+import time
+
+class SensorView:
+    # Description: Copy of the wall sensor state drawn by the Renderer
+
+    def __init__(self):
+        self.start_coord = (0, 0)
+        self.end_coord = (0, 0)
+        self.text_coord = (0, 0)
+        self.distance = 0
+        self.init_distance = 0
+
+    def capture(self, sensor):
+        self.start_coord = tuple(sensor.start_coord)
+        self.end_coord = tuple(sensor.end_coord)
+        self.text_coord = tuple(sensor.text_coord)
+        self.distance = sensor.distance
+        self.init_distance = sensor.init_distance
+
+
+class RobotView:
+    # Description: Copy of the robot state drawn by the Renderer, taken between two physics ticks
+    # path is the robot's own Trajectory, it only grows so the renderer can read it while the physics appends to it
+
+    def __init__(self):
+        self.x = 0
+        self.y = 0
+        self.orientation = 0
+        self.radius = 0
+        self.v_left = 0
+        self.v_right = 0
+        self.velocity_vector = (0, 0)
+        self.wall_sensors = []
+        self.detected_features = []
+        self.path = None
+
+    def capture(self, robot):
+        self.x, self.y, self.orientation = robot.x, robot.y, robot.orientation
+        self.radius = robot.radius
+        self.v_left, self.v_right = robot.v_left, robot.v_right
+        self.velocity_vector = tuple(robot.velocity_vector)
+        while len(self.wall_sensors) < len(robot.wall_sensors):
+            self.wall_sensors.append(SensorView())
+        for view, sensor in zip(self.wall_sensors, robot.wall_sensors):
+            view.capture(sensor)
+        self.detected_features = list(robot.detected_features)
+        self.path = robot.path
+
+
+class FilterView:
+    # Description: Copy of the filter estimate drawn by the Renderer, path and covariance_history only grow and are shared
+
+    def __init__(self):
+        self.state = None
+        self.covariance = None
+        self.path = None
+        self.covariance_history = []
+        self.landmarks = None
+
+    #Only the robot part of the covariance is copied, a SLAMFilter covariance grows with the landmarks
+    def capture(self, filter):
+        self.state = filter.state[:3].copy()
+        self.covariance = filter.covariance[:3, :3].copy()
+        self.path = filter.path
+        self.covariance_history = filter.covariance_history
+        landmarks = getattr(filter, 'landmarks', None)
+        self.landmarks = landmarks.copy() if landmarks is not None else None
+
+
+class Scheduler:
+    # Description: Steps a Simulation (robot, sensors and filter) at a fixed physics rate independent of the display rate
+    # The physics runs on a background thread (start/stop) or, without threads, catches up on the elapsed time once
+    # per frame (advance), skipping frames rather than ticks when it falls behind. After each batch of ticks the state is
+    # copied into a view that is swapped with the one the renderer reads, so a frame never sees a half-updated robot.
+    # A third, spare view lets both sides swap without waiting for each other.
+    # An optional controller (e.g. a PathFollower) is called as controller(simulation) on the physics side every
+    # control_interval ticks and sets the motors, so it never reads the robot while a tick is updating it.
+
+    def __init__(self, simulation, physics_rate=500, max_lag=0.25, controller=None, control_interval=1):
+        self.simulation = simulation
+        self.simulation.dt = 1 / physics_rate
+        self.max_lag = max_lag     #longest stretch of real time the physics catches up on, the rest is dropped
+        self.controller = controller
+        self.control_interval = control_interval
+
+        self.lag = 0               #real time not yet simulated
+        self.lock = threading.Lock()
+        self.write, self.spare, self.read = [(RobotView(), FilterView()) for _ in range(3)]
+        self.fresh = False         #spare holds a newer state than read
+
+        self.thread = None
+        self.running = False
+
+        self.publish()
+
+    #Copies the current state into the write view and makes it the latest one
+    def publish(self):
+        robot_view, filter_view = self.write
+        robot_view.capture(self.simulation.robot)
+        if self.simulation.kf is not None:
+            filter_view.capture(self.simulation.kf)
+        with self.lock:
+            self.write, self.spare = self.spare, self.write
+            self.fresh = True
+
+    #Latest published (RobotView, FilterView), stays untouched by the physics until the next call
+    def snapshot(self):
+        with self.lock:
+            if self.fresh:
+                self.read, self.spare = self.spare, self.read
+                self.fresh = False
+        return self.read
+
+    #Runs the physics ticks owed after elapsed seconds of real time, returns the number of ticks
+    def advance(self, elapsed):
+        dt = self.simulation.dt
+        self.lag = min(self.lag + elapsed, self.max_lag)
+        ticks = int(self.lag / dt)
+        for _ in range(ticks):
+            if self.controller is not None and self.simulation.ticks % self.control_interval == 0:
+                self.simulation.robot.set_motors(*self.controller(self.simulation))
+            self.simulation.step()
+        self.lag -= ticks * dt
+        if ticks > 0:
+            self.publish()
+        return ticks
+
+    def run_physics(self):
+        last = time.perf_counter()
+        while self.running:
+            now = time.perf_counter()
+            self.advance(now - last)
+            last = now
+            time.sleep(max(self.simulation.dt - self.lag, 0))
+
+    #Runs the physics on a background thread until stop
+    def start(self):
+        if self.thread is not None:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run_physics, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.running = False
+        self.thread.join()
+        self.thread = None
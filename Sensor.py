@@ -1,6 +1,9 @@
 import math
+import numpy as np
 from shapely.geometry import LineString, Point
 
+import Geometry
+
 class WallSensor:
     # Author: Jannick Smeets
     # Description: Class representing a sensor of the robot for detecting walls
@@ -14,12 +17,11 @@ class WallSensor:
         self.init_distance = self.length-robot.radius
         self.distance = self.init_distance
 
+        self.origin_coord = []
         self.start_coord = []
         self.end_coord = []
         self.text_coord = []
 
-        self.sensor_line = None
-        
         self.update_lines()
 
 
@@ -36,13 +38,17 @@ class WallSensor:
         text_x = self.robot.x + (self.robot.radius + self.text_pos) * math.cos(self.robot.orientation + self.angle)
         text_y = self.robot.y + (self.robot.radius + self.text_pos) * math.sin(self.robot.orientation + self.angle)
 
+        self.origin_coord = [self.robot.x, self.robot.y]
         self.start_coord = [start_x, start_y]
         self.end_coord = [end_x, end_y]
         self.text_coord = [text_x, text_y]
 
-        #LineString used for finding intersection
-        self.sensor_line = LineString([(self.robot.x, self.robot.y), (self.end_coord[0], self.end_coord[1])])
+    #LineString used for finding intersection, only built when the shapely reference path asks for it
+    @property
+    def sensor_line(self):
+        return LineString([(self.origin_coord[0], self.origin_coord[1]), (self.end_coord[0], self.end_coord[1])])
 
+    #Reference implementation using shapely, see check_intersect_all for the batched version used by the robot
     def check_intersect(self, walls):
         wall_distances = [self.init_distance] * len(walls)  #list of distances to all walls from sensor
 
@@ -56,6 +62,28 @@ class WallSensor:
 
         self.distance = min(wall_distances) #finds smallest distance of sensor to any wall
 
+    #Batched check_intersect, casts the lines of all sensors against all wall segments in a single NumPy operation
+    @staticmethod
+    def check_intersect_all(sensors, walls):
+        segments = Geometry.as_segments(walls)
+        if len(segments) == 0:
+            for sensor in sensors:
+                sensor.distance = sensor.init_distance
+            return
+
+        origins = np.array([sensor.origin_coord for sensor in sensors])
+        ends = np.array([sensor.end_coord for sensor in sensors])
+        lengths = np.array([[sensor.length] for sensor in sensors], dtype=float)
+        init_distances = np.array([sensor.init_distance for sensor in sensors], dtype=float)
+
+        t = Geometry.ray_cast(origins, ends, segments)   #(sensors, walls) position of the intersection along each sensor line
+        #distance between intersection and start point of the sensor, which lies robot.radius along the line
+        wall_distances = np.where(np.isfinite(t), np.abs(t * lengths - sensors[0].robot.radius), init_distances[:, np.newaxis])
+        distances = np.minimum(wall_distances.min(axis=1), init_distances)
+
+        for sensor, distance in zip(sensors, distances.tolist()):
+            sensor.distance = distance
+
     def calc_distance(self, p1, p2):
         #Calculates distance between two points
         return math.sqrt((p2[0] - p1[0])**2 + (p2[1] - p1[1])**2)
@@ -70,18 +98,45 @@ class FeatureSensor:
         self.length = sensor_length
 
     #Senses for features within sensor range and calculates relative bearing
-    def sense_features(self, map_walls, map_features):
+    def sense_features(self, map_walls, map_features, index=None):
+        if index is not None:
+            return self.sense_features_indexed(map_features, index)
+
         detected_features = []
         for feature_idx, feature in enumerate(map_features):
             exact_distance = Point(self.robot.x, self.robot.y).distance(feature.point)  #Distance between robot and feature
             if exact_distance < self.length:
                 if self.check_intersect(feature, map_walls):
-                    vector = (feature.x - self.robot.x, feature.y - self.robot.y)
-                    bearing = math.atan2(vector[0], vector[1])  #Bearing relative to map perspective (in radians)
-                    relative_bearing = (bearing + self.robot.orientation - math.pi/2) % 2*math.pi #Bearing relative to robot orientation (-π/2 offset)
-                    detected_features.append([exact_distance, relative_bearing, feature])
+                    detected_features.append([exact_distance, self.calc_bearing(feature), feature])
         return detected_features
 
+    #Same result as sense_features, using the spatial index of the map: features in range come from a grid range query
+    #and all lines of sight are tested against the nearby walls at once, skipping the walls a feature lies on
+    def sense_features_indexed(self, map_features, index):
+        robot_x, robot_y = self.robot.x, self.robot.y
+        feature_ids = index.features_within(robot_x, robot_y, self.length)
+        if len(feature_ids) == 0:
+            return []
+
+        points = index.points[feature_ids]
+        wall_ids = index.walls_crossing_segments((robot_x, robot_y), points)
+        blocked = np.isfinite(Geometry.ray_cast((robot_x, robot_y), points, index.segments[wall_ids]))
+        blocked &= ~index.features_on_walls(feature_ids, wall_ids)
+        visible = feature_ids[~blocked.any(axis=1)]
+
+        detected_features = []
+        for feature_idx in visible.tolist():
+            feature = map_features[feature_idx]
+            exact_distance = math.hypot(feature.x - robot_x, feature.y - robot_y)   #Distance between robot and feature
+            detected_features.append([exact_distance, self.calc_bearing(feature), feature])
+        return detected_features
+
+    def calc_bearing(self, feature):
+        vector = (feature.x - self.robot.x, feature.y - self.robot.y)
+        bearing = math.atan2(vector[1], vector[0])  #Bearing relative to map perspective (in radians)
+        relative_bearing = (bearing - self.robot.orientation + math.pi) % (2*math.pi) - math.pi #Bearing relative to robot orientation, in [-π, π)
+        return relative_bearing
+
     #Checks if line of sight from robot to detected feature is intersected by wall
     def check_intersect(self, feature, map_walls):
         line_of_sight = LineString([(self.robot.x, self.robot.y),(feature.x, feature.y)])
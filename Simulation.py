@@ -0,0 +1,160 @@
+import math
+import random
+import numpy as np
+
+from DataAssociation import DataAssociation
+from KalmanFilter import KalmanFilter
+from Robot import Robot
+from Map import Map
+from SLAMFilter import SLAMFilter
+
+#Default filter tuning, identical to the interactive simulation in main.py
+INITIAL_COVARIANCE = np.eye(3) * 0.1
+#Process noise per second, create scales it by dt so the filter gets the same noise per second at every tick rate
+#(diag([0.02, 0.02, 0.5°]) per tick at 60 ticks per second)
+PROCESS_NOISE = np.diag([1.2, 1.2, np.deg2rad(30)])
+MEASUREMENT_NOISE = np.diag([0.1, np.deg2rad(5)])
+#Process noise per second with SLAM or data association, large enough to cover the motion model error of sliding
+#along walls. Otherwise a SLAM estimate drifts far outside its covariance, and with association it leaves the gates
+#after a collision so all observations get rejected (diag([2, 2, 1°]) per tick at 60 ticks per second)
+SLIDING_PROCESS_NOISE = np.diag([120, 120, np.deg2rad(60)])
+
+class Simulation:
+    # Description: Headless simulation driver, steps the robot, its sensors and the Kalman filter at a fixed timestep
+    # without any display, so runs are as fast as the CPU allows and reproducible for a given seed and command script
+
+    def __init__(self, map, robot, kf=None, dt=1/60, recorder=None, range_table=None, association=None, occupancy_grid=None, telemetry=None):
+        self.map = map
+        self.robot = robot
+        self.kf = kf
+        self.dt = dt
+        self.recorder = recorder    #Recorder streaming every tick to disk, see Recording
+        self.range_table = range_table  #optional RangeTable for the wall sensors instead of ray casting
+        self.association = association  #optional DataAssociation, matches the observations instead of using the sensed features
+        self.occupancy_grid = occupancy_grid    #optional OccupancyGrid, maps the wall sensor readings at the true pose every tick
+        self.telemetry = telemetry  #optional TelemetryServer, publishes every tick to the connected viewers
+
+        self.time = 0
+        self.ticks = 0
+        self.measurements = []      #measurements handed to the filter during the last tick - [(distance, bearing, (x, y))]
+
+    #Builds the default 800x800 scenario of main.py, the random initial filter state is drawn from the given seed
+    #With slam the filter is a SLAMFilter that maps the features itself, starting from the true pose (the map frame)
+    #association ('nn' or 'jcbb') matches the observations with a DataAssociation, the filter then starts at the
+    #true pose as gating needs an estimate close to it
+    @classmethod
+    def create(cls, width=800, height=800, power=100, dt=1/60, seed=None, joint_update=False, slam=False, association=None):
+        rng = random.Random(seed)
+
+        map = Map(width, height)
+        map.populate_map(width, height)
+        map.extract_features()
+        robot = Robot(width*0.15, height*0.85, power)
+
+        process_noise = (SLIDING_PROCESS_NOISE if slam or association is not None else PROCESS_NOISE) * dt
+        if slam:
+            kf = SLAMFilter([robot.x, robot.y, robot.orientation], np.zeros((3, 3)), process_noise, MEASUREMENT_NOISE, robot)
+        else:
+            initial_state = [rng.randrange(width), rng.randrange(height), rng.uniform(0, 2*math.pi)]
+            if association is not None:
+                initial_state = [robot.x, robot.y, robot.orientation]
+            kf = KalmanFilter(initial_state, INITIAL_COVARIANCE, process_noise, MEASUREMENT_NOISE, robot, map, joint_update)
+
+        if association is not None:
+            association = DataAssociation(MEASUREMENT_NOISE, association, landmarks=None if slam else map.feature_coords)
+        return cls(map, robot, kf, dt, association=association)
+
+    #Advances the simulation by one tick, dt defaults to the fixed timestep of the simulation
+    def step(self, dt=None):
+        if dt is None:
+            dt = self.dt
+
+        robot = self.robot
+        control_input = np.array([robot.v, robot.omega])
+
+        if self.kf is not None:
+            self.kf.predict(control_input, dt)
+
+        robot.update(dt, self.map.segments, self.map.index)
+        robot.update_sensors(self.map.segments, self.map.index, self.range_table)
+        if self.occupancy_grid is not None:
+            self.occupancy_grid.integrate_robot(robot)
+        robot.update_feature_sensors(self.map.walls, self.map.features, self.map.index)
+
+        if self.association is not None and self.kf is not None:
+            self.measurements = self.association.measurements(robot.detected_features, self.kf)
+        else:
+            self.measurements = [(f[0], f[1], (f[2].x, f[2].y)) for f in robot.detected_features]
+
+        if self.kf is not None:
+            self.kf.update(self.measurements)
+
+        if self.recorder is not None:
+            self.recorder.record_simulation(self, dt, control_input)
+
+        self.time += dt
+        self.ticks += 1
+
+        if self.telemetry is not None:
+            self.telemetry.publish(self)
+
+    # Description: Mutable state of the whole simulation as one flat array [time, ticks, filter snapshot size, filter
+    # snapshot, robot snapshot], see Robot.snapshot and KalmanFilter.snapshot. The map is static and shared, so a
+    # snapshot is a few hundred bytes and restore makes the simulation continue exactly as from the snapshot tick
+    def snapshot(self):
+        filter_state = self.kf.snapshot() if self.kf is not None else np.zeros(0)
+        return np.concatenate(([self.time, self.ticks, len(filter_state)], filter_state, self.robot.snapshot()))
+
+    def restore(self, state):
+        self.time = float(state[0])
+        self.ticks = int(state[1])
+        size = int(state[2])
+        if self.kf is not None:
+            self.kf.restore(state[3:3 + size])
+        self.robot.restore(state[3 + size:], self.map.features)
+        self.measurements = [(f[0], f[1], (f[2].x, f[2].y)) for f in self.robot.detected_features]
+
+    # Description: Look-ahead rollout, runs commands (as in run) from the current state and restores that state after
+    # Returns evaluate(simulation) at the end of the rollout, or the snapshot of the final state without evaluate.
+    # The recorder, occupancy grid and telemetry are detached during the rollout so they only hold the real run, the
+    # robot and filter paths are swapped for scratch trajectories so the rollout never overwrites points of a full ring
+    def rollout(self, commands, steps=None, evaluate=None):
+        start = self.snapshot()
+        recorder, self.recorder = self.recorder, None
+        occupancy_grid, self.occupancy_grid = self.occupancy_grid, None
+        telemetry, self.telemetry = self.telemetry, None
+        robot_path, self.robot.path = self.robot.path, self.robot.path.scratch()
+        if self.kf is not None:
+            filter_path, self.kf.path = self.kf.path, self.kf.path.scratch()
+        try:
+            self.run(commands, steps)
+            return evaluate(self) if evaluate is not None else self.snapshot()
+        finally:
+            self.recorder = recorder
+            self.occupancy_grid = occupancy_grid
+            self.telemetry = telemetry
+            self.robot.path = robot_path
+            if self.kf is not None:
+                self.kf.path = filter_path
+            self.restore(start)
+
+    #Runs the simulation on motor commands, either an iterable of (v_left, v_right) pairs (one per tick)
+    #or a controller called as controller(simulation) every tick, which then needs a number of steps
+    def run(self, commands, steps=None):
+        if callable(commands):
+            if steps is None:
+                raise ValueError("steps is required when driving the simulation with a controller")
+            for _ in range(steps):
+                self.robot.set_motors(*commands(self))
+                self.step()
+        else:
+            for tick, (v_left, v_right) in enumerate(commands):
+                if steps is not None and tick >= steps:
+                    break
+                self.robot.set_motors(v_left, v_right)
+                self.step()
+
+    #Runs a script of [(duration, v_left, v_right)], each entry holds the motor speeds for duration seconds
+    def run_script(self, script):
+        for duration, v_left, v_right in script:
+            self.run([(v_left, v_right)] * int(round(duration / self.dt)))
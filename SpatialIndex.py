@@ -0,0 +1,234 @@
+import math
+import numpy as np
+
+import Geometry
+
+class GridIndex:
+    # Description: Uniform grid over the walls and features of a map, so that queries only look at the walls
+    # and features in the cells around the query instead of scanning the whole map
+    # Every cell holds the indices of the walls (segments) crossing it and of the features (points) inside it,
+    # stored as one sorted index array per kind plus the start offset of every cell
+
+    def __init__(self, segments, points, cell_size=None):
+        self.segments = np.asarray(segments, dtype=float).reshape(-1, 4)
+        self.points = np.asarray(points, dtype=float).reshape(-1, 2)
+
+        coords = np.concatenate((self.segments.reshape(-1, 2), self.points))
+        if len(coords) == 0:
+            coords = np.zeros((1, 2))
+        self.x0, self.y0 = coords.min(axis=0)
+        extent = coords.max(axis=0) - (self.x0, self.y0)
+
+        #By default roughly one wall per cell, but never so small that the grid gets huge for tiny maps
+        if cell_size is None:
+            cell_size = max(math.sqrt(max(extent[0] * extent[1], 1) / max(len(self.segments), 1)), 25)
+        self.cell_size = float(cell_size)
+        self.nx = int(extent[0] // self.cell_size) + 1
+        self.ny = int(extent[1] // self.cell_size) + 1
+
+        segment_ids, segment_cells = self.cells_of_segments(self.segments)
+        self.wall_starts, self.wall_ids = self.build_cells(segment_cells, segment_ids)
+        feature_cells = self.cells_of_points(self.points)
+        self.feature_starts, self.feature_ids = self.build_cells(feature_cells, np.arange(len(self.points)))
+        self.on_wall_keys = self.find_features_on_walls(feature_cells)
+
+    #Static precomputation of which walls every feature lies on, as sorted keys feature * walls + wall
+    #A wall through a feature always crosses the cell of that feature, so only those walls are tested
+    def find_features_on_walls(self, feature_cells):
+        begin = self.wall_starts[feature_cells]
+        counts = self.wall_starts[feature_cells + 1] - begin
+        features = np.repeat(np.arange(len(self.points)), counts)
+        walls = self.wall_ids[np.arange(counts.sum()) + np.repeat(begin - (np.cumsum(counts) - counts), counts)]
+
+        segments = self.segments[walls]
+        ax, ay = segments[:, 0], segments[:, 1]
+        ex, ey = segments[:, 2] - ax, segments[:, 3] - ay
+        distances = Geometry.point_distances_squared(self.points[features, 0], self.points[features, 1], ax, ay, ex, ey, ex * ex + ey * ey)
+        on_wall = distances <= (1e-9 * self.cell_size) ** 2
+        return np.sort(features[on_wall] * len(self.segments) + walls[on_wall])
+
+    #Whether each feature lies on each wall - shape (features, walls)
+    def features_on_walls(self, feature_ids, wall_ids):
+        keys = feature_ids[:, np.newaxis] * len(self.segments) + wall_ids[np.newaxis, :]
+        if len(self.on_wall_keys) == 0:
+            return np.zeros(keys.shape, dtype=bool)
+        positions = np.minimum(np.searchsorted(self.on_wall_keys, keys), len(self.on_wall_keys) - 1)
+        return self.on_wall_keys[positions] == keys
+
+    #Cell coordinates of x, y clamped to the grid
+    def cell_coords(self, x, y):
+        cx = np.clip(np.floor((np.asarray(x) - self.x0) / self.cell_size), 0, self.nx - 1).astype(np.int64)
+        cy = np.clip(np.floor((np.asarray(y) - self.y0) / self.cell_size), 0, self.ny - 1).astype(np.int64)
+        return cx, cy
+
+    def cells_of_points(self, points):
+        cx, cy = self.cell_coords(points[:, 0], points[:, 1])
+        return cy * self.nx + cx
+
+    #All (segment index, cell) pairs for the cells each segment passes
+    #Walks the grid columns each segment spans and, per column, the rows covered by the part of the segment inside it
+    def cells_of_segments(self, segments):
+        x1, y1, x2, y2 = segments[:, 0], segments[:, 1], segments[:, 2], segments[:, 3]
+        x_min, x_max = np.minimum(x1, x2), np.maximum(x1, x2)
+        y_min, y_max = np.minimum(y1, y2), np.maximum(y1, y2)
+        cx0 = self.cell_coords(x_min, y_min)[0]
+        cx1 = self.cell_coords(x_max, y_max)[0]
+
+        columns = cx1 - cx0 + 1
+        ids = np.repeat(np.arange(len(segments)), columns)
+        cx = cx0[ids] + np.arange(columns.sum()) - np.repeat(np.cumsum(columns) - columns, columns)
+
+        #y range of the segment within its column, vertical segments cover their whole y range
+        xa = np.maximum(x_min[ids], self.x0 + cx * self.cell_size)
+        xb = np.minimum(x_max[ids], self.x0 + (cx + 1) * self.cell_size)
+        dx = x2 - x1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = np.where(dx != 0, (y2 - y1) / dx, 0)[ids]
+        ya = np.where(dx[ids] != 0, y1[ids] + (xa - x1[ids]) * slope, y_min[ids])
+        yb = np.where(dx[ids] != 0, y1[ids] + (xb - x1[ids]) * slope, y_max[ids])
+        cy0 = self.cell_coords(xa, np.minimum(ya, yb))[1]
+        cy1 = self.cell_coords(xa, np.maximum(ya, yb))[1]
+
+        rows = cy1 - cy0 + 1
+        column_ids = np.repeat(np.arange(len(cx)), rows)
+        cy = cy0[column_ids] + np.arange(rows.sum()) - np.repeat(np.cumsum(rows) - rows, rows)
+        return ids[column_ids], cy * self.nx + cx[column_ids]
+
+    #Groups item indices by cell, returns the start offset of every cell and the item indices sorted by cell
+    def build_cells(self, cells, ids):
+        order = np.argsort(cells, kind='stable')
+        starts = np.searchsorted(cells[order], np.arange(self.nx * self.ny + 1))
+        return starts, ids[order]
+
+    #Unique item indices (in index order) stored in the given cells
+    def gather(self, cells, starts, ids):
+        begin = starts[cells]
+        counts = starts[cells + 1] - begin
+        total = counts.sum()
+        if total == 0:
+            return np.zeros(0, dtype=np.int64)
+        positions = np.arange(total) + np.repeat(begin - (np.cumsum(counts) - counts), counts)
+        return np.unique(ids[positions])
+
+    #Cell range (inclusive) of the bounding box around x0, y0 - x1, y1 grown by margin, clamped to the grid
+    def box_range(self, x0, y0, x1, y1, margin=0):
+        cx0 = min(max(math.floor((min(x0, x1) - margin - self.x0) / self.cell_size), 0), self.nx - 1)
+        cy0 = min(max(math.floor((min(y0, y1) - margin - self.y0) / self.cell_size), 0), self.ny - 1)
+        cx1 = min(max(math.floor((max(x0, x1) + margin - self.x0) / self.cell_size), 0), self.nx - 1)
+        cy1 = min(max(math.floor((max(y0, y1) + margin - self.y0) / self.cell_size), 0), self.ny - 1)
+        return cx0, cy0, cx1, cy1
+
+    #Unique item indices (in index order) stored in a box of cells, every row of the box is one contiguous slice
+    def gather_box(self, box, starts, ids):
+        cx0, cy0, cx1, cy1 = box
+        rows = [ids[starts[row + cx0]:starts[row + cx1 + 1]] for row in range(cy0 * self.nx, cy1 * self.nx + 1, self.nx)]
+        return np.unique(np.concatenate(rows))
+
+    #Batched box query, all (query, item) pairs for the boxes x0, y0 - x1, y1 (arrays) grown by margin
+    #Pairs are unique and sorted by query and then by item index
+    def pairs_in_boxes(self, x0, y0, x1, y1, margin, starts, ids):
+        cx0, cy0 = self.cell_coords(np.minimum(x0, x1) - margin, np.minimum(y0, y1) - margin)
+        cx1, cy1 = self.cell_coords(np.maximum(x0, x1) + margin, np.maximum(y0, y1) + margin)
+
+        #every cell of every box
+        widths = cx1 - cx0 + 1
+        counts = widths * (cy1 - cy0 + 1)
+        queries = np.repeat(np.arange(len(cx0)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cells = (cy0[queries] + offsets // widths[queries]) * self.nx + cx0[queries] + offsets % widths[queries]
+
+        #every item of every cell
+        begin = starts[cells]
+        counts = starts[cells + 1] - begin
+        items = ids[np.arange(counts.sum()) + np.repeat(begin - (np.cumsum(counts) - counts), counts)]
+        #every item is stored at least once, so item indices are below len(ids)
+        keys = np.unique(np.repeat(queries, counts) * len(ids) + items)
+        return keys // max(len(ids), 1), keys % max(len(ids), 1)
+
+    #Walls that may touch a disc of the given radius moved from x0, y0 to x1, y1
+    def walls_near_segment(self, x0, y0, x1, y1, radius):
+        return self.gather_box(self.box_range(x0, y0, x1, y1, radius), self.wall_starts, self.wall_ids)
+
+    #Walls that may be crossed by any of the segments from starts to ends - (..., 2) arrays
+    #Segments spanning only a few cells together (like the sensor lines) are answered with their bounding box,
+    #longer ones only visit the cells they actually pass
+    def walls_crossing_segments(self, starts, ends):
+        segments = np.concatenate(np.broadcast_arrays(np.asarray(starts, dtype=float), np.asarray(ends, dtype=float)), axis=-1).reshape(-1, 4)
+        coords = segments.reshape(-1, 2)
+        box = self.box_range(coords[:, 0].min(), coords[:, 1].min(), coords[:, 0].max(), coords[:, 1].max())
+        if (box[2] - box[0] + 1) * (box[3] - box[1] + 1) <= 4 * len(segments):
+            return self.gather_box(box, self.wall_starts, self.wall_ids)
+        return self.gather(np.unique(self.cells_of_segments(segments)[1]), self.wall_starts, self.wall_ids)
+
+    #Features within radius of x, y
+    def features_within(self, x, y, radius):
+        ids = self.gather_box(self.box_range(x, y, x, y, radius), self.feature_starts, self.feature_ids)
+        points = self.points[ids]
+        return ids[np.hypot(points[:, 0] - x, points[:, 1] - y) < radius]
+
+
+class KDTree:
+    # Description: Static 2-d tree over points, for radius queries that visit O(log n) nodes plus the matches
+    # Every node covers a range of the permutation order and keeps the bounding box of its points, internal nodes
+    # split their range at the median along the wider side of the box. Nodes are stored in flat arrays.
+
+    def __init__(self, points, leaf_size=8):
+        self.points = np.asarray(points, dtype=float).reshape(-1, 2)
+        self.order = np.arange(len(self.points))
+
+        starts, ends, lows, highs, children = [], [], [], [], []
+        stack = [(0, len(self.points), -1, 0)]      #(start, end, parent, which child)
+        while stack:
+            start, end, parent, side = stack.pop()
+            node = len(starts)
+            if parent >= 0:
+                children[parent][side] = node
+            ids = self.order[start:end]
+            box = self.points[ids]
+            low, high = (box.min(axis=0), box.max(axis=0)) if len(ids) else (np.zeros(2), np.zeros(2))
+            starts.append(start)
+            ends.append(end)
+            lows.append(low)
+            highs.append(high)
+            children.append([-1, -1])
+            if end - start > leaf_size:
+                axis = int(np.argmax(high - low))
+                middle = (end - start) // 2
+                self.order[start:end] = ids[np.argpartition(box[:, axis], middle)]
+                stack.append((start + middle, end, node, 1))
+                stack.append((start, start + middle, node, 0))
+
+        #plain lists, queries walk the tree node by node
+        self.starts = starts
+        self.ends = ends
+        self.boxes = [(low[0], low[1], high[0], high[1]) for low, high in zip(np.array(lows).tolist(), np.array(highs).tolist())]
+        self.children = children
+
+    def __len__(self):
+        return len(self.points)
+
+    #Indices of the points within radius of x, y
+    def within(self, x, y, radius):
+        found = []
+        radius_squared = radius * radius
+        boxes, children = self.boxes, self.children
+        stack = [0] if len(self.points) else []
+        while stack:
+            node = stack.pop()
+            low_x, low_y, high_x, high_y = boxes[node]
+            #squared distance from the query point to the bounding box of the node
+            dx = max(low_x - x, 0, x - high_x)
+            dy = max(low_y - y, 0, y - high_y)
+            if dx * dx + dy * dy > radius_squared:
+                continue
+            left, right = children[node]
+            if left >= 0:
+                stack.append(left)
+                stack.append(right)
+            else:
+                found.append(self.order[self.starts[node]:self.ends[node]])
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        ids = np.concatenate(found)
+        points = self.points[ids]
+        return ids[(points[:, 0] - x)**2 + (points[:, 1] - y)**2 <= radius_squared]
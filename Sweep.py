@@ -0,0 +1,177 @@
+import argparse
+import csv
+import itertools
+import json
+import math
+import multiprocessing as mp
+import random
+import time
+import numpy as np
+
+from KalmanFilter import KalmanFilter
+from Robot import Robot
+from Map import Map
+from Simulation import Simulation, INITIAL_COVARIANCE, PROCESS_NOISE, MEASUREMENT_NOISE
+
+#Configuration of one headless run, every key can be swept. Matrices are given as diagonals or full matrices, the
+#process noise per second (scaled by dt as in Simulation.create)
+DEFAULT_CONFIG = {
+    'process_noise': np.diag(PROCESS_NOISE).tolist(),
+    'measurement_noise': np.diag(MEASUREMENT_NOISE).tolist(),
+    'initial_covariance': np.diag(INITIAL_COVARIANCE).tolist(),
+    'feature_range': 200,
+    'wall_sensor_range': 120,
+    'joint_update': False,
+    'seed': 0,
+    'duration': 30,         #simulated seconds, driven by a random motor script drawn from the seed
+    'dt': 1/60,
+}
+
+METRICS = ['position_rmse', 'heading_rmse', 'nees', 'nees_consistent', 'measurements_per_tick', 'runtime', 'ticks_per_second']
+
+#95% bounds of the chi-square distribution with 3 degrees of freedom, the expected NEES range of a consistent filter
+NEES_BOUNDS = (0.216, 9.348)
+
+def as_matrix(value):
+    matrix = np.array(value, dtype=float)
+    return np.diag(matrix) if matrix.ndim == 1 else matrix
+
+#Random motor script of [(duration, v_left, v_right)] lasting duration seconds, the same one for the same seed
+def motor_script(seed, duration, power=100):
+    rng = random.Random(seed)
+    script = []
+    total = 0
+    while total < duration:
+        step = rng.choice([0.3, 0.6, 1.0, 2.0])
+        script.append((step, rng.choice([power, -power, 0]), rng.choice([power, -power, 0])))
+        total += step
+    return script
+
+# Description: Runs one configuration headless and returns the configuration with its metrics
+# The filter starts at the true pose perturbed by a sample of initial_covariance, errors are taken every tick between
+# the filter estimate and the ground truth (Robot.path and orientation). NEES is the mean normalized estimation error
+# squared, nees_consistent the fraction of ticks inside NEES_BOUNDS
+def evaluate(config):
+    config = dict(DEFAULT_CONFIG, **config)
+    rng = np.random.default_rng(config['seed'])
+
+    map = Map(800, 800)
+    map.populate_map(800, 800)
+    map.extract_features()
+    robot = Robot(800*0.15, 800*0.85, 100)
+    robot.feature_sensor.length = config['feature_range']
+    for sensor in robot.wall_sensors:
+        sensor.length = config['wall_sensor_range']
+        sensor.init_distance = sensor.length - robot.radius
+
+    initial_covariance = as_matrix(config['initial_covariance'])
+    initial_state = rng.multivariate_normal([robot.x, robot.y, robot.orientation], initial_covariance)
+    initial_state[2] %= 2 * math.pi
+    kf = KalmanFilter(initial_state, initial_covariance, as_matrix(config['process_noise']) * config['dt'],
+                      as_matrix(config['measurement_noise']), robot, map, config['joint_update'])
+    simulation = Simulation(map, robot, kf, config['dt'])
+
+    errors = []
+    nees = []
+    measurements = 0
+    start = time.perf_counter()
+    for duration, v_left, v_right in motor_script(config['seed'], config['duration']):
+        for _ in range(int(round(duration / simulation.dt))):
+            robot.set_motors(v_left, v_right)
+            simulation.step()
+            measurements += len(simulation.measurements)
+
+            error = np.array([robot.x, robot.y, robot.orientation]) - kf.state
+            error[2] = (error[2] + math.pi) % (2 * math.pi) - math.pi
+            errors.append(error)
+            nees.append(error @ np.linalg.solve(kf.covariance, error))
+    runtime = time.perf_counter() - start
+
+    errors = np.array(errors)
+    nees = np.array(nees)
+    ticks = max(simulation.ticks, 1)
+    result = dict(config)
+    result.update({
+        'position_rmse': float(np.sqrt(np.mean(errors[:, 0]**2 + errors[:, 1]**2))),
+        'heading_rmse': float(np.sqrt(np.mean(errors[:, 2]**2))),
+        'nees': float(np.mean(nees)),
+        'nees_consistent': float(np.mean((nees >= NEES_BOUNDS[0]) & (nees <= NEES_BOUNDS[1]))),
+        'measurements_per_tick': measurements / ticks,
+        'runtime': runtime,
+        'ticks_per_second': ticks / runtime,
+    })
+    return result
+
+#Every combination of the given values, e.g. grid(seed=range(10), feature_range=[100, 200])
+def grid(**values):
+    names = list(values)
+    for combination in itertools.product(*(values[name] for name in names)):
+        yield dict(zip(names, combination))
+
+#count configurations drawn uniformly from the given (low, high) ranges, diagonals are drawn per element and
+#noise ranges are sampled log-uniformly. Keys given as lists are chosen from, e.g. seed=range(10)
+def random_search(count, random_seed=None, **ranges):
+    rng = random.Random(random_seed)
+    for _ in range(count):
+        config = {}
+        for name, value in ranges.items():
+            if isinstance(value, tuple):
+                low, high = value
+                if name.endswith('noise') or name.endswith('covariance'):
+                    config[name] = [math.exp(rng.uniform(math.log(l), math.log(h))) for l, h in zip(low, high)]
+                else:
+                    config[name] = rng.uniform(low, high)
+            else:
+                config[name] = rng.choice(list(value))
+        yield config
+
+# Description: Evaluates all configurations in a process pool and writes one CSV row per run as results come in,
+# so an interrupted sweep keeps what it has finished. Returns the rows, sorted like the configurations
+def run_sweep(configs, output=None, workers=None):
+    configs = [dict(config, run=i) for i, config in enumerate(configs)]
+    columns = ['run'] + list(DEFAULT_CONFIG) + METRICS
+    rows = []
+    file = open(output, 'w', newline='') if output is not None else None
+    try:
+        if file is not None:
+            writer = csv.DictWriter(file, columns, extrasaction='ignore')
+            writer.writeheader()
+        with mp.Pool(workers) as pool:
+            for result in pool.imap_unordered(evaluate, configs):
+                rows.append(result)
+                if file is not None:
+                    writer.writerow({name: json.dumps(value) if isinstance(value, (list, tuple)) else value
+                                     for name, value in result.items()})
+                    file.flush()
+    finally:
+        if file is not None:
+            file.close()
+    return sorted(rows, key=lambda row: row['run'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Headless Kalman filter parameter sweep")
+    parser.add_argument('--output', default='sweep.csv')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seeds', type=int, default=5, help="seeds per configuration")
+    parser.add_argument('--random', type=int, default=0, help="random search with this many configurations instead of the grid")
+    parser.add_argument('--duration', type=float, default=DEFAULT_CONFIG['duration'])
+    args = parser.parse_args()
+
+    if args.random > 0:
+        configs = random_search(args.random, random_seed=0,
+                                process_noise=([0.06, 0.06, 6e-3], [60, 60, 6]),
+                                measurement_noise=([0.01, 1e-3], [10, 1]),
+                                initial_covariance=([0.01, 0.01, 1e-3], [10, 10, 1]),
+                                feature_range=(100, 300),
+                                seed=range(args.seeds))
+    else:
+        configs = grid(process_noise=[[q, q, q * np.deg2rad(30) / 1.2] for q in [0.3, 1.2, 6]],
+                       measurement_noise=[[r, np.deg2rad(5)] for r in [0.05, 0.1, 0.5]],
+                       feature_range=[150, 200, 250],
+                       seed=range(args.seeds))
+    configs = [dict(config, duration=args.duration) for config in configs]
+
+    rows = run_sweep(configs, args.output, args.workers)
+    best = min(rows, key=lambda row: row['position_rmse'])
+    print(f"{len(rows)} runs written to {args.output}, best position RMSE {best['position_rmse']:.3f} (run {best['run']})")
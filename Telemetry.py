@@ -0,0 +1,360 @@
+import argparse
+import asyncio
+import functools
+import multiprocessing as mp
+import os
+import struct
+import threading
+import time
+import numpy as np
+
+#Wire format, all little-endian. Every message is a MESSAGE_HEADER (type, payload length) followed by the payload
+#  HELLO  MAGIC, version (u16), run name (utf-8)
+#  MAP    MAP_HEADER (width, height, wall count, feature count), walls (count x 4 float32), features (count x 2 float32)
+#  BATCH  tick count (u16), then per tick a TICK_HEADER and its float32 arrays: filter state, upper triangle of
+#         the filter covariance (row by row), wall sensor distances and (distance, bearing, x, y) per detected feature
+MAGIC = b'RTEL'
+VERSION = 1
+HELLO, MAP, BATCH = 1, 2, 3
+MESSAGE_HEADER = struct.Struct('<BI')
+MAP_HEADER = struct.Struct('<ffII')
+BATCH_HEADER = struct.Struct('<H')
+#tick, time, pose (x, y, orientation), state size, covariance size, sensor count, feature count
+TICK_HEADER = struct.Struct('<IdfffHHBH')
+FLOAT = np.dtype('<f4')
+CLOSE_TIMEOUT = 1           #seconds close waits for viewers to receive the queued batches
+
+#Row and column indices of the upper triangle of a size x size matrix, row by row
+@functools.lru_cache(maxsize=None)
+def triangle(size):
+    return np.triu_indices(size)
+
+def encode_message(kind, payload):
+    return MESSAGE_HEADER.pack(kind, len(payload)) + payload
+
+def encode_hello(name):
+    return encode_message(HELLO, MAGIC + struct.pack('<H', VERSION) + name.encode())
+
+def encode_map(map):
+    walls = np.asarray(map.segments, dtype=FLOAT)
+    features = np.asarray(map.feature_coords, dtype=FLOAT)
+    return encode_message(MAP, MAP_HEADER.pack(map.width, map.height, len(walls), len(features)) + walls.tobytes() + features.tobytes())
+
+# Description: One tick of a simulation as a TICK_HEADER and its arrays. Without full_covariance only the robot block
+# of the covariance is sent, a SLAMFilter covariance grows with the square of the landmarks
+def encode_tick(simulation, full_covariance=False):
+    robot, kf = simulation.robot, simulation.kf
+    if kf is not None:
+        state = kf.state
+        covariance = kf.covariance if full_covariance else kf.covariance[:3, :3]
+    else:
+        state, covariance = np.zeros(0), np.zeros((0, 0))
+    sensors = robot.wall_sensor_distances
+    features = [(distance, bearing, feature.x, feature.y) for distance, bearing, feature in robot.detected_features]
+
+    rows, columns = triangle(len(covariance))
+    header = TICK_HEADER.pack(simulation.ticks, simulation.time, robot.x, robot.y, robot.orientation,
+                              len(state), len(covariance), len(sensors), len(features))
+    return header + np.concatenate((state, covariance[rows, columns], sensors, np.ravel(features))).astype(FLOAT).tobytes()
+
+
+class Frame:
+    # Description: One decoded tick of a telemetry stream
+
+    __slots__ = ('tick', 'time', 'pose', 'state', 'covariance', 'wall_sensor_distances', 'features')
+
+    def __init__(self, tick, time, pose, state, covariance, wall_sensor_distances, features):
+        self.tick = tick
+        self.time = time
+        self.pose = pose                                    #true (x, y, orientation)
+        self.state = state                                  #filter state
+        self.covariance = covariance                        #symmetric filter covariance, the robot block unless sent in full
+        self.wall_sensor_distances = wall_sensor_distances
+        self.features = features                            #(count, 4) distance, bearing, x, y
+
+def decode_batch(payload):
+    count, = BATCH_HEADER.unpack_from(payload)
+    offset = BATCH_HEADER.size
+    frames = []
+    for _ in range(count):
+        tick, time, x, y, orientation, state_size, covariance_size, sensor_count, feature_count = TICK_HEADER.unpack_from(payload, offset)
+        offset += TICK_HEADER.size
+        rows, columns = triangle(covariance_size)
+        covariance_end = state_size + len(rows)
+        size = covariance_end + sensor_count + 4 * feature_count
+        values = np.frombuffer(payload, FLOAT, size, offset).astype(float)
+        offset += size * FLOAT.itemsize
+
+        covariance = np.empty((covariance_size, covariance_size))
+        covariance[rows, columns] = covariance[columns, rows] = values[state_size:covariance_end]
+        sensors = values[covariance_end:covariance_end + sensor_count]
+        features = values[covariance_end + sensor_count:].reshape(-1, 4)
+        frames.append(Frame(tick, time, (x, y, orientation), values[:state_size], covariance, sensors, features))
+    return frames
+
+#(width, height, walls (N, 4), features (M, 2)) of a MAP payload
+def decode_map(payload):
+    width, height, wall_count, feature_count = MAP_HEADER.unpack_from(payload)
+    walls = np.frombuffer(payload, FLOAT, 4 * wall_count, MAP_HEADER.size).reshape(-1, 4)
+    features = np.frombuffer(payload, FLOAT, 2 * feature_count, MAP_HEADER.size + walls.nbytes).reshape(-1, 2)
+    return width, height, walls.astype(float), features.astype(float)
+
+def decode_hello(payload):
+    if payload[:4] != MAGIC:
+        raise ValueError("not a telemetry stream")
+    version, = struct.unpack_from('<H', payload, 4)
+    if version != VERSION:
+        raise ValueError("telemetry version " + str(version) + ", expected " + str(VERSION))
+    return payload[6:].decode()
+
+#Address as ('unix', path) for 'unix:path' (or 'unix://path') and ('tcp', host, port) for 'host:port' or 'tcp://host:port'
+def parse_address(address):
+    if address.startswith('unix://'):
+        return 'unix', address[len('unix://'):]
+    if address.startswith('unix:'):
+        return 'unix', address[len('unix:'):]
+    host, _, port = (address[len('tcp://'):] if address.startswith('tcp://') else address).rpartition(':')
+    if not port.isdigit():
+        raise ValueError("telemetry address " + repr(address) + " is neither host:port nor unix:path")
+    return 'tcp', host or '127.0.0.1', int(port)
+
+# Description: Reads the messages of a stream until it ends, yields (type, payload)
+async def read_messages(reader):
+    while True:
+        try:
+            header = await reader.readexactly(MESSAGE_HEADER.size)
+        except asyncio.IncompleteReadError:
+            return
+        kind, length = MESSAGE_HEADER.unpack(header)
+        yield kind, await reader.readexactly(length)
+
+async def open_stream(address):
+    address = parse_address(address)
+    if address[0] == 'unix':
+        return await asyncio.open_unix_connection(address[1])
+    return await asyncio.open_connection(address[1], address[2])
+
+
+class TelemetryConnection:
+    # Description: One viewer connected to a TelemetryServer, lives on the server's event loop
+    # Batches wait in a queue of queue_size, the sender writes them and awaits drain, so a viewer that reads slower
+    # than the simulation publishes fills its queue instead of the socket buffers. A full queue drops its oldest
+    # batch, a viewer wants the latest state, and the simulation is never held up by a viewer.
+
+    def __init__(self, writer, queue_size):
+        self.writer = writer
+        self.queue = asyncio.Queue(queue_size)
+        self.dropped = 0
+
+    def offer(self, message):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+    async def send(self):
+        while True:
+            message = await self.queue.get()
+            self.writer.write(message)
+            await self.writer.drain()
+
+
+class TelemetryServer:
+    # Description: Publishes the state of a running simulation to any number of viewers over a local TCP or Unix socket
+    # Set as Simulation.telemetry, Simulation.step calls publish every tick. Ticks are encoded in the packed format
+    # above and sent in batches of batch_size ticks (or what has accumulated after batch_interval seconds), every
+    # decimation-th tick only. The sockets are served by an asyncio event loop on a background thread, the simulation
+    # only hands it finished batches. Without viewers publish returns at once, nothing is encoded.
+    # address is 'host:port' (port 0 picks a free port, see address after start) or 'unix:path'.
+
+    def __init__(self, address='127.0.0.1:0', map=None, name='', batch_size=32, batch_interval=0.1, decimation=1,
+                 queue_size=16, full_covariance=False):
+        parse_address(address)      #raises ValueError for a malformed address before anything starts
+        self.address = address
+        self.name = name
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.decimation = decimation
+        self.queue_size = queue_size
+        self.full_covariance = full_covariance
+        self.map_message = encode_map(map) if map is not None else None
+
+        self.loop = None
+        self.thread = None
+        self.server = None
+        self.error = None           #exception that stopped the event loop thread from listening
+        self.connections = set()
+        self.tasks = set()
+
+        self.published = 0          #publish calls
+        self.pending = []           #encoded ticks of the batch being collected
+        self.batch_started = 0
+        self.batches = 0            #batches handed to the event loop
+
+    # Description: Starts the event loop thread and listens, returns the address viewers connect to
+    def start(self):
+        if self.thread is not None:
+            return self.address
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self.run_loop, args=(ready,), daemon=True)
+        self.thread.start()
+        ready.wait()
+        if self.error is not None:
+            self.thread.join()
+            self.loop.close()
+            self.thread = None
+            error, self.error = self.error, None
+            if isinstance(error, OSError):
+                raise OSError("telemetry server could not listen on " + self.address + ": " + str(error)) from error
+            raise error
+        return self.address
+
+    #Event loop thread, listens and serves until close, any error while listening is handed to start
+    def run_loop(self, ready):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.listen())
+        except BaseException as error:
+            self.server = None
+            self.error = error
+        finally:
+            ready.set()
+        if self.error is None:
+            self.loop.run_forever()
+
+    async def listen(self):
+        address = parse_address(self.address)
+        if address[0] == 'unix':
+            if os.path.exists(address[1]):
+                os.remove(address[1])
+            self.server = await asyncio.start_unix_server(self.serve, address[1])
+        else:
+            self.server = await asyncio.start_server(self.serve, address[1], address[2])
+            self.address = '%s:%d' % self.server.sockets[0].getsockname()[:2]
+
+    # Description: Serves one viewer: hello and map, then the batches until the viewer disconnects
+    async def serve(self, reader, writer):
+        connection = TelemetryConnection(writer, self.queue_size)
+        writer.write(encode_hello(self.name))
+        if self.map_message is not None:
+            writer.write(self.map_message)
+        self.connections.add(connection)
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        sender = asyncio.ensure_future(connection.send())
+        #viewers send nothing, end of file means they are gone
+        receiver = asyncio.ensure_future(reader.read())
+        try:
+            await asyncio.wait([sender, receiver], return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            sender.cancel()
+            receiver.cancel()
+            self.connections.discard(connection)
+            self.tasks.discard(task)
+            writer.close()
+
+    #Called by the simulation every tick
+    def publish(self, simulation):
+        self.published += 1
+        if not self.connections or (self.published - 1) % self.decimation != 0:
+            return
+        if not self.pending:
+            self.batch_started = time.perf_counter()
+        self.pending.append(encode_tick(simulation, self.full_covariance))
+        if len(self.pending) >= self.batch_size or time.perf_counter() - self.batch_started >= self.batch_interval:
+            self.flush()
+
+    #Hands the collected ticks to the event loop as one batch
+    def flush(self):
+        if not self.pending or self.loop is None:
+            return
+        message = encode_message(BATCH, BATCH_HEADER.pack(len(self.pending)) + b''.join(self.pending))
+        self.pending = []
+        self.batches += 1
+        self.loop.call_soon_threadsafe(self.broadcast, message)
+
+    def broadcast(self, message):
+        for connection in self.connections:
+            connection.offer(message)
+
+    #Batches dropped for slow viewers, summed over all viewers
+    @property
+    def dropped(self):
+        return sum(connection.dropped for connection in list(self.connections))
+
+    def close(self):
+        if self.thread is None:
+            return
+        self.flush()
+        asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.thread = None
+        address = parse_address(self.address)
+        if address[0] == 'unix' and os.path.exists(address[1]):
+            os.remove(address[1])
+
+    async def shutdown(self):
+        #let the senders write what is queued (a stalled viewer for at most CLOSE_TIMEOUT), then close the listener
+        #and the connections
+        deadline = time.perf_counter() + CLOSE_TIMEOUT
+        while any(not connection.queue.empty() for connection in self.connections) and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+        if self.server is not None:
+            self.server.close()
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# Description: Runs a headless simulation publishing telemetry on address, driven by a random motor script of the seed.
+# With realtime the ticks are paced to the simulated time, otherwise the simulation runs as fast as it can
+def run_publisher(address, seed, duration, realtime=True, slam=False):
+    from Simulation import Simulation
+    from Sweep import motor_script
+    simulation = Simulation.create(seed=seed, slam=slam)
+    with TelemetryServer(address, simulation.map, name='seed %d' % seed) as telemetry:
+        simulation.telemetry = telemetry
+        print("seed", seed, "publishing on", telemetry.address, flush=True)
+        start = time.perf_counter()
+        for step_duration, v_left, v_right in motor_script(seed, duration):
+            for _ in range(int(round(step_duration / simulation.dt))):
+                simulation.robot.set_motors(v_left, v_right)
+                simulation.step()
+                if realtime:
+                    time.sleep(max(simulation.time - (time.perf_counter() - start), 0))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Headless simulations publishing telemetry, follow them with Viewer.py")
+    parser.add_argument('--runs', type=int, default=4)
+    parser.add_argument('--port', type=int, default=5000, help="run i publishes on port + i")
+    parser.add_argument('--unix', help="publish on Unix sockets with this path prefix instead, run i on <prefix><i>.sock")
+    parser.add_argument('--duration', type=float, default=600, help="simulated seconds")
+    parser.add_argument('--fast', action='store_true', help="run as fast as possible instead of in real time")
+    parser.add_argument('--slam', action='store_true')
+    args = parser.parse_args()
+
+    addresses = [('unix:%s%d.sock' % (args.unix, i)) if args.unix else '127.0.0.1:%d' % (args.port + i) for i in range(args.runs)]
+    processes = [mp.Process(target=run_publisher, args=(address, i, args.duration, not args.fast, args.slam)) for i, address in enumerate(addresses)]
+    for process in processes:
+        process.start()
+    print("python Viewer.py " + " ".join(addresses), flush=True)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
@@ -0,0 +1,79 @@
+import numpy as np
+
+class Trajectory:
+    # Description: Bounded trajectory storage, a preallocated NumPy ring buffer of (x, y) points
+    # Keeps the last capacity stored points and stores only every decimation-th appended point.
+    # Behaves like the list of tuples it replaces (len, indexing, iteration) and tracks how many points were ever
+    # stored, so renderers can ask for just the points added since their last frame.
+
+    def __init__(self, point=None, capacity=100000, decimation=1):
+        self.points = np.zeros((capacity, 2))
+        self.capacity = capacity
+        self.decimation = decimation
+
+        self.appended = 0       # number of append calls, including the ones dropped by decimation
+        self.stored = 0         # number of points ever stored, the newest is at (stored - 1) % capacity
+
+        if point is not None:
+            self.append(point)
+
+    def append(self, point):
+        if self.appended % self.decimation == 0:
+            self.points[self.stored % self.capacity] = point
+            self.stored += 1
+        self.appended += 1
+
+    #Forgets all points, optionally starting again from point
+    def clear(self, point=None):
+        self.appended = 0
+        self.stored = 0
+        if point is not None:
+            self.append(point)
+
+    #Counters (appended, stored) for restore, the points themselves are not copied
+    def snapshot(self):
+        return self.appended, self.stored
+
+    #Rolls back to the counters of an earlier snapshot. Points appended since then are forgotten, once the buffer is
+    #full they have overwritten as many of the oldest points, so only short excursions restore the full history
+    #(Simulation.rollout appends to a scratch trajectory instead)
+    def restore(self, appended, stored):
+        self.appended = int(appended)
+        self.stored = int(stored)
+
+    #Empty trajectory continuing the decimation of this one, takes the appends of a look-ahead so the retained points
+    #are never overwritten
+    def scratch(self, capacity=1000):
+        trajectory = Trajectory(capacity=capacity, decimation=self.decimation)
+        trajectory.appended = self.appended
+        return trajectory
+
+    def __len__(self):
+        return min(self.stored, self.capacity)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("trajectory index out of range")
+        x, y = self.points[(self.stored - len(self) + index) % self.capacity]
+        return (float(x), float(y))
+
+    def __iter__(self):
+        return iter(map(tuple, self.array().tolist()))
+
+    #Retained points from oldest to newest as an (n, 2) array
+    def array(self):
+        return self.since(0)
+
+    #Points stored after the first total stored points that are still retained, oldest first - (n, 2) array
+    def since(self, total):
+        start = max(total, self.stored - len(self))
+        if start >= self.stored:
+            return np.zeros((0, 2))
+        first, last = start % self.capacity, (self.stored - 1) % self.capacity
+        if first <= last:
+            return self.points[first:last + 1].copy()
+        return np.concatenate((self.points[first:], self.points[:last + 1]))
@@ -0,0 +1,249 @@
+import argparse
+import asyncio
+import math
+import time
+import numpy as np
+
+from Telemetry import HELLO, MAP, BATCH, decode_hello, decode_map, decode_batch, read_messages, open_stream
+
+WHITE = (255, 255, 255)
+BLACK = (0, 0, 0)
+GREY = (160, 160, 160)
+RED = (255, 0, 0)
+BLUE = (0, 0, 255)
+GREEN = (0, 180, 0)
+
+TRAIL_LENGTH = 5000         #points kept of the true and estimated path of a run
+RECONNECT_INTERVAL = 1      #seconds between connection attempts to a run that is not up (yet)
+
+class RunView:
+    # Description: What the viewer knows about one telemetry stream, the map, the latest frame and the trails
+
+    def __init__(self, address):
+        self.address = address
+        self.name = address
+        self.connected = False
+        self.map = None                 #(width, height, walls, features) once received
+        self.background = None          #tile with the map, built when the map arrives
+        self.rate_time = time.perf_counter()
+        self.reset()
+
+    #Forgets the frames received so far, when a stream (re)starts or its ticks go back (Simulation.restore)
+    def reset(self):
+        self.frame = None               #latest Frame
+        self.trail = []                 #true positions
+        self.estimate_trail = []        #filter positions
+        self.points = 0                 #true and filter positions received, including the ones dropped from the trails
+        self.estimates = 0
+        self.drawn = (0, 0)             #points and estimates drawn onto trails
+        self.redrawn = 0                #points at the last full redraw of trails
+        self.trails = None              #copy of background the trails are drawn onto as they grow, see Viewer.draw_trails
+        self.frames = 0                 #frames received since first_tick
+        self.first_tick = None
+        self.rate = 0                   #simulated ticks per second
+        self.rate_tick = None
+
+    def receive(self, frames):
+        if self.frame is not None and frames[0].tick <= self.frame.tick:
+            self.reset()
+        if self.first_tick is None:
+            self.first_tick = frames[0].tick
+        self.frames += len(frames)
+        self.frame = frames[-1]
+        self.trail.extend(frame.pose[:2] for frame in frames)
+        estimates = [tuple(frame.state[:2]) for frame in frames if len(frame.state) >= 2]
+        self.estimate_trail.extend(estimates)
+        self.points += len(frames)
+        self.estimates += len(estimates)
+        del self.trail[:-TRAIL_LENGTH]
+        del self.estimate_trail[:-TRAIL_LENGTH]
+
+    #Fraction of the ticks since the first one that arrived, below 1 with decimation or batches dropped by the server
+    @property
+    def received(self):
+        if self.frame is None:
+            return 0
+        return self.frames / (self.frame.tick - self.first_tick + 1)
+
+    def update_rate(self, now):
+        tick = self.frame.tick if self.frame is not None else None
+        if tick is not None and self.rate_tick is not None and now > self.rate_time:
+            self.rate = (tick - self.rate_tick) / (now - self.rate_time)
+        self.rate_tick = tick
+        self.rate_time = now
+
+
+class Viewer:
+    # Description: Separate process following any number of telemetry streams (see TelemetryServer), each run in a
+    # tile of a grid. Every stream is read by its own asyncio task that only keeps the latest frame and the trails,
+    # rendering runs at fps independent of how fast the runs publish, so one viewer can follow dozens of runs. Runs
+    # that are not up yet or went down are retried every RECONNECT_INTERVAL seconds. headless prints a status line
+    # per run every second instead of opening a window.
+
+    def __init__(self, addresses, tile_size=300, fps=30, headless=False):
+        self.runs = [RunView(address) for address in addresses]
+        self.tile_size = tile_size
+        self.fps = fps
+        self.headless = headless
+        self.columns = int(math.ceil(math.sqrt(len(self.runs))))
+        self.rows = int(math.ceil(len(self.runs) / self.columns))
+        self.running = True
+
+    async def follow(self, run):
+        while self.running:
+            try:
+                reader, writer = await open_stream(run.address)
+            except OSError:
+                await asyncio.sleep(RECONNECT_INTERVAL)
+                continue
+            run.connected = True
+            try:
+                async for kind, payload in read_messages(reader):
+                    if kind == BATCH:
+                        run.receive(decode_batch(payload))
+                    elif kind == MAP:
+                        run.map = decode_map(payload)
+                        run.background = run.trails = None
+                    elif kind == HELLO:
+                        #a new stream, possibly a restarted run, its map follows
+                        run.name = decode_hello(payload) or run.address
+                        run.reset()
+                        run.map = run.background = None
+            except (OSError, asyncio.IncompleteReadError):
+                pass
+            except ValueError as error:
+                run.name = run.address + " (" + str(error) + ")"     #not a telemetry stream, or another version
+            finally:
+                run.connected = False
+                writer.close()
+            await asyncio.sleep(RECONNECT_INTERVAL)
+
+    async def main(self):
+        tasks = [asyncio.ensure_future(self.follow(run)) for run in self.runs]
+        try:
+            if self.headless:
+                await self.report()
+            else:
+                await self.render()
+        finally:
+            self.running = False
+            for task in tasks:
+                task.cancel()
+
+    def run(self):
+        try:
+            asyncio.run(self.main())
+        except KeyboardInterrupt:
+            pass
+
+    async def report(self):
+        while self.running:
+            await asyncio.sleep(1)
+            now = time.perf_counter()
+            for run in self.runs:
+                run.update_rate(now)
+                print(self.status(run), flush=True)
+
+    def status(self, run):
+        if run.frame is None:
+            return "%s  %s" % (run.name, "waiting" if run.connected else "not connected")
+        return "%s  tick %d  t %.1fs  %.0f ticks/s  received %.0f%%%s" % (
+            run.name, run.frame.tick, run.frame.time, run.rate, 100 * run.received, "" if run.connected else "  disconnected")
+
+    async def render(self):
+        import pygame
+        pygame.init()
+        self.pygame = pygame
+        screen = pygame.display.set_mode((self.columns * self.tile_size, self.rows * self.tile_size))
+        pygame.display.set_caption("Telemetry")
+        self.font = pygame.font.SysFont(None, 18)
+        rate_updated = time.perf_counter()
+        while self.running:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    self.running = False
+            now = time.perf_counter()
+            if now - rate_updated >= 1:
+                for run in self.runs:
+                    run.update_rate(now)
+                rate_updated = now
+
+            screen.fill(GREY)
+            for index, run in enumerate(self.runs):
+                origin = ((index % self.columns) * self.tile_size, (index // self.columns) * self.tile_size)
+                screen.blit(self.draw_tile(run), origin)
+            pygame.display.flip()
+            await asyncio.sleep(1 / self.fps)
+        pygame.quit()
+
+    #Map to tile pixels, y up, the map fitted into the tile
+    def transform(self, run):
+        width, height = run.map[:2] if run.map is not None else (1, 1)
+        scale = (self.tile_size - 2) / max(width, height)
+        return lambda x, y: (1 + x * scale, self.tile_size - 1 - y * scale), scale
+
+    def draw_tile(self, run):
+        pygame = self.pygame
+        to_tile, scale = self.transform(run)
+        if run.background is None:
+            run.background = pygame.Surface((self.tile_size, self.tile_size))
+            run.background.fill(WHITE)
+            if run.map is not None:
+                for x1, y1, x2, y2 in run.map[2].tolist():
+                    pygame.draw.line(run.background, BLACK, to_tile(x1, y1), to_tile(x2, y2), 1)
+                for x, y in run.map[3].tolist():
+                    pygame.draw.circle(run.background, BLACK, to_tile(x, y), 2)
+            run.trails = None
+        self.draw_trails(run, to_tile)
+        tile = run.trails.copy()
+
+        frame = run.frame
+        if frame is not None:
+            x, y, orientation = frame.pose
+            for distance, bearing, feature_x, feature_y in frame.features.tolist():
+                pygame.draw.line(tile, GREEN, to_tile(x, y), to_tile(feature_x, feature_y), 1)
+            if len(frame.state) >= 2 and len(frame.covariance) >= 2:
+                self.draw_ellipse(tile, to_tile, frame.state[:2], frame.covariance[:2, :2])
+            radius = max(20 * scale, 2)
+            center = to_tile(x, y)
+            pygame.draw.circle(tile, RED, center, radius)
+            pygame.draw.line(tile, BLACK, center, to_tile(x + 20 * math.cos(orientation), y + 20 * math.sin(orientation)), 1)
+
+        tile.blit(self.font.render(self.status(run), True, BLACK), (4, 4))
+        pygame.draw.rect(tile, GREY, tile.get_rect(), 1)
+        return tile
+
+    # Description: Draws the trail segments received since the last frame onto the persistent trails surface of the run,
+    # so a frame costs the new points rather than both full trails. The surface is drawn again from the background when
+    # the stream is reset and every TRAIL_LENGTH points, which removes the points dropped from the trails
+    def draw_trails(self, run, to_tile):
+        if run.trails is None or run.points - run.redrawn >= TRAIL_LENGTH:
+            run.trails = run.background.copy()
+            run.drawn = (run.points - len(run.trail), run.estimates - len(run.estimate_trail))
+            run.redrawn = run.points
+        for trail, total, drawn, color in ((run.trail, run.points, run.drawn[0], BLUE),
+                                           (run.estimate_trail, run.estimates, run.drawn[1], RED)):
+            #the new points, joined to the last one drawn
+            segment = trail[-(total - drawn + 1):] if total > drawn else []
+            if len(segment) > 1:
+                self.pygame.draw.lines(run.trails, color, False, [to_tile(x, y) for x, y in segment], 1)
+        run.drawn = (run.points, run.estimates)
+
+    #2 sigma position ellipse of the filter
+    def draw_ellipse(self, tile, to_tile, mean, covariance):
+        values, vectors = np.linalg.eigh(covariance)
+        angles = np.linspace(0, 2 * math.pi, 24, endpoint=False)
+        points = mean[:, np.newaxis] + 2 * (vectors * np.sqrt(np.maximum(values, 0))) @ np.vstack((np.cos(angles), np.sin(angles)))
+        points = [to_tile(px, py) for px, py in points.T.tolist()]
+        if len(points) > 2:
+            self.pygame.draw.polygon(tile, RED, points, 1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Follows telemetry streams of running simulations, see Telemetry.py")
+    parser.add_argument('addresses', nargs='+', help="host:port or unix:path of each run")
+    parser.add_argument('--tile-size', type=int, default=300)
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--headless', action='store_true', help="print the status of the runs every second instead of a window")
+    args = parser.parse_args()
+    Viewer(args.addresses, args.tile_size, args.fps, args.headless).run()
@@ -0,0 +1,26 @@
+import math
+
+from Environment import RobotEnv
+
+#Robot of a fresh environment on the default map, just inside the left boundary wall (x = 80) facing it
+def pinned_env():
+    env = RobotEnv(seed=1)
+    env.reset()
+    robot = env.robot
+    robot.x, robot.y, robot.orientation = 80 + robot.radius + 1, 400, math.pi
+    return env
+
+def test_driving_into_a_wall_terminates_with_penalty():
+    env = pinned_env()
+    for _ in range(30):
+        _, reward, terminated, truncated, _ = env.step([100, 100])
+        if terminated or truncated:
+            break
+    assert terminated
+    assert reward == -1
+
+def test_driving_away_from_a_wall_is_rewarded():
+    env = pinned_env()
+    _, reward, terminated, _, _ = env.step([-100, -100])
+    assert not terminated
+    assert reward > 0
@@ -0,0 +1,17 @@
+from Scheduler import Scheduler
+from Simulation import Simulation
+
+
+def test_controller_sets_the_motors_on_the_physics_side():
+    sim = Simulation.create(seed=1)
+    calls = []
+    def controller(simulation):
+        calls.append(simulation.ticks)
+        return 100, 100
+    scheduler = Scheduler(sim, 500, controller=controller, control_interval=10)
+
+    ticks = scheduler.advance(0.1)
+
+    assert ticks == 50
+    assert calls == [0, 10, 20, 30, 40]
+    assert scheduler.snapshot()[0].v_left == 100
@@ -0,0 +1,26 @@
+import numpy as np
+
+from Simulation import Simulation
+from Trajectory import Trajectory
+
+
+def test_rollout_keeps_the_paths_of_a_full_ring():
+    sim = Simulation.create(seed=1)
+    sim.robot.path = Trajectory((sim.robot.x, sim.robot.y), capacity=50)
+    sim.kf.path = Trajectory((sim.kf.state[0], sim.kf.state[1]), capacity=50)
+    sim.run([(100, 80)] * 120)
+    robot_path, filter_path = sim.robot.path.array(), sim.kf.path.array()
+    start = sim.snapshot()
+
+    sim.rollout([(100, 100)] * 30)
+
+    assert np.array_equal(sim.robot.path.array(), robot_path)
+    assert np.array_equal(sim.kf.path.array(), filter_path)
+    assert np.array_equal(sim.snapshot(), start)
+
+
+def test_process_noise_per_second_is_independent_of_the_tick_rate():
+    for options in ({}, {'slam': True}, {'association': 'nn'}):
+        slow = Simulation.create(seed=1, dt=1/60, **options).kf.process_noise
+        fast = Simulation.create(seed=1, dt=1/500, **options).kf.process_noise
+        assert np.allclose(slow * 60, fast * 500)
@@ -0,0 +1,20 @@
+import math
+import numpy as np
+import pytest
+
+from Simulation import Simulation
+
+
+@pytest.mark.parametrize('dt', [1/60, 1/500])
+def test_estimate_stays_consistent_while_sliding_along_a_wall(dt):
+    sim = Simulation.create(seed=1, dt=dt, slam=True)
+    robot = sim.robot
+    robot.orientation = sim.kf.state[2] = math.radians(170)     #into the left wall at a shallow angle
+    collisions = 0
+    for _ in range(int(round(4 / dt))):
+        robot.set_motors(100, 100)
+        sim.step()
+        collisions += robot.is_collision()
+        error = np.array([robot.x, robot.y]) - sim.kf.state[:2]
+        assert error @ np.linalg.solve(sim.kf.covariance[:2, :2], error) <= 3**2
+    assert collisions > 0.5 * round(4 / dt)
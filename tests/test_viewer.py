@@ -0,0 +1,59 @@
+import math
+import os
+import numpy as np
+import pytest
+
+pygame = pytest.importorskip('pygame')
+
+from Telemetry import Frame
+from Viewer import Viewer, BLUE, RED
+
+
+def frames(start, count):
+    result = []
+    for tick in range(start, start + count):
+        x, y = 400 + 300 * math.cos(tick / 50), 400 + 300 * math.sin(tick / 70)
+        result.append(Frame(tick, tick / 60, (x, y, 0.0), np.array([x + 5, y - 5, 0.0]), np.eye(3), np.zeros(12), np.zeros((0, 4))))
+    return result
+
+
+def full_trails(viewer, run, to_tile):
+    surface = run.background.copy()
+    for trail, color in ((run.trail, BLUE), (run.estimate_trail, RED)):
+        pygame.draw.lines(surface, color, False, [to_tile(x, y) for x, y in trail], 1)
+    return pygame.surfarray.array3d(surface)
+
+
+@pytest.fixture
+def viewer():
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.init()
+    viewer = Viewer(['localhost:0'])
+    viewer.pygame = pygame
+    viewer.font = pygame.font.Font(None, 18)
+    yield viewer
+    pygame.quit()
+
+
+def test_trails_drawn_per_frame_match_a_full_redraw(viewer):
+    run = viewer.runs[0]
+    run.map = (800, 800, np.zeros((0, 4)), np.zeros((0, 2)))
+    tick = 0
+    for count in (2, 1, 7, 120, 3, 64):
+        run.receive(frames(tick, count))
+        tick += count
+        viewer.draw_tile(run)
+        to_tile, scale = viewer.transform(run)
+        assert np.array_equal(pygame.surfarray.array3d(run.trails), full_trails(viewer, run, to_tile))
+
+
+def test_trails_are_redrawn_when_the_stream_restarts(viewer):
+    run = viewer.runs[0]
+    run.map = (800, 800, np.zeros((0, 4)), np.zeros((0, 2)))
+    run.receive(frames(0, 200))
+    viewer.draw_tile(run)
+    run.receive(frames(10, 50))     #ticks went back, e.g. Simulation.restore
+    viewer.draw_tile(run)
+    to_tile, scale = viewer.transform(run)
+    assert run.points == 50
+    assert np.array_equal(pygame.surfarray.array3d(run.trails), full_trails(viewer, run, to_tile))